@@ -0,0 +1,70 @@
+"""Cache LRU in memoria con limite sul numero di voci e sulla dimensione"""
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Cache LRU limitata per numero di voci e, opzionalmente, per byte stimati"""
+
+    def __init__(self, max_entries=1024, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Un valore più grande dell'intera cache non viene memorizzato
+            self.pop(key)
+            return
+        self.pop(key)
+        self._entries[key] = (value, size)
+        self.current_bytes += size
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.current_bytes > self.max_bytes
+        ):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.current_bytes -= entry[1]
+        return entry[0]
+
+    def popitem(self):
+        """Rimuove e restituisce (chiave, valore) della voce usata meno di recente"""
+        key, (value, size) = self._entries.popitem(last=False)
+        self.current_bytes -= size
+        return key, value
+
+    def invalidate(self, predicate):
+        """Rimuove tutte le voci la cui chiave soddisfa il predicato"""
+        for key in [key for key in self._entries if predicate(key)]:
+            self.pop(key)
+
+    def values(self):
+        return [value for value, _ in self._entries.values()]
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
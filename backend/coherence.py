@@ -0,0 +1,190 @@
+"""Bus di coerenza delle cache locali tra worker e nodi
+
+Le cache in-process (elenchi di directory, path delle sessioni del terminale)
+sono invalidate dal worker che esegue la modifica. Il bus pubblica ogni
+invalidazione perché anche gli altri worker, sullo stesso nodo o su nodi
+diversi, eliminino le stesse voci.
+
+Con MongoDB gli eventi vengono scritti in una collection capped e ogni worker
+la segue con un cursore tailable, che funziona anche su un mongod standalone
+(a differenza dei change stream). Se il cursore si interrompe per un errore
+alcuni eventi possono essere andati persi: il worker svuota allora le proprie
+cache. Con il motore embedded c'è un solo processo e si usa LocalBus, che
+consegna gli eventi agli altri bus dello stesso processo (utile nei test).
+
+Gli eventi arrivano con un ritardo: un altro worker può avere ancora in corso
+la lettura dal database della directory invalidata. Per questo l'evento non
+si limita a eliminare la voce ma fa avanzare la generazione delle cache, e la
+lettura in corso non viene memorizzata (vedi listing_cache.py).
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from database import STORAGE_BACKEND, db
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+COHERENCE_BUS = os.environ.get("COHERENCE_BUS", "mongo" if STORAGE_BACKEND == "mongo" else "local")
+COHERENCE_COLLECTION = "cache_invalidations"
+COHERENCE_CAPPED_BYTES = int(os.environ.get("COHERENCE_CAPPED_BYTES", str(16 * 1024 * 1024)))
+# Eventi in attesa di scrittura oltre i quali si pubblica un reset completo
+COHERENCE_MAX_PENDING = 10000
+# Alla (ri)apertura del cursore si rileggono gli eventi di questo intervallo (skew tra i nodi)
+COHERENCE_RESUME_MARGIN_SECONDS = 5.0
+COHERENCE_RETRY_SECONDS = 1.0
+# _id degli eventi già applicati, per ignorare quelli riletti dopo una riapertura
+_SEEN_EVENTS = 4096
+
+coherence_events_total = registry.counter(
+    "futureos_coherence_events_total",
+    "Eventi di invalidazione pubblicati e ricevuti dal bus di coerenza",
+    ("direction",),
+)
+coherence_resets_total = registry.counter(
+    "futureos_coherence_resets_total",
+    "Svuotamenti completi delle cache locali per eventi del bus persi",
+)
+
+RESET_EVENT = {"kind": "reset"}
+
+
+class LocalBus:
+    """Bus in-process: consegna gli eventi agli altri bus creati sullo stesso hub"""
+
+    def __init__(self, hub=None):
+        self.origin = uuid.uuid4().hex
+        self._hub = hub if hub is not None else []
+        self._apply = None
+
+    async def start(self, apply):
+        self._apply = apply
+        self._hub.append(self)
+
+    async def stop(self):
+        if self in self._hub:
+            self._hub.remove(self)
+        self._apply = None
+
+    def publish(self, event):
+        coherence_events_total.inc(direction="published")
+        for bus in list(self._hub):
+            if bus is not self and bus._apply is not None:
+                coherence_events_total.inc(direction="received")
+                bus._apply(dict(event))
+
+
+class MongoBus:
+    """Bus su collection capped seguita con un cursore tailable"""
+
+    def __init__(self, database, name=COHERENCE_COLLECTION, size=COHERENCE_CAPPED_BYTES):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._database = database
+        self._collection = database[name]
+        self._size = size
+        self._apply = None
+        self._pending = []
+        self._wakeup = None
+        self._tasks = []
+        self._seen = deque(maxlen=_SEEN_EVENTS)
+        self._seen_set = set()
+
+    async def _ensure_collection(self):
+        try:
+            await self._database.create_collection(self._collection.name, capped=True, size=self._size)
+        except CollectionInvalid:
+            pass
+
+    async def start(self, apply):
+        if self._tasks:
+            return
+        await self._ensure_collection()
+        self._apply = apply
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._flush()), asyncio.create_task(self._tail())]
+        logger.info(f"Bus di coerenza delle cache attivo ({self._collection.name})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pending:
+            # Ultimo tentativo di consegnare le invalidazioni prima dell'arresto
+            try:
+                await self._collection.insert_many(self._pending)
+            except Exception:
+                logger.exception("Invalidazioni non pubblicate all'arresto")
+            self._pending = []
+
+    def publish(self, event):
+        """Accoda l'evento; la scrittura avviene in un task separato, a lotti"""
+        if not self._tasks:
+            return
+        if len(self._pending) >= COHERENCE_MAX_PENDING:
+            # Gli altri worker ricevono un unico reset al posto degli eventi accumulati
+            self._pending = [dict(RESET_EVENT)]
+        self._pending.append(dict(event))
+        coherence_events_total.inc(direction="published")
+        self._wakeup.set()
+
+    async def _flush(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                continue
+            now = datetime.utcnow()
+            for event in batch:
+                event["origin"] = self.origin
+                event["at"] = now
+            try:
+                await self._collection.insert_many(batch)
+            except Exception:
+                logger.exception("Pubblicazione delle invalidazioni fallita, nuovo tentativo")
+                self._pending = batch + self._pending
+                await asyncio.sleep(COHERENCE_RETRY_SECONDS)
+                self._wakeup.set()
+
+    def _receive(self, event):
+        if event["_id"] in self._seen_set:
+            return
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_set.discard(self._seen[0])
+        self._seen.append(event["_id"])
+        self._seen_set.add(event["_id"])
+        if event.get("origin") == self.origin:
+            return
+        coherence_events_total.inc(direction="received")
+        self._apply(event)
+
+    async def _tail(self):
+        resume_at = datetime.utcnow()
+        while True:
+            since = resume_at - timedelta(seconds=COHERENCE_RESUME_MARGIN_SECONDS)
+            try:
+                cursor = self._collection.find(
+                    {"at": {"$gte": since}}, cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    async for event in cursor:
+                        resume_at = max(resume_at, event["at"])
+                        self._receive(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Il cursore può aver perso la sua posizione: le cache locali non sono più affidabili
+                logger.exception("Cursore del bus di coerenza interrotto, svuoto le cache locali")
+                coherence_resets_total.inc()
+                self._apply(dict(RESET_EVENT))
+            # Un cursore tailable su una collection vuota si chiude subito
+            await asyncio.sleep(COHERENCE_RETRY_SECONDS)
+
+
+coherence_bus = MongoBus(db) if COHERENCE_BUS == "mongo" else LocalBus()
@@ -0,0 +1,144 @@
+"""Compressione gzip/brotli delle risposte HTTP
+
+Middleware ASGI che comprime le risposte testuali sopra una soglia di
+dimensione, scegliendo la codifica in base ad Accept-Encoding. Le risposte in
+streaming (più messaggi di body) vengono inoltrate senza modifiche.
+"""
+import gzip
+import os
+from starlette.datastructures import Headers, MutableHeaders
+from offload import run_buffer
+
+try:
+    import brotli
+except ImportError:  # brotli è opzionale: senza, si usa solo gzip
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+# Sopra questa dimensione la compressione gira nel pool di thread (zlib e brotli rilasciano il GIL)
+COMPRESSION_OFFLOAD_MIN_SIZE = int(os.environ.get("COMPRESSION_OFFLOAD_MIN_SIZE", str(256 * 1024)))
+
+
+def negotiate_encoding(accept_encoding):
+    """Sceglie la codifica migliore tra quelle accettate dal client"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+
+def _is_compressible(content_type):
+    return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+def _encoded_etag(etag, encoding):
+    """ETag della rappresentazione compressa, o None per gli ETag deboli"""
+    if etag and etag.endswith('"') and not etag.startswith("W/"):
+        return f'{etag[:-1]}-{encoding}"'
+    return None
+
+
+def _revalidated_etag(etag, encoding, if_none_match):
+    """ETag da inviare con un 304: quello della codifica che il client ha in cache"""
+    encoded = _encoded_etag(etag, encoding)
+    if encoded is None:
+        return etag
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return encoded if encoded in candidates else etag
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                if message["status"] == 304:
+                    # Il 304 porta il validatore della rappresentazione compressa
+                    # se è quella che il client ha ricevuto con il 200
+                    headers = MutableHeaders(raw=message["headers"])
+                    etag = headers.get("etag")
+                    if etag:
+                        headers["ETag"] = _revalidated_etag(
+                            etag, encoding, request_headers.get("if-none-match", "")
+                        )
+                    await send(message)
+                    return
+                # Attende il primo body per decidere se comprimere
+                start_message = message
+                return
+
+            if message["type"] == "http.response.body" and start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(raw=start["headers"])
+                body = message.get("body", b"")
+                compressible = _is_compressible(headers.get("content-type", ""))
+                if compressible:
+                    headers.add_vary_header("Accept-Encoding")
+
+                if (
+                    not compressible
+                    or message.get("more_body", False)
+                    or "content-encoding" in headers
+                    or len(body) < self.minimum_size
+                ):
+                    await send(start)
+                    await send(message)
+                    return
+
+                compressed = await run_buffer(
+                    compress, body, encoding,
+                    threshold=COMPRESSION_OFFLOAD_MIN_SIZE, task="compression"
+                )
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(compressed))
+                # Un ETag forte deve distinguere le diverse codifiche della risorsa
+                encoded_etag = _encoded_etag(headers.get("etag"), encoding)
+                if encoded_etag is not None:
+                    headers["ETag"] = encoded_etag
+                await send(start)
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,134 @@
+"""Compressione at-rest dei contenuti di file e note
+
+I contenuti sopra CONTENT_COMPRESSION_MIN_BYTES vengono salvati compressi
+(zstd se il pacchetto zstandard è installato, altrimenti zlib) come dato
+binario, con il codec indicato nel campo content_codec. La decompressione
+avviene solo quando il contenuto viene effettivamente restituito: elenchi e
+cache conservano il documento compresso.
+
+Se è attivo l'archivio locale (content_store.py), i contenuti più grandi
+finiscono nei file segmento e il documento conserva solo content_ref.
+"""
+import os
+import zlib
+from bson import Binary
+from content_store import CONTENT_STORE_MIN_BYTES, REF_FIELD, content_store
+from offload import buffer_pool, offload_inline_total
+
+try:
+    import zstandard
+except ImportError:  # zstandard è opzionale: senza, si usa zlib
+    zstandard = None
+
+CODEC_FIELD = "content_codec"
+# Campi interni di memorizzazione, mai restituiti dalle API
+_STORAGE_FIELDS = (CODEC_FIELD, REF_FIELD)
+CONTENT_CODEC = os.environ.get("CONTENT_CODEC", "zstd" if zstandard is not None else "zlib")
+CONTENT_COMPRESSION_MIN_BYTES = int(os.environ.get("CONTENT_COMPRESSION_MIN_BYTES", "4096"))
+# Se la compressione non risparmia almeno il 10% il contenuto resta in chiaro
+_MIN_SAVING_RATIO = 0.9
+# Byte memorizzati oltre i quali decode_documents decomprime nel pool di thread
+DECODE_OFFLOAD_MIN_BYTES = int(os.environ.get("DECODE_OFFLOAD_MIN_BYTES", str(64 * 1024)))
+
+
+def _compress(codec, data):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, 6)
+    raise ValueError(f"Codec di compressione sconosciuto: {codec}")
+
+
+def _decompress(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Contenuto compresso con zstd ma il pacchetto zstandard non è installato")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Codec di compressione sconosciuto: {codec}")
+
+
+async def encode_content(content):
+    """Campi da salvare per il contenuto: nell'archivio locale, compresso o in chiaro
+
+    La scrittura nel segmento dell'archivio locale gira nel pool di thread,
+    fuori dall'event loop.
+    """
+    if content_store is not None and content is not None and len(content) * 4 >= CONTENT_STORE_MIN_BYTES:
+        data = content.encode("utf-8")
+        if len(data) >= CONTENT_STORE_MIN_BYTES:
+            ref = await buffer_pool.submit(content_store.put, data, task="content_put")
+            return {"content": None, CODEC_FIELD: None, REF_FIELD: ref}
+    fields = _encode_inline(content)
+    if content_store is not None:
+        # Azzera un eventuale riferimento precedente all'archivio locale
+        fields[REF_FIELD] = None
+    return fields
+
+
+def _encode_inline(content):
+    if content is None or CONTENT_CODEC == "none":
+        return {"content": content, CODEC_FIELD: None}
+    data = content.encode("utf-8")
+    if len(data) < CONTENT_COMPRESSION_MIN_BYTES:
+        return {"content": content, CODEC_FIELD: None}
+    compressed = _compress(CONTENT_CODEC, data)
+    if len(compressed) > len(data) * _MIN_SAVING_RATIO:
+        return {"content": content, CODEC_FIELD: None}
+    return {"content": Binary(compressed), CODEC_FIELD: CONTENT_CODEC}
+
+
+def decode_content(content, codec, ref=None):
+    if ref:
+        if content_store is None:
+            raise RuntimeError("Contenuto nell'archivio locale ma CONTENT_STORE_DIR non è configurata")
+        return content_store.read_text(ref)
+    if not codec or content is None:
+        return content
+    return _decompress(codec, bytes(content)).decode("utf-8")
+
+
+def decoded(document):
+    """Documento con il contenuto in chiaro (una copia se era compresso)
+
+    Il documento originale non viene modificato, così le cache possono
+    continuare a tenerlo compresso.
+    """
+    codec = document.get(CODEC_FIELD)
+    ref = document.get(REF_FIELD)
+    if not codec and not ref:
+        if CODEC_FIELD in document or REF_FIELD in document:
+            document = {key: value for key, value in document.items() if key not in _STORAGE_FIELDS}
+        return document
+    result = {key: value for key, value in document.items() if key not in _STORAGE_FIELDS}
+    result["content"] = decode_content(document.get("content"), codec, ref)
+    return result
+
+
+def _stored_size(document):
+    """Byte da leggere o decomprimere per restituire il contenuto in chiaro"""
+    if document.get(REF_FIELD):
+        # Nell'archivio locale finiscono solo i contenuti sopra la sua soglia
+        return CONTENT_STORE_MIN_BYTES
+    if document.get(CODEC_FIELD) and document.get("content") is not None:
+        return len(document["content"])
+    return 0
+
+
+def _decode_all(documents):
+    return [decoded(document) for document in documents]
+
+
+async def decode_documents(documents):
+    """decoded() su una lista di documenti, nel pool di thread se i contenuti sono grandi
+
+    Sotto DECODE_OFFLOAD_MIN_BYTES complessivi la decompressione gira inline,
+    perché il passaggio al pool costerebbe più del lavoro stesso.
+    """
+    size = sum(_stored_size(document) for document in documents)
+    if size < DECODE_OFFLOAD_MIN_BYTES:
+        if size:
+            offload_inline_total.inc(task="content_decode")
+        return _decode_all(documents)
+    return await buffer_pool.submit(_decode_all, documents, task="content_decode")
@@ -0,0 +1,218 @@
+"""Archivio locale dei contenuti grandi in file segmento letti tramite mmap
+
+Opzionale, per installazioni a nodo singolo: si attiva con CONTENT_STORE_DIR.
+I contenuti sopra CONTENT_STORE_MIN_BYTES vengono accodati a file segmento
+append-only e il documento MongoDB conserva solo il riferimento (segmento,
+offset, lunghezza). Le letture restituiscono slice memoryview della mappa del
+segmento, senza copie: il download le invia così come sono alla risposta.
+
+Ogni processo scrive solo nei propri segmenti (il nome include il pid e un
+identificativo del processo), quindi più worker sullo stesso nodo non si
+contendono i file. Quando un segmento è pieno, o alla chiusura del processo,
+chi lo scriveva lo chiude creando accanto il marcatore <segmento>.closed: la
+compattazione (eseguita da un solo processo) considera solo i segmenti chiusi
+e quelli di processi non più attivi, mai un segmento in cui un altro worker
+sta ancora scrivendo. Riscrive i record ancora referenziati dei segmenti con
+molto spazio libero; i segmenti svuotati vengono eliminati al passaggio
+successivo, per non interrompere le letture in corso.
+
+Le mappe dei segmenti sono tenute in una LRU limitata e rilasciate quando il
+segmento viene ritirato o eliminato (anche da un altro processo): una mappa
+aperta impedirebbe di liberare lo spazio su disco del file eliminato.
+"""
+import logging
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+CONTENT_STORE_DIR = os.environ.get("CONTENT_STORE_DIR")
+CONTENT_STORE_MIN_BYTES = int(os.environ.get("CONTENT_STORE_MIN_BYTES", str(64 * 1024)))
+SEGMENT_MAX_BYTES = int(os.environ.get("CONTENT_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+CONTENT_STORE_FSYNC = os.environ.get("CONTENT_STORE_FSYNC", "0") == "1"
+# Un segmento viene compattato solo se inattivo da questo tempo e con meno della metà di dati vivi
+SEGMENT_IDLE_SECONDS = float(os.environ.get("CONTENT_SEGMENT_IDLE_SECONDS", "600"))
+COMPACTION_LIVE_RATIO = 0.5
+# Segmenti mappati contemporaneamente da ciascun processo
+CONTENT_STORE_MAX_MAPS = int(os.environ.get("CONTENT_STORE_MAX_MAPS", "256"))
+
+REF_FIELD = "content_ref"
+SEGMENT_SUFFIX = ".seg"
+CLOSED_SUFFIX = ".closed"
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Il processo esiste ma appartiene a un altro utente
+        return True
+    return True
+
+
+class ContentStore:
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES, max_maps=CONTENT_STORE_MAX_MAPS):
+        self.directory = Path(directory)
+        if not self.directory.is_absolute():
+            self.directory = ROOT_DIR / self.directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self.writer_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._sequence = 0
+        self._active = None
+        self._active_fd = None
+        self._active_size = 0
+        self.max_maps = max_maps
+        self._maps = OrderedDict()
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _path(self, segment, suffix=SEGMENT_SUFFIX):
+        return self.directory / f"{segment}{suffix}"
+
+    def _close_active(self):
+        if self._active_fd is None:
+            return
+        os.close(self._active_fd)
+        # Da qui il segmento non riceve altre scritture e può essere compattato
+        self._path(self._active, CLOSED_SUFFIX).touch()
+        self._active_fd = None
+        self._active = None
+
+    def close(self):
+        """Chiude il segmento attivo (alla chiusura del processo)"""
+        with self._lock:
+            self._close_active()
+
+    def _roll(self):
+        self._close_active()
+        self._sequence += 1
+        self._active = f"{self.writer_id}-{self._sequence:06d}"
+        self._active_fd = os.open(self._path(self._active), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._active_size = 0
+
+    def put(self, data):
+        """Accoda i byte al segmento attivo e restituisce il riferimento"""
+        with self._lock:
+            if (
+                self._active_fd is None
+                or self._active_size + len(data) > self.segment_max_bytes
+                # Il segmento attivo è stato compattato ed eliminato da un altro processo
+                or os.fstat(self._active_fd).st_nlink == 0
+            ):
+                self._roll()
+            offset = self._active_size
+            view = memoryview(data)
+            while view:
+                written = os.write(self._active_fd, view)
+                view = view[written:]
+            if CONTENT_STORE_FSYNC:
+                os.fsync(self._active_fd)
+            self._active_size += len(data)
+            return {"segment": self._active, "offset": offset, "length": len(data)}
+
+    def _map(self, segment, end):
+        current = self._maps.get(segment)
+        if current is None or len(current) < end:
+            # Il segmento è cresciuto: la mappa precedente resta valida per chi la usa ancora
+            with open(self._path(segment), "rb") as segment_file:
+                current = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = current
+            if len(self._maps) > self.max_maps:
+                # Le slice già restituite tengono viva la mappa finché servono
+                self._maps.popitem(last=False)
+        self._maps.move_to_end(segment)
+        return current
+
+    def view(self, ref):
+        """Slice memoryview del contenuto, senza copie"""
+        end = ref["offset"] + ref["length"]
+        with self._lock:
+            segment_map = self._map(ref["segment"], end)
+        return memoryview(segment_map)[ref["offset"]:end]
+
+    def read_text(self, ref):
+        return str(self.view(ref), "utf-8")
+
+    def segments(self):
+        """Segmenti presenti su disco con dimensione e ultimo aggiornamento"""
+        result = {}
+        for path in self.directory.glob(f"*{SEGMENT_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            result[path.name[:-len(SEGMENT_SUFFIX)]] = (stat.st_size, stat.st_mtime)
+        return result
+
+    def is_closed(self, segment):
+        """Vero se nessun processo scriverà più nel segmento"""
+        if segment == self._active:
+            return False
+        if self._path(segment, CLOSED_SUFFIX).exists():
+            return True
+        # Segmento di un processo terminato senza chiuderlo (il nome inizia con il pid)
+        pid = segment.split("-", 1)[0]
+        return pid.isdigit() and not _process_alive(int(pid))
+
+    def compaction_candidates(self, live_bytes):
+        """Segmenti chiusi e inattivi con meno di COMPACTION_LIVE_RATIO di dati ancora referenziati"""
+        now = time.time()
+        candidates = []
+        for segment, (size, modified) in self.segments().items():
+            if segment in self._retired or not self.is_closed(segment):
+                continue
+            if now - modified < SEGMENT_IDLE_SECONDS:
+                continue
+            if live_bytes.get(segment, 0) < size * COMPACTION_LIVE_RATIO:
+                candidates.append(segment)
+        return candidates
+
+    def copy_records(self, refs):
+        """Copia i record nel segmento attivo e restituisce i nuovi riferimenti, nello stesso ordine"""
+        return [self.put(self.view(ref)) for ref in refs]
+
+    def retire(self, segment):
+        with self._lock:
+            # Le mappe ancora in uso restano valide anche dopo l'eliminazione del file
+            self._maps.pop(segment, None)
+        self._retired[segment] = time.time()
+
+    def delete_retired(self):
+        """Elimina i segmenti ritirati in un passaggio precedente"""
+        removed = 0
+        for segment in list(self._retired):
+            with self._lock:
+                self._maps.pop(segment, None)
+            try:
+                self._path(segment).unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+            self._path(segment, CLOSED_SUFFIX).unlink(missing_ok=True)
+            del self._retired[segment]
+        return removed
+
+    def release_missing(self):
+        """Rilascia le mappe dei segmenti eliminati da un altro processo"""
+        with self._lock:
+            segments = list(self._maps)
+        missing = [segment for segment in segments if not self._path(segment).exists()]
+        with self._lock:
+            for segment in missing:
+                self._maps.pop(segment, None)
+        return len(missing)
+
+
+content_store = ContentStore(CONTENT_STORE_DIR) if CONTENT_STORE_DIR else None
@@ -1,21 +1,104 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import sys
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
+from metrics import MongoCommandListener, MongoPoolListener
+from diagnostics import SlowQueryListener, slow_queries
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+logger = logging.getLogger(__name__)
+
+# Backend di storage: "mongo" (default), "memory" o "sqlite" (motore embedded, vedi embedded_store.py)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo")
+
+def requested_workers(argv=None, environ=None):
+    """Worker del server richiesti con --workers/-w o WEB_CONCURRENCY
+
+    I worker uvicorn e gunicorn ricevono la riga di comando del processo
+    principale, quindi ognuno vede lo stesso valore.
+    """
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    workers = int(environ.get("WEB_CONCURRENCY") or 1)
+    for index, arg in enumerate(argv):
+        if arg in ("--workers", "-w") and index + 1 < len(argv):
+            value = argv[index + 1]
+        elif arg.startswith("--workers="):
+            value = arg.split("=", 1)[1]
+        else:
+            continue
+        if value.isdigit():
+            workers = int(value)
+    return workers
+
+if STORAGE_BACKEND in ("memory", "sqlite"):
+    from embedded_store import EmbeddedClient
+    # I dati embedded sono locali al processo: con più worker ognuno avrebbe i propri
+    if requested_workers() > 1:
+        raise ValueError(f"STORAGE_BACKEND={STORAGE_BACKEND} supporta un solo worker")
+    storage_path = None
+    if STORAGE_BACKEND == "sqlite":
+        storage_path = os.environ.get("STORAGE_PATH", str(ROOT_DIR / "futureos.db"))
+    client = EmbeddedClient(storage_path)
+    db = client[os.environ.get('DB_NAME', 'futureos')]
+    # Lo storage embedded non ha sessioni: run_transaction esegue le callback senza transazione
+    SESSIONS_SUPPORTED = False
+elif STORAGE_BACKEND == "mongo":
+    # MongoDB connection
+    mongo_url = os.environ['MONGO_URL']
+    event_listeners = [MongoCommandListener(), MongoPoolListener()]
+    if slow_queries is not None:
+        event_listeners.append(SlowQueryListener(slow_queries))
+    client = AsyncIOMotorClient(mongo_url, event_listeners=event_listeners)
+    db = client[os.environ['DB_NAME']]
+    # Un mongod standalone le rifiuta comunque: lo rileva run_transaction al primo tentativo
+    SESSIONS_SUPPORTED = True
+else:
+    raise ValueError(f"STORAGE_BACKEND non valido: {STORAGE_BACKEND}")
 
 # Collections
 user_settings_collection = db.user_settings
 filesystem_collection = db.filesystem
 terminal_history_collection = db.terminal_history
 notepad_files_collection = db.notepad_files
+rate_limits_collection = db.rate_limits
+scheduler_leases_collection = db.scheduler_leases
+jobs_collection = db.jobs
+system_samples_collection = db.system_samples
+
+# I job terminati vengono rimossi dall'indice TTL dopo questo tempo
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+async def ensure_indexes():
+    """Crea gli indici usati dalle query delle routes"""
+    try:
+        # path come primo campo: serve anche al $lookup dello scavenger dei nodi orfani
+        await filesystem_collection.create_index([("path", 1), ("user_id", 1)], unique=True)
+    except Exception as e:
+        # Path duplicati già presenti: l'indice resta comunque utile per le ricerche
+        logger.warning(f"Indice univoco sui path non creato ({e}), uso un indice semplice")
+        await filesystem_collection.create_index([("path", 1), ("user_id", 1)])
+    await filesystem_collection.create_index([("user_id", 1), ("parent_path", 1)])
+    # Completamento dei nomi per prefisso all'interno di una directory
+    await filesystem_collection.create_index([("user_id", 1), ("parent_path", 1), ("name", 1)])
+    await terminal_history_collection.create_index([("user_id", 1), ("timestamp", 1)])
+    # Ricerca per prefisso del comando (regex ancorata) nella cronologia
+    await terminal_history_collection.create_index([("user_id", 1), ("command", 1), ("timestamp", -1)])
+    await notepad_files_collection.create_index([("user_id", 1), ("name", 1)])
+    await notepad_files_collection.create_index([("user_id", 1), ("modified_at", -1)])
+    # Radici nel cestino: l'indice parziale contiene solo i nodi eliminati
+    await filesystem_collection.create_index(
+        [("user_id", 1), ("trashed_at", -1)],
+        partialFilterExpression={"trashed_at": {"$exists": True}}
+    )
+    # Coda dei job (reclamo del più vecchio in attesa) ed elenco per utente
+    await jobs_collection.create_index([("status", 1), ("created_at", 1)])
+    await jobs_collection.create_index([("user_id", 1), ("created_at", -1)])
+    await jobs_collection.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
 
 async def init_default_data():
     """Inizializza i dati di default se non esistono"""
@@ -0,0 +1,239 @@
+"""Diagnostica delle query MongoDB: slow-query log e cattura degli explain
+
+Il livello è opzionale e si attiva impostando MONGO_SLOW_QUERY_MS: ogni
+comando che supera la soglia viene registrato nel log con collection e
+filtro, e raggruppato per "forma" della query. Periodicamente vengono
+catturati i piani di explain() delle forme più lente, segnalando i COLLSCAN.
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from bson import json_util
+from dotenv import load_dotenv
+from pymongo import monitoring
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = os.environ.get("MONGO_SLOW_QUERY_MS")
+EXPLAIN_INTERVAL_SECONDS = float(os.environ.get("MONGO_EXPLAIN_INTERVAL", "300"))
+EXPLAIN_TOP_SHAPES = 5
+MAX_SHAPES = 200
+
+# Comandi per cui MongoDB supporta explain
+EXPLAINABLE_COMMANDS = ("find", "aggregate", "count", "distinct", "delete", "update", "findAndModify")
+
+# Campi di sessione/transazione da togliere prima di rilanciare il comando in explain
+_SESSION_FIELDS = (
+    "lsid", "$db", "$clusterTime", "txnNumber", "startTransaction", "autocommit",
+    "$readPreference", "readConcern", "writeConcern",
+)
+
+
+def _to_json(value):
+    """Converte un documento BSON in una struttura serializzabile in JSON"""
+    return json.loads(json_util.dumps(value))
+
+
+def extract_filter(command_name, command):
+    """Restituisce il filtro (o la pipeline) di un comando MongoDB"""
+    if command_name in ("find", "distinct"):
+        return command.get("filter") or command.get("query") or {}
+    if command_name in ("count", "findAndModify"):
+        return command.get("query") or {}
+    if command_name == "aggregate":
+        return command.get("pipeline") or []
+    if command_name == "delete":
+        deletes = command.get("deletes") or [{}]
+        return deletes[0].get("q", {})
+    if command_name == "update":
+        updates = command.get("updates") or [{}]
+        return updates[0].get("q", {})
+    return {}
+
+
+def explain_command(command_name, command):
+    """Prepara il comando da passare a explain
+
+    Un update o un delete può contenere molti statement, ma explain ne accetta
+    uno solo: si spiega il primo, lo stesso da cui viene la forma.
+    """
+    statements = {"update": "updates", "delete": "deletes"}.get(command_name)
+    if statements and len(command.get(statements) or ()) > 1:
+        return {**command, statements: command[statements][:1]}
+    return command
+
+
+def query_shape(value):
+    """Sostituisce i valori di un filtro con il loro tipo, mantenendo gli operatori"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Le liste di valori ($in, $nin...) hanno la stessa forma a prescindere dalla lunghezza
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return type(value).__name__
+
+
+def _plan_stages(plan, stages):
+    """Raccoglie gli stage del piano vincente ignorando i piani scartati"""
+    if isinstance(plan, dict):
+        stage = plan.get("stage")
+        if isinstance(stage, str):
+            stages.append(stage)
+        for key, value in plan.items():
+            if key != "rejectedPlans":
+                _plan_stages(value, stages)
+    elif isinstance(plan, list):
+        for item in plan:
+            _plan_stages(item, stages)
+    return stages
+
+
+class SlowQueryRecorder:
+    """Raggruppa le query lente per forma e ne conserva un campione"""
+
+    def __init__(self, threshold_ms, max_shapes=MAX_SHAPES):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def record(self, database, collection, command_name, command, duration_ms):
+        query_filter = extract_filter(command_name, command)
+        shape = query_shape(query_filter)
+        key = (collection, command_name, json.dumps(shape, sort_keys=True))
+        sample = {
+            name: value for name, value in command.items()
+            if name not in _SESSION_FIELDS
+        }
+
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    # Scarta la forma meno costosa per mantenere la memoria limitata
+                    cheapest = min(self._shapes, key=lambda k: self._shapes[k]["max_ms"])
+                    del self._shapes[cheapest]
+                entry = self._shapes[key] = {
+                    "database": database,
+                    "collection": collection,
+                    "command": command_name,
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "sample": sample,
+                    "plan": None,
+                    "collscan": None,
+                    "explained_at": None,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            if duration_ms >= entry["max_ms"]:
+                entry["max_ms"] = duration_ms
+                entry["sample"] = sample
+
+        logger.warning(
+            "Query lenta su %s.%s (%.1f ms): %s",
+            collection, command_name, duration_ms, json_util.dumps(query_filter)
+        )
+
+    def slowest(self, limit=None):
+        with self._lock:
+            entries = sorted(self._shapes.values(), key=lambda e: e["max_ms"], reverse=True)
+        return entries[:limit] if limit else entries
+
+    def report(self):
+        """Restituisce le forme registrate in un formato serializzabile"""
+        result = []
+        for entry in self.slowest():
+            result.append({
+                "collection": entry["collection"],
+                "command": entry["command"],
+                "shape": entry["shape"],
+                "count": entry["count"],
+                "total_ms": round(entry["total_ms"], 3),
+                "avg_ms": round(entry["total_ms"] / entry["count"], 3),
+                "max_ms": round(entry["max_ms"], 3),
+                "sample_filter": _to_json(extract_filter(entry["command"], entry["sample"])),
+                "plan": entry["plan"],
+                "collscan": entry["collscan"],
+                "explained_at": entry["explained_at"],
+            })
+        return result
+
+    async def capture_explain_plans(self, client, top=EXPLAIN_TOP_SHAPES):
+        """Esegue explain() sulle forme più lente e registra gli stage del piano"""
+        for entry in self.slowest(top):
+            if entry["command"] not in EXPLAINABLE_COMMANDS:
+                continue
+            command = explain_command(entry["command"], entry["sample"])
+            try:
+                explain = await client[entry["database"]].command(
+                    {"explain": command, "verbosity": "queryPlanner"}
+                )
+            except Exception as e:
+                logger.warning("Explain fallito per %s.%s: %s", entry["collection"], entry["command"], e)
+                continue
+
+            stages = _plan_stages(explain.get("queryPlanner", explain), [])
+            with self._lock:
+                entry["plan"] = stages
+                entry["collscan"] = "COLLSCAN" in stages
+                entry["explained_at"] = datetime.utcnow().isoformat()
+            if entry["collscan"]:
+                logger.warning(
+                    "COLLSCAN su %s.%s con filtro %s",
+                    entry["collection"], entry["command"], json.dumps(entry["shape"])
+                )
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Listener pymongo che segnala i comandi sopra soglia"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        # Gli explain lanciati dalla diagnostica non vanno registrati di nuovo
+        if event.command_name == "explain":
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                event.database_name, collection, event.command
+            )
+
+    def _finish(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms >= self.recorder.threshold_ms:
+            database, collection, command = pending
+            self.recorder.record(database, collection, event.command_name, command, duration_ms)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+# Attivo solo se la soglia è configurata
+slow_queries = SlowQueryRecorder(float(SLOW_QUERY_MS)) if SLOW_QUERY_MS else None
@@ -0,0 +1,1237 @@
+"""Storage embedded compatibile con il sottoinsieme di Motor usato dall'app
+
+Con STORAGE_BACKEND=memory (o sqlite) database.py usa questo motore al posto
+di MongoDB: le collection sono dizionari in memoria con indici per campo,
+ciascuno con l'elenco ordinato dei valori distinti. Le uguaglianze sono una
+ricerca in un dizionario e le regex ancorate (come quelle dei sottoalberi del
+filesystem) un intervallo nell'indice ordinato di path. Con sqlite ogni
+scrittura viene registrata in un database SQLite in modalità WAL e le
+collection vengono ricaricate all'avvio.
+
+L'interfaccia è quella delle collection Motor (find, aggregate, update_one,
+find_one_and_update...), limitata agli operatori usati dalle routes; un
+operatore non supportato solleva OperationFailure. Le sessioni non sono
+supportate (database.SESSIONS_SUPPORTED è falso): run_transaction esegue le
+callback senza transazione, e start_session risponde come un mongod
+standalone, con OperationFailure "IllegalOperation".
+
+Con sqlite le modifiche di ogni operazione (per esempio tutti i documenti di
+un update_many) vengono scritte in un'unica transazione da un thread
+dedicato, fuori dall'event loop e nell'ordine in cui sono avvenute. I dati
+sono locali al processo: un solo worker può usare lo storage embedded.
+"""
+import asyncio
+import bisect
+import fcntl
+import functools
+import operator
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from bson import ObjectId, decode as bson_decode, encode as bson_encode
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+
+# Intervallo minimo tra due passaggi di scadenza degli indici TTL
+TTL_SWEEP_SECONDS = 30
+# Codice di errore di MongoDB per le operazioni non disponibili ("IllegalOperation")
+_ILLEGAL_OPERATION_CODE = 20
+
+
+# --- Ordinamento dei valori (ordine BSON) ---
+
+def _type_rank(value):
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value):
+    """Chiave confrontabile e hashable che rispetta l'ordine dei tipi di MongoDB"""
+    rank = _type_rank(value)
+    if rank == 1:
+        return (1, 0)
+    if rank in (4, 5, 10):
+        return (rank, repr(value))
+    if rank == 6:
+        return (rank, bytes(value))
+    return (rank, value)
+
+
+def _get(document, path):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set_path(document, path, value):
+    """Imposta path in document, copiando i sotto-documenti attraversati"""
+    parts = path.split(".")
+    target = document
+    for part in parts[:-1]:
+        child = target.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        target[part] = child
+        target = child
+    target[parts[-1]] = value
+
+
+def _unset_path(document, path):
+    parts = path.split(".")
+    target = document
+    for part in parts[:-1]:
+        child = target.get(part)
+        if not isinstance(child, dict):
+            return
+        child = dict(child)
+        target[part] = child
+        target = child
+    target.pop(parts[-1], None)
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _plain(value):
+    return None if value is _MISSING else value
+
+
+# --- Filtri ---
+
+_TYPE_ALIASES = {
+    "string": (str,),
+    "double": (float,),
+    "int": (int,),
+    "long": (int,),
+    "number": (int, float),
+    "bool": (bool,),
+    "date": (datetime,),
+    "objectId": (ObjectId,),
+    "binData": (bytes,),
+    "object": (dict,),
+    "array": (list,),
+    "null": (type(None),),
+}
+
+_COMPARISONS = {
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+}
+
+
+@lru_cache(maxsize=256)
+def _compile(pattern, options=""):
+    flags = 0
+    for option in options:
+        flags |= {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}.get(option, 0)
+    return re.compile(pattern, flags)
+
+
+def _equals(value, target):
+    if target is None:
+        return value is None or value is _MISSING
+    if isinstance(value, list) and not isinstance(target, list):
+        return any(_equals(item, target) for item in value)
+    return value is not _MISSING and _type_rank(value) == _type_rank(target) and value == target
+
+
+def _compare(op, value, target):
+    if isinstance(value, list):
+        return any(_compare(op, item, target) for item in value)
+    if value is _MISSING or value is None or target is None:
+        # Solo $gte/$lte con null selezionano i campi nulli o assenti
+        return target is None and op in ("$gte", "$lte") and (value is None or value is _MISSING)
+    if _type_rank(value) != _type_rank(target):
+        return False
+    return _COMPARISONS[op](sort_key(value), sort_key(target))
+
+
+def _regex_matches(value, pattern, options=""):
+    if isinstance(pattern, re.Pattern):
+        regex = pattern
+    else:
+        regex = _compile(pattern, options or "")
+    if isinstance(value, list):
+        return any(isinstance(item, str) and regex.search(item) for item in value)
+    return isinstance(value, str) and regex.search(value) is not None
+
+
+def _match_operator(value, op, argument, condition):
+    if op == "$eq":
+        return _equals(value, argument)
+    if op == "$ne":
+        return not _equals(value, argument)
+    if op in _COMPARISONS:
+        return _compare(op, value, argument)
+    if op == "$in":
+        return any(
+            _regex_matches(value, item) if isinstance(item, re.Pattern) else _equals(value, item)
+            for item in argument
+        )
+    if op == "$nin":
+        return not _match_operator(value, "$in", argument, condition)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(argument)
+    if op == "$type":
+        names = argument if isinstance(argument, list) else [argument]
+        for name in names:
+            types = _TYPE_ALIASES.get(name)
+            if types is None:
+                raise OperationFailure(f"Tipo non supportato dallo storage embedded: {name}")
+            if value is not _MISSING and isinstance(value, types):
+                if bool in types or not isinstance(value, bool):
+                    return True
+        return False
+    if op == "$regex":
+        return _regex_matches(value, argument, condition.get("$options", ""))
+    if op == "$options":
+        return True
+    if op == "$not":
+        return not _match_condition(value, argument)
+    if op == "$size":
+        return isinstance(value, list) and len(value) == argument
+    raise OperationFailure(f"Operatore non supportato dallo storage embedded: {op}")
+
+
+def _is_operator_dict(condition):
+    return isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)
+
+
+def _match_condition(value, condition):
+    if _is_operator_dict(condition):
+        return all(_match_operator(value, op, argument, condition) for op, argument in condition.items())
+    if isinstance(condition, re.Pattern):
+        return _regex_matches(value, condition)
+    return _equals(value, condition)
+
+
+def matches(document, query):
+    """Vero se il documento soddisfa il filtro MongoDB"""
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(document, item) for item in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, item) for item in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, item) for item in condition):
+                return False
+        elif key == "$expr":
+            if not _truthy(evaluate(condition, document)):
+                return False
+        elif key.startswith("$"):
+            raise OperationFailure(f"Operatore non supportato dallo storage embedded: {key}")
+        elif not _match_condition(_get(document, key), condition):
+            return False
+    return True
+
+
+# --- Espressioni di aggregazione ---
+
+def _truthy(value):
+    return value not in (None, False, 0, _MISSING)
+
+
+def _subtract(left, right):
+    if isinstance(left, datetime) and isinstance(right, datetime):
+        return int((left - right).total_seconds() * 1000)
+    if isinstance(left, datetime):
+        return left - timedelta(milliseconds=right)
+    return left - right
+
+
+def _add(*values):
+    total = 0
+    moment = None
+    for value in values:
+        if value is None:
+            return None
+        if isinstance(value, datetime):
+            moment = value
+        else:
+            total += value
+    return moment + timedelta(milliseconds=total) if moment is not None else total
+
+
+def _to_string(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _compare_values(op):
+    return lambda left, right: op(sort_key(left), sort_key(right))
+
+
+_EXPRESSIONS = {
+    "$add": _add,
+    "$subtract": _subtract,
+    "$multiply": lambda *values: None if None in values else _product(values),
+    "$divide": lambda left, right: None if left is None or right is None else left / right,
+    "$min": lambda *values: min((v for v in _flatten(values) if v is not None), key=sort_key, default=None),
+    "$max": lambda *values: max((v for v in _flatten(values) if v is not None), key=sort_key, default=None),
+    "$ifNull": lambda *values: next((v for v in values if v is not None), None),
+    "$eq": _compare_values(operator.eq),
+    "$ne": _compare_values(operator.ne),
+    "$gt": _compare_values(operator.gt),
+    "$gte": _compare_values(operator.ge),
+    "$lt": _compare_values(operator.lt),
+    "$lte": _compare_values(operator.le),
+    "$and": lambda *values: all(_truthy(v) for v in values),
+    "$or": lambda *values: any(_truthy(v) for v in values),
+    "$not": lambda value: not _truthy(value),
+    "$in": lambda value, values: any(_equals(item, value) for item in (values or [])),
+    "$strLenCP": len,
+    "$toString": _to_string,
+    "$toLower": lambda value: (value or "").lower(),
+    "$size": len,
+    "$concat": lambda *values: None if None in values else "".join(values),
+    "$substrCP": lambda value, start, count: (value or "")[start:start + count],
+}
+
+
+def _product(values):
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+
+def _flatten(values):
+    if len(values) == 1 and isinstance(values[0], list):
+        return values[0]
+    return values
+
+
+def evaluate(expression, document, variables=None):
+    """Valuta un'espressione di aggregazione sul documento"""
+    if isinstance(expression, str):
+        if expression.startswith("$$"):
+            name, _, rest = expression[2:].partition(".")
+            value = document if name in ("ROOT", "CURRENT") else (variables or {}).get(name, _MISSING)
+            return _get(value, rest) if rest and value is not _MISSING else value
+        if expression.startswith("$"):
+            return _get(document, expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [_plain(evaluate(item, document, variables)) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+
+    if len(expression) == 1:
+        (op, argument), = expression.items()
+        if op.startswith("$"):
+            if op == "$literal":
+                return argument
+            if op == "$cond":
+                if isinstance(argument, dict):
+                    argument = [argument["if"], argument["then"], argument["else"]]
+                condition, then, otherwise = argument
+                chosen = then if _truthy(evaluate(condition, document, variables)) else otherwise
+                return _plain(evaluate(chosen, document, variables))
+            if op == "$filter":
+                items = _plain(evaluate(argument["input"], document, variables)) or []
+                name = argument.get("as", "this")
+                return [
+                    item for item in items
+                    if _truthy(evaluate(argument["cond"], document, {**(variables or {}), name: item}))
+                ]
+            function = _EXPRESSIONS.get(op)
+            if function is None:
+                raise OperationFailure(f"Espressione non supportata dallo storage embedded: {op}")
+            if isinstance(argument, list):
+                values = [_plain(evaluate(item, document, variables)) for item in argument]
+            else:
+                values = [_plain(evaluate(argument, document, variables))]
+            return function(*values)
+    return {key: _plain(evaluate(value, document, variables)) for key, value in expression.items()}
+
+
+# --- Proiezioni e aggiornamenti ---
+
+def project(document, projection):
+    """Applica una proiezione di find o uno stage $project"""
+    if not projection:
+        return _copy(document)
+    include_id = projection.get("_id", 1) not in (0, False)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    inclusive = any(
+        not isinstance(value, (int, bool)) or value for value in fields.values()
+    ) or (not fields and include_id)
+
+    if not inclusive:
+        result = _copy(document)
+        for key in fields:
+            _unset_path(result, key)
+        if not include_id:
+            result.pop("_id", None)
+        return result
+
+    result = {}
+    if include_id and "_id" in document:
+        result["_id"] = document["_id"]
+    for key, value in fields.items():
+        if isinstance(value, (int, bool)):
+            field_value = _get(document, key)
+        else:
+            field_value = evaluate(value, document)
+        if field_value is not _MISSING:
+            _set_path(result, key, _copy(field_value))
+    return result
+
+
+def apply_update(document, update, is_insert=False):
+    """Restituisce il documento aggiornato senza modificare l'originale"""
+    result = dict(document)
+    if isinstance(update, list):
+        # Update con pipeline: ogni stage vede il documento prodotto dal precedente
+        for stage in update:
+            (op, argument), = stage.items()
+            if op in ("$set", "$addFields"):
+                computed = {key: evaluate(value, result) for key, value in argument.items()}
+                for key, value in computed.items():
+                    _set_path(result, key, _copy(_plain(value)))
+            elif op == "$unset":
+                for key in [argument] if isinstance(argument, str) else argument:
+                    _unset_path(result, key)
+            elif op == "$project":
+                result = project(result, argument)
+            else:
+                raise OperationFailure(f"Stage di update non supportato dallo storage embedded: {op}")
+    else:
+        if not _is_operator_dict(update):
+            raise ValueError("update only works with $ operators")
+        for op, argument in update.items():
+            if op == "$set" or (op == "$setOnInsert" and is_insert):
+                for key, value in argument.items():
+                    _set_path(result, key, _copy(value))
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$unset":
+                for key in argument:
+                    _unset_path(result, key)
+            elif op == "$inc":
+                for key, value in argument.items():
+                    current = _plain(_get(result, key))
+                    _set_path(result, key, (current or 0) + value)
+            elif op in ("$min", "$max"):
+                pick = min if op == "$min" else max
+                for key, value in argument.items():
+                    current = _plain(_get(result, key))
+                    _set_path(result, key, value if current is None else pick(current, value, key=sort_key))
+            elif op == "$push":
+                for key, value in argument.items():
+                    current = _plain(_get(result, key)) or []
+                    _set_path(result, key, list(current) + [_copy(value)])
+            else:
+                raise OperationFailure(f"Operatore di update non supportato dallo storage embedded: {op}")
+
+    if "_id" in document and result.get("_id") != document["_id"]:
+        raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'")
+    return result
+
+
+def _upsert_seed(query):
+    """Documento iniziale di un upsert: i campi del filtro in uguaglianza"""
+    seed = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if _is_operator_dict(condition):
+            if "$eq" in condition:
+                _set_path(seed, key, _copy(condition["$eq"]))
+        elif not isinstance(condition, re.Pattern):
+            _set_path(seed, key, _copy(condition))
+    return seed
+
+
+def _has_top_level_alternation(pattern):
+    """Vero se la regex contiene un | fuori da gruppi e classi (es. "^abc|xyz")"""
+    depth = 0
+    in_class = False
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            index += 2
+            continue
+        if in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+            # "]" subito dopo "[" o "[^" è letterale
+            if pattern[index + 1:index + 2] == "^":
+                index += 1
+            if pattern[index + 1:index + 2] == "]":
+                index += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+        index += 1
+    return False
+
+
+def _regex_prefix(condition):
+    """Prefisso letterale di una regex ancorata e case-sensitive, o None
+
+    Con un'alternativa al primo livello l'ancora vale solo per il primo ramo,
+    quindi non c'è un prefisso comune.
+    """
+    if isinstance(condition, dict):
+        if condition.get("$options"):
+            return None
+        pattern = condition.get("$regex")
+    else:
+        pattern = condition
+    if isinstance(pattern, re.Pattern):
+        if pattern.flags & re.IGNORECASE:
+            return None
+        pattern = pattern.pattern
+    if not isinstance(pattern, str) or not pattern.startswith("^") or _has_top_level_alternation(pattern):
+        return None
+
+    prefix = []
+    index = 1
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\" and index + 1 < len(pattern) and not pattern[index + 1].isalnum():
+            prefix.append(pattern[index + 1])
+            index += 2
+            continue
+        if char in ".^$*+?()[]{}|\\":
+            # Un quantificatore rende opzionale l'ultimo carattere letterale
+            if char in "*?{" and prefix:
+                prefix.pop()
+            break
+        prefix.append(char)
+        index += 1
+    return "".join(prefix)
+
+
+# --- Indici ---
+
+class FieldIndex:
+    """Valori distinti di un campo in ordine, ciascuno con gli _id dei documenti"""
+
+    def __init__(self, field):
+        self.field = field
+        self._ids = {}
+        self._keys = []
+
+    def add(self, document_id, value):
+        key = sort_key(value)
+        bucket = self._ids.get(key)
+        if bucket is None:
+            bucket = self._ids[key] = set()
+            bisect.insort(self._keys, key)
+        bucket.add(document_id)
+
+    def remove(self, document_id, value):
+        key = sort_key(value)
+        bucket = self._ids.get(key)
+        if bucket is None:
+            return
+        bucket.discard(document_id)
+        if not bucket:
+            del self._ids[key]
+            position = bisect.bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                del self._keys[position]
+
+    def equal(self, value):
+        return self._ids.get(sort_key(value), set())
+
+    def range(self, low, high):
+        """_id dei documenti con chiave in [low, high)"""
+        result = set()
+        start = bisect.bisect_left(self._keys, low)
+        end = bisect.bisect_left(self._keys, high)
+        for key in self._keys[start:end]:
+            result |= self._ids[key]
+        return result
+
+    def prefix(self, prefix):
+        result = set()
+        position = bisect.bisect_left(self._keys, (3, prefix))
+        while position < len(self._keys):
+            rank, value = self._keys[position]
+            if rank != 3 or not value.startswith(prefix):
+                break
+            result |= self._ids[self._keys[position]]
+            position += 1
+        return result
+
+    def candidates(self, condition):
+        """Insieme di _id che può soddisfare la condizione, o None se l'indice non serve"""
+        if isinstance(condition, re.Pattern) or (isinstance(condition, dict) and "$regex" in condition):
+            prefix = _regex_prefix(condition)
+            return self.prefix(prefix) if prefix else None
+        if _is_operator_dict(condition):
+            if "$eq" in condition:
+                return self.equal(condition["$eq"])
+            if "$in" in condition and not any(isinstance(v, re.Pattern) for v in condition["$in"]):
+                result = set()
+                for value in condition["$in"]:
+                    result |= self.equal(value)
+                return result
+            return None
+        if isinstance(condition, (dict, list)):
+            return None
+        return self.equal(condition)
+
+
+class _Cursor:
+    """Cursore asincrono sul risultato di find o aggregate"""
+
+    def __init__(self, run, projection=None, copy=True):
+        self._run = run
+        self._projection = projection
+        self._copy = copy
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self._sort = list(key_or_list)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _documents(self, length=None):
+        documents = self._run()
+        if self._sort:
+            documents = sort_documents(documents, self._sort)
+        if self._skip:
+            documents = documents[self._skip:]
+        limit = self._limit
+        if length is not None and (not limit or length < limit):
+            limit = length
+        if limit:
+            documents = documents[:limit]
+        if not self._copy:
+            return documents
+        return [project(document, self._projection) for document in documents]
+
+    async def to_list(self, length=None):
+        return self._documents(length)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._documents():
+            yield document
+
+
+def sort_documents(documents, sort):
+    documents = list(documents)
+    # Ordinamenti stabili dal criterio meno significativo al più significativo
+    for field, direction in reversed(sort):
+        documents.sort(key=lambda document: sort_key(_get(document, field)), reverse=direction < 0)
+    return documents
+
+
+def _lookup_equalities(stage):
+    """Coppie (campo, variabile) di un {"$match": {"$expr": ...}} fatto solo di $eq, o None"""
+    expression = stage.get("$match", {}).get("$expr") if len(stage) == 1 else None
+    if not isinstance(expression, dict) or len(stage["$match"]) != 1:
+        return None
+    conditions = expression.get("$and", [expression]) if len(expression) == 1 else []
+    equalities = []
+    for condition in conditions:
+        operands = condition.get("$eq") if isinstance(condition, dict) and len(condition) == 1 else None
+        if not isinstance(operands, list) or len(operands) != 2 or not all(isinstance(o, str) for o in operands):
+            return None
+        field, variable = sorted(operands, key=lambda operand: operand.startswith("$$"))
+        if not (field.startswith("$") and not field.startswith("$$") and variable.startswith("$$")):
+            return None
+        equalities.append((field[1:], variable[2:]))
+    return equalities or None
+
+
+def _group(documents, spec):
+    """Stage $group con gli accumulatori più comuni"""
+    groups = {}
+    for document in documents:
+        group_id = _plain(evaluate(spec["_id"], document))
+        key = sort_key(group_id)
+        state = groups.get(key)
+        if state is None:
+            state = groups[key] = {"_id": group_id, "_count": {}}
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expression), = accumulator.items()
+            value = _plain(evaluate(expression, document))
+            if op in ("$sum", "$avg"):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    state[field] = state.get(field, 0) + value
+                    state["_count"][field] = state["_count"].get(field, 0) + 1
+                else:
+                    state.setdefault(field, 0)
+            elif op in ("$min", "$max"):
+                if value is not None:
+                    current = state.get(field)
+                    pick = min if op == "$min" else max
+                    state[field] = value if current is None else pick(current, value, key=sort_key)
+                else:
+                    state.setdefault(field, None)
+            elif op == "$first":
+                state.setdefault(field, value)
+            elif op == "$last":
+                state[field] = value
+            elif op == "$push":
+                state.setdefault(field, []).append(value)
+            elif op == "$addToSet":
+                items = state.setdefault(field, [])
+                if not any(sort_key(item) == sort_key(value) for item in items):
+                    items.append(value)
+            else:
+                raise OperationFailure(f"Accumulatore non supportato dallo storage embedded: {op}")
+
+    result = []
+    for state in groups.values():
+        counts = state.pop("_count")
+        for field, accumulator in spec.items():
+            if field != "_id" and "$avg" in accumulator:
+                state[field] = state[field] / counts[field] if counts.get(field) else None
+        result.append(state)
+    return result
+
+
+def _journaled(method):
+    """Scrive nel journal le modifiche fatte dall'operazione, anche se fallisce a metà"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            await self._flush()
+    return wrapper
+
+
+class EmbeddedCollection:
+    def __init__(self, database, name, documents=()):
+        self.database = database
+        self.name = name
+        self._namespace = f"{database.name}.{name}"
+        self._journal = database.client.journal
+        # Modifiche dell'operazione in corso, da scrivere nel journal alla sua fine
+        self._changes = []
+        self._documents = {}
+        self._sequence = {}
+        self._next_sequence = 0
+        self._indexes = {}
+        self._unique = {}
+        self._ttl = []
+        self._last_sweep = 0.0
+        for document in documents:
+            self._store(document)
+
+    # Scritture interne
+
+    def _store(self, document):
+        document_id = document["_id"]
+        self._documents[document_id] = document
+        self._sequence[document_id] = self._next_sequence
+        self._next_sequence += 1
+        for field, index in self._indexes.items():
+            index.add(document_id, _get(document, field))
+        for fields, keys in self._unique.items():
+            keys[self._unique_key(fields, document)] = document_id
+
+    def _check_unique(self, document, ignore_id=None):
+        for fields, keys in self._unique.items():
+            owner = keys.get(self._unique_key(fields, document))
+            if owner is not None and owner != ignore_id:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self._namespace} "
+                    f"index: {'_'.join(fields)} dup key",
+                    11000
+                )
+
+    @staticmethod
+    def _unique_key(fields, document):
+        return tuple(sort_key(_get(document, field)) for field in fields)
+
+    def _insert(self, document):
+        if "_id" not in document:
+            # Come pymongo, l'_id generato viene aggiunto al documento del chiamante
+            document["_id"] = ObjectId()
+        if document["_id"] in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self._namespace} index: _id_ dup key",
+                11000
+            )
+        stored = _copy(document)
+        self._check_unique(stored)
+        self._store(stored)
+        if self._journal is not None:
+            self._changes.append((stored["_id"], stored))
+        return stored["_id"]
+
+    def _replace(self, old, new):
+        document_id = old["_id"]
+        self._check_unique(new, ignore_id=document_id)
+        for field, index in self._indexes.items():
+            old_value, new_value = _get(old, field), _get(new, field)
+            if sort_key(old_value) != sort_key(new_value):
+                index.remove(document_id, old_value)
+                index.add(document_id, new_value)
+        for fields, keys in self._unique.items():
+            old_key, new_key = self._unique_key(fields, old), self._unique_key(fields, new)
+            if old_key != new_key:
+                keys.pop(old_key, None)
+                keys[new_key] = document_id
+        self._documents[document_id] = new
+        if self._journal is not None:
+            self._changes.append((document_id, new))
+
+    def _remove(self, document):
+        document_id = document["_id"]
+        for field, index in self._indexes.items():
+            index.remove(document_id, _get(document, field))
+        for fields, keys in self._unique.items():
+            keys.pop(self._unique_key(fields, document), None)
+        del self._documents[document_id]
+        del self._sequence[document_id]
+        if self._journal is not None:
+            self._changes.append((document_id, None))
+
+    async def _flush(self):
+        if self._changes:
+            changes, self._changes = self._changes, []
+            await self._journal.write(self._namespace, changes)
+
+    def _expire(self):
+        """Rimuove i documenti scaduti degli indici TTL"""
+        if not self._ttl or time.monotonic() - self._last_sweep < TTL_SWEEP_SECONDS:
+            return
+        self._last_sweep = time.monotonic()
+        for field, seconds in self._ttl:
+            cutoff = datetime.utcnow() - timedelta(seconds=seconds)
+            expired = self._indexes[field].range((9, datetime.min), (9, cutoff))
+            for document_id in expired:
+                self._remove(self._documents[document_id])
+
+    # Lettura
+
+    def _candidates(self, query):
+        best = None
+        for field, condition in query.items():
+            if field.startswith("$"):
+                continue
+            if field == "_id":
+                if _is_operator_dict(condition):
+                    if "$in" not in condition:
+                        continue
+                    ids = {value for value in condition["$in"] if value in self._documents}
+                else:
+                    ids = {condition} if condition in self._documents else set()
+            else:
+                index = self._indexes.get(field)
+                if index is None:
+                    continue
+                ids = index.candidates(condition)
+                if ids is None:
+                    continue
+            if best is None or len(ids) < len(best):
+                best = ids
+        return best
+
+    def _select(self, query):
+        query = query or {}
+        ids = self._candidates(query)
+        if ids is None:
+            documents = self._documents.values()
+        else:
+            # Mantiene l'ordine naturale (di inserimento) come MongoDB senza sort
+            documents = [self._documents[i] for i in sorted(ids, key=self._sequence.__getitem__)]
+        return [document for document in documents if matches(document, query)]
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs):
+        cursor = _Cursor(lambda: self._select(filter), projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    async def find_one(self, filter=None, projection=None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        documents = await self.find(filter, projection, sort=kwargs.get("sort")).to_list(1)
+        return documents[0] if documents else None
+
+    async def count_documents(self, filter=None, **kwargs):
+        return len(self._select(filter))
+
+    async def estimated_document_count(self, **kwargs):
+        return len(self._documents)
+
+    async def distinct(self, key, filter=None, **kwargs):
+        values = {}
+        for document in self._select(filter):
+            value = _get(document, key)
+            for item in value if isinstance(value, list) else [value]:
+                if item is not _MISSING:
+                    values.setdefault(sort_key(item), item)
+        return list(values.values())
+
+    def aggregate(self, pipeline, **kwargs):
+        return _Cursor(lambda: self._aggregate(pipeline), copy=False)
+
+    def _aggregate(self, pipeline):
+        stages = list(pipeline)
+        if stages and "$match" in stages[0]:
+            # Il primo $match usa gli indici
+            documents = self._select(stages.pop(0)["$match"])
+        else:
+            documents = list(self._documents.values())
+
+        for stage in stages:
+            (op, argument), = stage.items()
+            if op == "$match":
+                documents = [document for document in documents if matches(document, argument)]
+            elif op == "$sort":
+                documents = sort_documents(documents, list(argument.items()))
+            elif op == "$limit":
+                documents = documents[:argument]
+            elif op == "$skip":
+                documents = documents[argument:]
+            elif op == "$project":
+                documents = [project(document, argument) for document in documents]
+            elif op in ("$set", "$addFields"):
+                documents = [apply_update(document, [{"$set": argument}]) for document in documents]
+            elif op == "$unset":
+                documents = [apply_update(document, [{"$unset": argument}]) for document in documents]
+            elif op == "$group":
+                documents = _group(documents, argument)
+            elif op == "$lookup":
+                documents = self._lookup(documents, argument)
+            elif op == "$count":
+                documents = [{argument: len(documents)}]
+            else:
+                raise OperationFailure(f"Stage non supportato dallo storage embedded: {op}")
+        return [_copy(document) for document in documents]
+
+    def _lookup(self, documents, spec):
+        foreign = self.database[spec["from"]]
+        if "pipeline" in spec:
+            return self._lookup_pipeline(foreign, documents, spec)
+        local_field, foreign_field = spec["localField"], spec["foreignField"]
+        index = foreign._indexes.get(foreign_field)
+        result = []
+        for document in documents:
+            value = _plain(_get(document, local_field))
+            if index is not None:
+                ids = sorted(index.equal(value), key=foreign._sequence.__getitem__)
+                joined = [foreign._documents[i] for i in ids]
+            else:
+                joined = [d for d in foreign._documents.values() if _equals(_get(d, foreign_field), value)]
+            result.append({**document, spec["as"]: [_copy(d) for d in joined]})
+        return result
+
+    def _lookup_pipeline(self, foreign, documents, spec):
+        """$lookup con let/pipeline: il primo $match confronta campi e variabili con $eq"""
+        stages = list(spec["pipeline"])
+        equalities = _lookup_equalities(stages[0]) if stages else None
+        if equalities is None:
+            raise OperationFailure("$lookup con pipeline: lo storage embedded richiede un primo $match di $eq")
+        result = []
+        for document in documents:
+            variables = {name: _plain(evaluate(value, document)) for name, value in spec.get("let", {}).items()}
+            # Diventa un filtro di uguaglianza, che usa gli indici della collection esterna
+            query = {field: variables.get(name) for field, name in equalities}
+            joined = foreign._aggregate([{"$match": query}, *stages[1:]])
+            result.append({**document, spec["as"]: joined})
+        return result
+
+    # Scrittura
+
+    @_journaled
+    async def insert_one(self, document, **kwargs):
+        self._expire()
+        return InsertOneResult(self._insert(document), True)
+
+    @_journaled
+    async def insert_many(self, documents, **kwargs):
+        self._expire()
+        return InsertManyResult([self._insert(document) for document in documents], True)
+
+    async def _update(self, filter, update, upsert, multi):
+        self._expire()
+        targets = self._select(filter)
+        if not multi:
+            targets = targets[:1]
+        modified = 0
+        for document in targets:
+            updated = apply_update(document, update)
+            if updated != document:
+                self._replace(document, updated)
+                modified += 1
+        raw_result = {"n": len(targets), "nModified": modified, "updatedExisting": bool(targets)}
+        if not targets and upsert:
+            document = apply_update(_upsert_seed(filter), update, is_insert=True)
+            raw_result["n"] = 1
+            raw_result["upserted"] = self._insert(document)
+        return UpdateResult(raw_result, True)
+
+    @_journaled
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        return await self._update(filter, update, upsert, multi=False)
+
+    @_journaled
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        return await self._update(filter, update, upsert, multi=True)
+
+    @_journaled
+    async def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                                  return_document=False, **kwargs):
+        self._expire()
+        targets = self._select(filter)
+        if sort:
+            targets = sort_documents(targets, list(sort))
+        if targets:
+            document = targets[0]
+            updated = apply_update(document, update)
+            if updated != document:
+                self._replace(document, updated)
+            result = updated if return_document else document
+        elif upsert:
+            updated = apply_update(_upsert_seed(filter), update, is_insert=True)
+            self._insert(updated)
+            result = updated if return_document else None
+        else:
+            result = None
+        return project(result, projection) if result is not None else None
+
+    @_journaled
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        targets = self._select(filter)
+        if sort:
+            targets = sort_documents(targets, list(sort))
+        if not targets:
+            return None
+        self._remove(targets[0])
+        return project(targets[0], projection)
+
+    @_journaled
+    async def delete_one(self, filter, **kwargs):
+        targets = self._select(filter)[:1]
+        for document in targets:
+            self._remove(document)
+        return DeleteResult({"n": len(targets)}, True)
+
+    @_journaled
+    async def delete_many(self, filter, **kwargs):
+        targets = self._select(filter)
+        for document in targets:
+            self._remove(document)
+        return DeleteResult({"n": len(targets)}, True)
+
+    async def create_index(self, keys, unique=False, expireAfterSeconds=None, name=None, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        fields = tuple(field for field, _ in keys)
+        for field in fields:
+            if field != "_id" and field not in self._indexes:
+                index = self._indexes[field] = FieldIndex(field)
+                for document_id, document in self._documents.items():
+                    index.add(document_id, _get(document, field))
+        if unique and fields not in self._unique:
+            owners = {}
+            for document_id, document in self._documents.items():
+                key = self._unique_key(fields, document)
+                if key in owners:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self._namespace} "
+                        f"index: {'_'.join(fields)} dup key",
+                        11000
+                    )
+                owners[key] = document_id
+            self._unique[fields] = owners
+        if expireAfterSeconds is not None and (fields[0], expireAfterSeconds) not in self._ttl:
+            self._ttl.append((fields[0], expireAfterSeconds))
+        return name or "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    @_journaled
+    async def drop(self, **kwargs):
+        for document in list(self._documents.values()):
+            self._remove(document)
+
+
+class EmbeddedDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            documents = self.client.journal.load(f"{self.name}.{name}") if self.client.journal else ()
+            collection = self._collections[name] = EmbeddedCollection(self, name, documents)
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    async def list_collection_names(self, **kwargs):
+        return list(self._collections)
+
+    async def command(self, *args, **kwargs):
+        raise OperationFailure("Comando non supportato dallo storage embedded")
+
+
+class SqliteJournal:
+    """Persistenza delle collection embedded in SQLite (WAL), un record BSON per documento
+
+    Le scritture girano in un unico thread, in ordine di invio, con una
+    transazione per operazione. Un lock esclusivo sul file impedisce a un
+    altro processo di aprire lo stesso database.
+    """
+
+    def __init__(self, path):
+        self._lock_file = open(f"{path}.lock", "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(
+                f"{path} è già in uso da un altro processo: lo storage embedded supporta un solo worker"
+            ) from None
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="futureos-journal")
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "namespace TEXT NOT NULL, id BLOB NOT NULL, body BLOB NOT NULL, "
+                "PRIMARY KEY (namespace, id)) WITHOUT ROWID"
+            )
+
+    @staticmethod
+    def _key(document_id):
+        return bson_encode({"_id": document_id})
+
+    def load(self, namespace):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT body FROM documents WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return [bson_decode(body) for (body,) in rows]
+
+    def write(self, namespace, changes):
+        """Accoda le modifiche (_id, documento o None se eliminato) di un'operazione
+
+        L'invio al thread avviene subito, quindi l'ordine delle transazioni è
+        quello delle operazioni anche se i chiamanti attendono in ordine diverso.
+        """
+        return asyncio.get_running_loop().run_in_executor(self._executor, self._write, namespace, changes)
+
+    def _write(self, namespace, changes):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                for document_id, document in changes:
+                    if document is None:
+                        self._connection.execute(
+                            "DELETE FROM documents WHERE namespace = ? AND id = ?",
+                            (namespace, self._key(document_id))
+                        )
+                    else:
+                        self._connection.execute(
+                            "INSERT OR REPLACE INTO documents (namespace, id, body) VALUES (?, ?, ?)",
+                            (namespace, self._key(document_id), bson_encode(document))
+                        )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def close(self):
+        # Attende le scritture già accodate
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._connection.close()
+        self._lock_file.close()
+
+
+class EmbeddedClient:
+    def __init__(self, path=None):
+        self.journal = SqliteJournal(path) if path else None
+        self._databases = {}
+
+    def __getitem__(self, name):
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = EmbeddedDatabase(self, name)
+        return database
+
+    def get_database(self, name, **kwargs):
+        return self[name]
+
+    async def start_session(self, **kwargs):
+        # Come un mongod standalone; run_transaction non ci arriva (database.SESSIONS_SUPPORTED)
+        raise OperationFailure(
+            "Le sessioni non sono supportate dallo storage embedded", code=_ILLEGAL_OPERATION_CODE
+        )
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
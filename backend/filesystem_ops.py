@@ -0,0 +1,282 @@
+"""Operazioni multi-documento sul filesystem virtuale
+
+Creazioni ed eliminazioni ricorsive vengono eseguite in transazione: la
+creazione aggiorna anche la cartella padre, così un'eliminazione concorrente
+della stessa cartella genera un conflitto di scrittura invece di lasciare
+figli orfani. Lo scavenger (eseguito dallo scheduler) rimuove i nodi rimasti
+senza padre.
+
+Lo spostamento nel cestino e il ripristino scrivono solo la radice del
+sottoalbero (vedi trash.py). Creare un nodo nel path di una radice nel
+cestino sposta quel sottoalbero sotto un path libero: resta nel cestino, fino
+al ripristino o al purge, e il nuovo nodo non eredita i vecchi discendenti.
+"""
+import logging
+from datetime import datetime
+from database import filesystem_collection
+from invalidation import invalidate_filesystem_path, invalidate_trash
+from paths import parent_of, subtree_regex
+from trash import IS_TRASHED, NOT_TRASHED, PURGING_FIELD, TRASHED_FIELD, is_trashed
+from transactions import run_transaction
+from versioning import INITIAL_VERSION, VERSION_FIELD, VERSION_INCREMENT, VersionConflictError, expected_condition
+
+logger = logging.getLogger(__name__)
+
+ORPHAN_BATCH_SIZE = 500
+
+
+class NodeExistsError(Exception):
+    pass
+
+
+class ParentNotFoundError(Exception):
+    pass
+
+
+def _set_path_prefix(path, new_path, field):
+    """Espressione che sostituisce il prefisso path con new_path nel campo indicato"""
+    return {"$concat": [new_path, {"$substrCP": [f"${field}", len(path), {"$strLenCP": f"${field}"}]}]}
+
+
+async def _move_trashed_root(root, user_id, session=None):
+    """Sposta una radice nel cestino, con il sottoalbero, sotto un path libero accanto all'originale"""
+    path = root["path"]
+    name = f"{root['name']}~{root['_id']}"
+    new_path = f"{parent_of(path).rstrip('/')}/{name}"
+    # Una sola update con pipeline per tutti i discendenti, senza leggerli
+    await filesystem_collection.update_many(
+        {"path": {"$regex": subtree_regex(path)}, "user_id": user_id},
+        [{"$set": {
+            "path": _set_path_prefix(path, new_path, "path"),
+            "parent_path": _set_path_prefix(path, new_path, "parent_path"),
+        }}],
+        session=session
+    )
+    await filesystem_collection.update_one(
+        {"_id": root["_id"]},
+        {"$set": {"path": new_path, "name": name}, **VERSION_INCREMENT},
+        session=session
+    )
+
+
+async def create_node(node):
+    """Inserisce un nodo verificando in transazione che il padre esista
+
+    Un nodo nel cestino con lo stesso path viene spostato, con il suo
+    sottoalbero, sotto il path "<nome>~<_id>" nella stessa transazione: resta
+    nel cestino e può ancora essere ripristinato.
+    """
+    user_id = node["user_id"]
+    if node["parent_path"] and await is_trashed(node["parent_path"], user_id):
+        raise ParentNotFoundError(node["parent_path"])
+    replaced = False
+
+    async def create(session):
+        nonlocal replaced
+        existing = await filesystem_collection.find_one(
+            {"path": node["path"], "user_id": user_id},
+            {"_id": 1, "path": 1, "name": 1, TRASHED_FIELD: 1, PURGING_FIELD: 1},
+            session=session
+        )
+        if existing and existing.get(TRASHED_FIELD) is None:
+            raise NodeExistsError(node["path"])
+        if existing and existing.get(PURGING_FIELD) is not None:
+            # Il purge in corso elimina per path: il nome si libera quando ha finito
+            raise NodeExistsError(node["path"])
+        if existing:
+            await _move_trashed_root(existing, user_id, session=session)
+            replaced = True
+
+        if node["parent_path"]:
+            # Aggiornare il padre crea un conflitto con un'eliminazione concorrente
+            parent = await filesystem_collection.update_one(
+                {"path": node["parent_path"], "type": "folder", "user_id": user_id, **NOT_TRASHED},
+                {"$set": {"modified_at": datetime.utcnow()}, **VERSION_INCREMENT},
+                session=session
+            )
+            if parent.matched_count == 0:
+                raise ParentNotFoundError(node["parent_path"])
+
+        document = dict(node)
+        document.setdefault(VERSION_FIELD, INITIAL_VERSION)
+        result = await filesystem_collection.insert_one(document, session=session)
+        return result.inserted_id
+
+    inserted_id = await run_transaction(create)
+    if replaced:
+        invalidate_filesystem_path(node["path"], subtree=True)
+        invalidate_trash(user_id)
+    invalidate_filesystem_path(node["path"], parent_path=node["parent_path"])
+    if node["parent_path"]:
+        invalidate_filesystem_path(node["parent_path"])
+    return inserted_id
+
+
+async def delete_node(path, user_id="default_user", expected_version=None):
+    """Elimina il nodo e, se è una cartella, tutto il suo contenuto; restituisce i nodi eliminati
+
+    Con expected_version (vedi versioning.if_match_version) il nodo viene
+    eliminato solo se ha ancora quella versione, altrimenti solleva
+    VersionConflictError.
+    """
+
+    async def delete(session):
+        if expected_version is not None:
+            # Prima la radice, con la versione nella condizione: se non corrisponde non si tocca nulla
+            root = await filesystem_collection.delete_one(
+                {"path": path, "user_id": user_id, **expected_condition(expected_version)},
+                session=session
+            )
+            if root.deleted_count == 0:
+                current = await filesystem_collection.find_one(
+                    {"path": path, "user_id": user_id}, {VERSION_FIELD: 1}, session=session
+                )
+                if current is not None:
+                    raise VersionConflictError(current)
+                return 0
+            deleted = await filesystem_collection.delete_many(
+                {"path": {"$regex": subtree_regex(path)}, "user_id": user_id},
+                session=session
+            )
+            return deleted.deleted_count + root.deleted_count
+
+        deleted = await filesystem_collection.delete_many(
+            {"path": {"$regex": subtree_regex(path)}, "user_id": user_id},
+            session=session
+        )
+        root = await filesystem_collection.delete_one(
+            {"path": path, "user_id": user_id}, session=session
+        )
+        if root.deleted_count == 0:
+            return 0
+        return deleted.deleted_count + root.deleted_count
+
+    deleted_count = await run_transaction(delete)
+    invalidate_filesystem_path(path, subtree=True)
+    invalidate_trash(user_id)
+    return deleted_count
+
+
+async def trash_node(path, user_id="default_user", expected_version=None):
+    """Sposta il nodo nel cestino con una sola scrittura; False se non esiste
+
+    Con expected_version solleva VersionConflictError se il nodo ha
+    un'altra versione.
+    """
+    if await is_trashed(path, user_id):
+        return False
+    query = {"path": path, "user_id": user_id, **NOT_TRASHED}
+    condition = dict(query)
+    if expected_version is not None:
+        condition.update(expected_condition(expected_version))
+    result = await filesystem_collection.update_one(
+        condition,
+        {"$set": {TRASHED_FIELD: datetime.utcnow()}, **VERSION_INCREMENT}
+    )
+    if result.matched_count == 0:
+        current = await filesystem_collection.find_one(query, {VERSION_FIELD: 1})
+        if current is not None:
+            raise VersionConflictError(current)
+        return False
+    invalidate_filesystem_path(path, subtree=True)
+    invalidate_trash(user_id)
+    return True
+
+
+async def restore_node(path, user_id="default_user"):
+    """Ripristina un nodo dal cestino; False se non è nel cestino
+
+    Solleva ParentNotFoundError se la directory di origine non esiste più
+    (o è a sua volta nel cestino).
+    """
+    parent_path = parent_of(path)
+    if parent_path:
+        parent = await filesystem_collection.find_one(
+            {"path": parent_path, "type": "folder", "user_id": user_id, **NOT_TRASHED}, {"_id": 1}
+        )
+        if parent is None or await is_trashed(parent_path, user_id):
+            raise ParentNotFoundError(parent_path)
+    result = await filesystem_collection.update_one(
+        # Un nodo già preso in carico dal purge non è più ripristinabile
+        {"path": path, "user_id": user_id, **IS_TRASHED, PURGING_FIELD: None},
+        {"$unset": {TRASHED_FIELD: ""}, "$set": {"modified_at": datetime.utcnow()}, **VERSION_INCREMENT}
+    )
+    if result.matched_count == 0:
+        return False
+    invalidate_filesystem_path(path, subtree=True)
+    invalidate_trash(user_id)
+    return True
+
+
+async def delete_subtree_in_batches(path, batch_size, on_batch=None, user_id="default_user"):
+    """Elimina definitivamente nodo e sottoalbero a lotti, dai nodi più profondi
+
+    Senza transazione: un'interruzione lascia un sottoalbero parziale ma mai
+    nodi orfani. on_batch(count) viene chiamata dopo ogni lotto e può
+    interrompere l'operazione sollevando un'eccezione.
+    """
+    subtree = {"path": {"$regex": subtree_regex(path)}, "user_id": user_id}
+    deleted = 0
+    try:
+        while True:
+            # Ordine decrescente: i figli vengono eliminati prima dei padri
+            batch = await filesystem_collection.find(subtree, {"_id": 1}).sort("path", -1).limit(
+                batch_size
+            ).to_list(batch_size)
+            if not batch:
+                break
+            result = await filesystem_collection.delete_many({"_id": {"$in": [item["_id"] for item in batch]}})
+            deleted += result.deleted_count
+            if on_batch is not None:
+                await on_batch(len(batch))
+        result = await filesystem_collection.delete_one({"path": path, "user_id": user_id})
+        deleted += result.deleted_count
+        if on_batch is not None:
+            await on_batch(1)
+    finally:
+        invalidate_filesystem_path(path, subtree=True)
+        # Il sottoalbero poteva contenere radici nel cestino
+        invalidate_trash(user_id)
+    return deleted
+
+
+async def find_orphans(user_id="default_user", limit=ORPHAN_BATCH_SIZE):
+    """Nodi dell'utente il cui parent_path non esiste più
+
+    La scansione parte dall'indice (user_id, parent_path), esclusa la radice
+    (parent_path ""), e per ogni nodo cerca il padre con l'indice (path, user_id).
+    """
+    return await filesystem_collection.aggregate([
+        {"$match": {"user_id": user_id, "parent_path": {"$gt": ""}}},
+        {"$lookup": {
+            "from": filesystem_collection.name,
+            "let": {"parent_path": "$parent_path", "user_id": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$path", "$$parent_path"]},
+                    {"$eq": ["$user_id", "$$user_id"]}
+                ]}}},
+                {"$project": {"_id": 1}},
+                {"$limit": 1}
+            ],
+            "as": "parent"
+        }},
+        {"$match": {"parent": {"$size": 0}}},
+        {"$project": {"_id": 0, "path": 1, "user_id": 1}},
+        {"$limit": limit}
+    ]).to_list(limit)
+
+
+async def scavenge_orphans():
+    """Elimina i nodi orfani insieme ai loro sottoalberi; restituisce il numero di nodi rimossi"""
+    removed = 0
+    for user_id in await filesystem_collection.distinct("user_id"):
+        while True:
+            orphans = await find_orphans(user_id)
+            for orphan in orphans:
+                removed += await delete_node(orphan["path"], orphan["user_id"])
+            if len(orphans) < ORPHAN_BATCH_SIZE:
+                break
+    if removed:
+        logger.info(f"Scavenger: rimossi {removed} nodi orfani")
+    return removed
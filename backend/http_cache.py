@@ -0,0 +1,90 @@
+"""ETag e GET condizionali per le risposte dell'API
+
+Gli ETag sono calcolati da _id e timestamp di modifica dei documenti. Per le
+collection intere un solo $group lato server ne riassume numero, versioni e
+ultime modifiche: se il client ha già la versione corrente si risponde 304
+senza leggere né serializzare i documenti.
+"""
+import hashlib
+from starlette.responses import Response
+
+CACHE_CONTROL = "private, no-cache"
+VERSION_FIELDS = ("modified_at", "updated_at", "version")
+
+# Suffissi aggiunti all'ETag dal middleware di compressione
+_ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def compute_etag(documents):
+    """ETag forte calcolato dall'identità e dalla data di modifica dei documenti"""
+    digest = hashlib.sha1()
+    for document in documents:
+        # I documenti già proiettati hanno "id" al posto di "_id"
+        digest.update(str(document.get("_id", document.get("id"))).encode())
+        for field in VERSION_FIELDS:
+            digest.update(b"|")
+            digest.update(str(document.get(field)).encode())
+        digest.update(b"\n")
+    return f'"{digest.hexdigest()}"'
+
+
+def fields_etag(etag, fields):
+    """ETag della rappresentazione ridotta ai campi scelti con fields="""
+    if fields is None:
+        return etag
+    variant = hashlib.sha1(",".join(sorted(fields)).encode()).hexdigest()[:8]
+    return f'{etag[:-1]}-f{variant}"'
+
+
+async def collection_etag(collection, query, sort=None, limit=None):
+    """Calcola l'ETag dei documenti che soddisfano la query
+
+    sort e limit vanno passati uguali a quelli della risposta, così l'ETag copre
+    gli stessi documenti. Il riepilogo cambia a ogni scrittura: gli inserimenti
+    e le eliminazioni spostano il conteggio o l'_id massimo, ogni modifica
+    incrementa la somma delle versioni o sposta l'ultima data di modifica.
+    """
+    pipeline = [{"$match": query}]
+    if sort:
+        pipeline.append({"$sort": sort})
+    if limit:
+        pipeline.append({"$limit": limit})
+    summary = {"_id": None, "count": {"$sum": 1}, "last_id": {"$max": "$_id"}}
+    for field in VERSION_FIELDS:
+        summary[field] = {"$sum" if field == "version" else "$max": f"${field}"}
+    pipeline.append({"$group": summary})
+    documents = await collection.aggregate(pipeline).to_list(1)
+    summary = documents[0] if documents else {}
+    digest = hashlib.sha1()
+    for field in ("count", "last_id", *VERSION_FIELDS):
+        digest.update(f"{field}={summary.get(field)}\n".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def _strip_encoding(etag):
+    for suffix in _ENCODING_SUFFIXES:
+        if etag.endswith(f'{suffix}"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def etag_matches(request, etag):
+    """Verifica se If-None-Match contiene l'ETag corrente"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [_strip_encoding(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+def set_cache_headers(response, etag):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def not_modified(etag):
+    """Risposta 304 Not Modified per l'ETag corrente"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
@@ -0,0 +1,52 @@
+"""Invalidazione delle cache locali dopo una modifica al filesystem
+
+Ogni invalidazione viene applicata subito alle cache di questo processo e
+pubblicata sul bus di coerenza, da cui gli altri worker la ricevono tramite
+apply_invalidation.
+"""
+from coherence import coherence_bus
+from listing_cache import listing_cache
+from paths import parent_of, path_cache
+from trash import trashed_roots
+
+
+def _evict(path, subtree, parent_path, user_id):
+    path_cache.invalidate(path, subtree=subtree)
+    listing_cache.invalidate(user_id, parent_path or parent_of(path))
+    if subtree:
+        listing_cache.invalidate_subtree(user_id, path)
+
+
+def invalidate_filesystem_path(path, subtree=False, parent_path=None, user_id="default_user"):
+    """Invalida path, l'elenco della sua directory padre e, con subtree=True, i discendenti"""
+    _evict(path, subtree, parent_path, user_id)
+    coherence_bus.publish({
+        "kind": "filesystem",
+        "path": path,
+        "subtree": subtree,
+        "parent_path": parent_path,
+        "user_id": user_id,
+    })
+
+
+def invalidate_trash(user_id="default_user"):
+    """Invalida l'insieme delle radici nel cestino dopo un'eliminazione, ripristino o purge"""
+    trashed_roots.invalidate(user_id)
+    coherence_bus.publish({"kind": "trash", "user_id": user_id})
+
+
+def clear_local_caches():
+    path_cache.clear()
+    listing_cache.clear()
+    trashed_roots.invalidate()
+
+
+def apply_invalidation(event):
+    """Applica un'invalidazione ricevuta da un altro worker"""
+    if event.get("kind") == "filesystem":
+        _evict(event["path"], event.get("subtree", False), event.get("parent_path"), event["user_id"])
+    elif event.get("kind") == "trash":
+        trashed_roots.invalidate(event["user_id"])
+    else:
+        # "reset" (o un tipo sconosciuto, da una versione più recente): si svuota tutto
+        clear_local_caches()
@@ -0,0 +1,419 @@
+"""Job asincroni per le operazioni lunghe sul filesystem
+
+Una richiesta crea il documento del job (stato "queued") e risponde subito
+con il suo id. Un numero limitato di worker asyncio per processo reclama i
+job in coda da MongoDB con find_one_and_update, quindi con più worker uvicorn
+ogni job viene eseguito una sola volta. Stato e avanzamento restano nel
+documento, da cui li leggono le API e lo stream SSE.
+
+L'annullamento è cooperativo: la richiesta imposta cancel_requested e
+l'operazione lo vede al successivo aggiornamento dell'avanzamento.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from database import ensure_indexes, filesystem_collection, jobs_collection
+from filesystem_ops import create_node, delete_subtree_in_batches, NodeExistsError, ParentNotFoundError
+from invalidation import invalidate_filesystem_path
+from metrics import registry
+from paths import base_name, is_within, normalize_path, parent_of, subtree_regex
+from trash import IS_TRASHED, PURGING_FIELD, TRASHED_FIELD, is_trashed, trash_filter
+from versioning import INITIAL_VERSION, VERSION_FIELD
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Intervallo con cui i worker controllano la coda (i job creati nel processo li svegliano subito)
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "2"))
+# Un job in esecuzione senza aggiornamenti da questo tempo è considerato interrotto
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", "300"))
+JOB_BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", "200"))
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+jobs_total = registry.counter(
+    "futureos_jobs_total",
+    "Job asincroni terminati, per tipo ed esito",
+    ("type", "status"),
+)
+job_run_seconds = registry.histogram(
+    "futureos_job_run_seconds",
+    "Durata di esecuzione dei job asincroni",
+    ("type",),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 1800.0),
+)
+jobs_running = registry.gauge(
+    "futureos_jobs_running",
+    "Job asincroni in esecuzione in questo processo",
+)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobProgress:
+    """Passato all'operazione per aggiornare l'avanzamento e verificare l'annullamento"""
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.done = 0
+        self.total = None
+
+    async def update(self, done=None, total=None, message=None):
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        fields = {"progress": {"done": self.done, "total": self.total}, "updated_at": datetime.utcnow()}
+        if message is not None:
+            fields["message"] = message
+        job = await jobs_collection.find_one_and_update(
+            {"_id": self.job_id}, {"$set": fields},
+            projection={"cancel_requested": 1}, return_document=ReturnDocument.AFTER
+        )
+        self.manager.notify(self.job_id)
+        if job is None or job.get("cancel_requested"):
+            raise JobCancelled()
+        # Cede il loop tra un lotto e l'altro anche se lo storage non sospende (motore embedded)
+        await asyncio.sleep(0)
+
+    async def advance(self, count, message=None):
+        await self.update(done=self.done + count, message=message)
+
+
+class JobType:
+    def __init__(self, name, run, validate=None):
+        self.name = name
+        self.run = run
+        self.validate = validate
+
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._types = {}
+        self._tasks = []
+        self._wakeup = None
+        self._listeners = {}
+
+    def register(self, name, run, validate=None):
+        """Registra un tipo di job: run(params, progress) restituisce il risultato"""
+        self._types[name] = JobType(name, run, validate)
+
+    @property
+    def types(self):
+        return sorted(self._types)
+
+    async def submit(self, job_type, params, user_id="default_user"):
+        """Valida i parametri e accoda il job; ValueError se tipo o parametri non sono validi"""
+        definition = self._types.get(job_type)
+        if definition is None:
+            raise ValueError(f"Tipo di job sconosciuto: {job_type}")
+        if definition.validate is not None:
+            params = definition.validate(params)
+        now = datetime.utcnow()
+        job = {
+            "user_id": user_id,
+            "type": job_type,
+            "params": params,
+            "status": "queued",
+            "progress": {"done": 0, "total": None},
+            "message": None,
+            "result": None,
+            "error": None,
+            "cancel_requested": False,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None,
+        }
+        result = await jobs_collection.insert_one(job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return result.inserted_id
+
+    async def cancel(self, job_id, user_id="default_user"):
+        """Annulla subito un job in coda, o chiede l'annullamento di uno in esecuzione"""
+        now = datetime.utcnow()
+        job = await jobs_collection.find_one_and_update(
+            {"_id": job_id, "user_id": user_id, "status": "queued"},
+            {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            job = await jobs_collection.find_one_and_update(
+                {"_id": job_id, "user_id": user_id, "status": "running"},
+                {"$set": {"cancel_requested": True, "updated_at": now}},
+                return_document=ReturnDocument.AFTER
+            )
+        if job is None:
+            job = await jobs_collection.find_one({"_id": job_id, "user_id": user_id})
+        self.notify(job_id)
+        return job
+
+    def notify(self, job_id):
+        for event in self._listeners.get(job_id, ()):
+            event.set()
+
+    async def wait_for_change(self, job_id, timeout):
+        """Attende un aggiornamento del job fatto in questo processo, al massimo timeout secondi"""
+        event = asyncio.Event()
+        self._listeners.setdefault(job_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            listeners = self._listeners.get(job_id)
+            listeners.discard(event)
+            if not listeners:
+                del self._listeners[job_id]
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        return await jobs_collection.find_one_and_update(
+            {"status": "queued"},
+            {"$set": {"status": "running", "worker": self.worker_id, "started_at": now, "updated_at": now}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _finish(self, job, status, **fields):
+        now = datetime.utcnow()
+        fields.update({"status": status, "finished_at": now, "updated_at": now})
+        await jobs_collection.update_one({"_id": job["_id"]}, {"$set": fields})
+        jobs_total.inc(type=job["type"], status=status)
+        self.notify(job["_id"])
+
+    async def _execute(self, job):
+        definition = self._types.get(job["type"])
+        if definition is None:
+            await self._finish(job, "failed", error=f"Tipo di job sconosciuto: {job['type']}")
+            return
+        progress = JobProgress(self, job["_id"])
+        self.notify(job["_id"])
+        jobs_running.inc()
+        started = time.perf_counter()
+        try:
+            result = await definition.run(job["params"], progress)
+            await self._finish(job, "succeeded", result=result)
+        except JobCancelled:
+            await self._finish(job, "cancelled")
+        except ValueError as e:
+            # Errori previsti dell'operazione (path inesistenti, destinazioni occupate)
+            logger.info(f"Job {job['_id']} ({job['type']}) non eseguito: {e}")
+            await self._finish(job, "failed", error=str(e))
+        except asyncio.CancelledError:
+            await self._finish(job, "failed", error="Interrotto dall'arresto del server")
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job['_id']} ({job['type']}) fallito")
+            await self._finish(job, "failed", error=str(e))
+        finally:
+            jobs_running.dec()
+            job_run_seconds.observe(time.perf_counter() - started, type=job["type"])
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception:
+                logger.exception("Errore nella lettura della coda dei job")
+                job = None
+            if job is not None:
+                await self._execute(job)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Worker dei job avviati: {self.workers}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def fail_stale_jobs(self):
+        """Chiude i job rimasti in esecuzione su un worker che non li aggiorna più"""
+        boundary = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        result = await jobs_collection.update_many(
+            {"status": "running", "updated_at": {"$lt": boundary}},
+            {"$set": {
+                "status": "failed", "error": "Worker non più attivo",
+                "finished_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+            }}
+        )
+        if result.modified_count:
+            logger.warning(f"Job interrotti chiusi come falliti: {result.modified_count}")
+        return result.modified_count
+
+
+job_manager = JobManager()
+
+
+# Operazioni disponibili come job
+
+def _path_param(params, name):
+    value = params.get(name)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"Parametro '{name}' mancante")
+    return normalize_path(value)
+
+
+def _validate_delete(params):
+    path = _path_param(params, "path")
+    if path == "/":
+        raise ValueError("Impossibile eliminare la directory radice")
+    return {"path": path}
+
+
+async def delete_tree(params, progress, user_id="default_user"):
+    """Elimina definitivamente un nodo e il suo sottoalbero a lotti"""
+    path = params["path"]
+    if (
+        await filesystem_collection.find_one({"path": path, "user_id": user_id}, {"_id": 1}) is None
+        or await is_trashed(path, user_id)
+    ):
+        raise ValueError(f"{path}: elemento non trovato")
+    subtree = {"path": {"$regex": subtree_regex(path)}, "user_id": user_id}
+    total = await filesystem_collection.count_documents(subtree) + 1
+    await progress.update(done=0, total=total)
+    deleted = await delete_subtree_in_batches(path, JOB_BATCH_SIZE, progress.advance, user_id)
+    return {"deleted": deleted}
+
+
+def _validate_purge(params):
+    validated = {}
+    if params.get("paths") is not None:
+        if not isinstance(params["paths"], list):
+            raise ValueError("Parametro 'paths' non valido")
+        validated["paths"] = [normalize_path(path) for path in params["paths"]]
+    if params.get("older_than_seconds") is not None:
+        validated["older_than_seconds"] = float(params["older_than_seconds"])
+    return validated
+
+
+async def purge_trash(params, progress, user_id="default_user"):
+    """Elimina definitivamente le radici nel cestino (tutte, quelle indicate o le più vecchie)"""
+    query = {"user_id": user_id, **IS_TRASHED}
+    if "paths" in params:
+        query["path"] = {"$in": params["paths"]}
+    if "older_than_seconds" in params:
+        query[TRASHED_FIELD] = {
+            "$type": "date",
+            "$lt": datetime.utcnow() - timedelta(seconds=params["older_than_seconds"])
+        }
+    roots = await filesystem_collection.find(query, {"path": 1}).to_list(None)
+    total = len(roots)
+    for root in roots:
+        total += await filesystem_collection.count_documents(
+            {"path": {"$regex": subtree_regex(root["path"])}, "user_id": user_id}
+        )
+    await progress.update(done=0, total=total)
+
+    purged = 0
+    stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    for root in roots:
+        # Da qui il nodo non è più ripristinabile; un purge interrotto può essere ripreso
+        claimed = await filesystem_collection.update_one(
+            {"_id": root["_id"], **IS_TRASHED, "$or": [{PURGING_FIELD: None}, {PURGING_FIELD: {"$lt": stale}}]},
+            {"$set": {PURGING_FIELD: datetime.utcnow()}}
+        )
+        if claimed.matched_count == 0:
+            continue
+        purged += await delete_subtree_in_batches(root["path"], JOB_BATCH_SIZE, progress.advance, user_id)
+    return {"purged": purged}
+
+
+def _validate_copy(params):
+    source = _path_param(params, "source")
+    destination = _path_param(params, "destination")
+    if source == "/" or is_within(destination, source):
+        raise ValueError("La destinazione non può trovarsi dentro la sorgente")
+    return {"source": source, "destination": destination}
+
+
+async def copy_tree(params, progress, user_id="default_user"):
+    """Copia un nodo e il suo sottoalbero sotto un nuovo path"""
+    source, destination = params["source"], params["destination"]
+    root = await filesystem_collection.find_one({"path": source, "user_id": user_id})
+    trashed = await trash_filter(user_id)
+    if root is None or trashed(source):
+        raise ValueError(f"{source}: elemento non trovato")
+    subtree = {"path": {"$regex": subtree_regex(source)}, "user_id": user_id}
+    total = 1 + (await filesystem_collection.count_documents(subtree) if root["type"] == "folder" else 0)
+    await progress.update(done=0, total=total)
+
+    now = datetime.utcnow()
+
+    def relocated(node):
+        copy = {key: value for key, value in node.items() if key != "_id"}
+        copy["path"] = destination + node["path"][len(source):]
+        copy["parent_path"] = parent_of(copy["path"])
+        copy["created_at"] = now
+        copy["modified_at"] = now
+        copy[VERSION_FIELD] = INITIAL_VERSION
+        return copy
+
+    node = relocated(root)
+    node["name"] = base_name(destination)
+    try:
+        await create_node(node)
+    except NodeExistsError:
+        raise ValueError(f"{destination}: esiste già") from None
+    except ParentNotFoundError:
+        raise ValueError(f"{parent_of(destination)}: directory non trovata") from None
+    await progress.advance(1)
+    if root["type"] != "folder":
+        return {"copied": 1}
+
+    copied = 1
+    last_path = ""
+    try:
+        while True:
+            # Ordine crescente: ogni cartella viene copiata prima del suo contenuto
+            batch = await filesystem_collection.find(
+                {"path": {"$regex": subtree_regex(source), "$gt": last_path}, "user_id": user_id}
+            ).sort("path", 1).limit(JOB_BATCH_SIZE).to_list(JOB_BATCH_SIZE)
+            if not batch:
+                break
+            # I sottoalberi nel cestino non vengono copiati
+            copies = [relocated(item) for item in batch if not trashed(item["path"])]
+            if copies:
+                await filesystem_collection.insert_many(copies)
+            copied += len(copies)
+            last_path = batch[-1]["path"]
+            await progress.advance(len(batch))
+    finally:
+        invalidate_filesystem_path(destination, subtree=True)
+    return {"copied": copied}
+
+
+async def reindex(params, progress):
+    """Ricrea gli indici mancanti"""
+    await progress.update(done=0, total=1, message="Creazione degli indici")
+    await ensure_indexes()
+    await progress.advance(1)
+    return {"indexes": "ok"}
+
+
+job_manager.register("delete", delete_tree, _validate_delete)
+job_manager.register("copy", copy_tree, _validate_copy)
+job_manager.register("reindex", reindex, lambda params: {})
+job_manager.register("purge_trash", purge_trash, _validate_purge)
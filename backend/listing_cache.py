@@ -0,0 +1,150 @@
+"""Cache condivisa degli elenchi di directory
+
+Gli elenchi per (user_id, parent_path) vengono letti dal file manager e da
+"ls" del terminale; sono tenuti in una LRU limitata in byte e invalidati in
+modo puntuale dalle operazioni che modificano il filesystem.
+
+Una lettura dal database può sovrapporsi a una modifica della stessa
+directory: chi riempie la cache legge la generazione della directory prima
+della query e passa a put, che scarta l'elenco se nel frattempo c'è stata
+un'invalidazione (locale o ricevuta dal bus di coerenza).
+"""
+import itertools
+import os
+from collections import OrderedDict
+from cache import LRUCache
+from database import filesystem_collection
+from http_cache import compute_etag
+from metrics import registry
+from models import FileSystemItem
+from paths import is_within
+from serialization import model_projection
+from trash import NOT_TRASHED, is_trashed
+
+LISTING_CACHE_MAX_ENTRIES = int(os.environ.get("LISTING_CACHE_MAX_ENTRIES", "1024"))
+LISTING_CACHE_MAX_BYTES = int(os.environ.get("LISTING_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Directory di cui si ricorda la generazione; le più vecchie ricadono nella generazione minima
+_MAX_GENERATIONS = 4096
+
+# Campi usati per l'ETag (vedi http_cache.VERSION_FIELDS), letti anche negli elenchi parziali
+_ETAG_FIELDS = {"id", "modified_at", "version"}
+# Stima dell'occupazione di un documento esclusi i contenuti
+_ITEM_OVERHEAD_BYTES = 256
+
+listing_cache_requests = registry.counter(
+    "futureos_listing_cache_requests_total",
+    "Letture della cache degli elenchi di directory",
+    ("result",),
+)
+listing_cache_bytes = registry.gauge(
+    "futureos_listing_cache_bytes",
+    "Occupazione stimata della cache degli elenchi di directory",
+)
+listing_cache_entries = registry.gauge(
+    "futureos_listing_cache_entries",
+    "Numero di elenchi di directory in cache",
+)
+
+
+class Listing:
+    """Elenco di una directory con il relativo ETag"""
+
+    __slots__ = ("items", "etag", "size")
+
+    def __init__(self, items):
+        self.items = items
+        self.etag = compute_etag(sorted(items, key=lambda item: item["id"]))
+        self.size = sum(_ITEM_OVERHEAD_BYTES + len(item.get("content") or "") for item in items)
+
+
+class ListingCache:
+    def __init__(self, max_entries=LISTING_CACHE_MAX_ENTRIES, max_bytes=LISTING_CACHE_MAX_BYTES):
+        self._cache = LRUCache(max_entries, max_bytes, sizeof=lambda listing: listing.size)
+        self._clock = itertools.count(1)
+        # Generazione delle directory invalidate di recente; le altre valgono _floor
+        self._generations = OrderedDict()
+        self._floor = 0
+
+    def get(self, user_id, parent_path):
+        listing = self._cache.get((user_id, parent_path))
+        listing_cache_requests.inc(result="miss" if listing is None else "hit")
+        return listing
+
+    def generation(self, user_id, parent_path):
+        """Da leggere prima della query che riempirà la cache, e da passare a put"""
+        return self._generations.get((user_id, parent_path), self._floor)
+
+    def put(self, user_id, parent_path, items, generation=None):
+        listing = Listing(items)
+        if generation is not None and generation != self.generation(user_id, parent_path):
+            # La directory è cambiata durante la lettura: l'elenco può essere vecchio
+            listing_cache_requests.inc(result="stale")
+            return listing
+        self._cache.set((user_id, parent_path), listing)
+        self._update_gauges()
+        return listing
+
+    def invalidate(self, user_id, parent_path):
+        key = (user_id, parent_path)
+        self._cache.pop(key)
+        self._generations.pop(key, None)
+        self._generations[key] = next(self._clock)
+        if len(self._generations) > _MAX_GENERATIONS:
+            # La generazione minima sale: le letture in corso sulle directory dimenticate vengono scartate
+            _, evicted = self._generations.popitem(last=False)
+            self._floor = max(self._floor, evicted)
+        self._update_gauges()
+
+    def invalidate_subtree(self, user_id, path):
+        """Invalida gli elenchi di path e di tutte le directory al suo interno"""
+        self._cache.invalidate(lambda key: key[0] == user_id and is_within(key[1], path))
+        self._advance_floor()
+        self._update_gauges()
+
+    def clear(self):
+        self._cache.clear()
+        self._advance_floor()
+        self._update_gauges()
+
+    def _advance_floor(self):
+        # Cambia la generazione di tutte le directory, comprese quelle in lettura e non ancora in cache
+        self._floor = next(self._clock)
+        self._generations.clear()
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    def _update_gauges(self):
+        listing_cache_bytes.set(self._cache.current_bytes)
+        listing_cache_entries.set(len(self._cache))
+
+
+listing_cache = ListingCache()
+
+
+async def get_listing(parent_path, user_id="default_user", fields=None):
+    """Restituisce l'elenco della directory, dalla cache o da MongoDB
+
+    Con fields, se l'elenco non è in cache vengono letti solo i campi scelti
+    (più quelli dell'ETag) e il risultato parziale non viene messo in cache.
+    """
+    listing = listing_cache.get(user_id, parent_path)
+    if listing is None:
+        generation = listing_cache.generation(user_id, parent_path)
+        if await is_trashed(parent_path, user_id):
+            # Directory nel cestino (o dentro una cartella nel cestino): vuota e non in cache
+            return Listing([])
+        projected_fields = None if fields is None else fields | _ETAG_FIELDS
+        items = await filesystem_collection.aggregate([
+            {"$match": {"parent_path": parent_path, "user_id": user_id, **NOT_TRASHED}},
+            model_projection(FileSystemItem, projected_fields)
+        ]).to_list(1000)
+        if fields is not None:
+            return Listing(items)
+        listing = listing_cache.put(user_id, parent_path, items, generation=generation)
+    return listing
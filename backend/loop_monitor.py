@@ -0,0 +1,164 @@
+"""Monitoraggio del ritardo dell'event loop e rilevamento delle chiamate bloccanti
+
+Un task heartbeat si risveglia a intervallo fisso e misura di quanto arriva in
+ritardo. Un thread watchdog controlla che l'heartbeat avanzi: se resta fermo
+oltre la soglia, cattura lo stack del thread dell'event loop e cerca il
+frame dell'handler di una route, così il tempo di blocco viene attribuito
+alla route che lo ha causato. Il costo a regime è un risveglio per intervallo;
+lo stack viene catturato solo durante i blocchi.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from fastapi.routing import APIRoute
+from metrics import registry, LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.environ.get("LOOP_MONITOR", "1") != "0"
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", "250"))
+MAX_RECENT_BLOCKS = 50
+MAX_STACK_FRAMES = 30
+
+event_loop_lag = registry.histogram(
+    "futureos_event_loop_lag_seconds",
+    "Ritardo dell'heartbeat dell'event loop rispetto all'orario previsto",
+    buckets=LATENCY_BUCKETS,
+)
+event_loop_blocks_total = registry.counter(
+    "futureos_event_loop_blocks_total",
+    "Blocchi dell'event loop oltre la soglia, per route responsabile",
+    ("route",),
+)
+event_loop_blocked_seconds_total = registry.counter(
+    "futureos_event_loop_blocked_seconds_total",
+    "Tempo di blocco dell'event loop oltre la soglia, per route responsabile",
+    ("route",),
+)
+
+
+class LoopMonitor:
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL, threshold_ms=LOOP_BLOCK_THRESHOLD_MS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.last_lag = None
+        self.max_lag = 0.0
+        self._routes = {}
+        self._recent = deque(maxlen=MAX_RECENT_BLOCKS)
+        self._lock = threading.Lock()
+        self._beat = None
+        self._stall = None
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def _index_routes(self, app):
+        """Associa il codice di ogni handler alla sua route"""
+        for route in app.routes:
+            if isinstance(route, APIRoute):
+                methods = ",".join(sorted(route.methods))
+                self._routes[route.endpoint.__code__] = f"{methods} {route.path}"
+
+    def _route_of(self, frame):
+        while frame is not None:
+            route = self._routes.get(frame.f_code)
+            if route is not None:
+                return route
+            frame = frame.f_back
+        return "unknown"
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            event_loop_lag.observe(lag)
+            if lag >= self.threshold:
+                self._record_block(lag)
+
+    def _record_block(self, lag):
+        with self._lock:
+            stall, self._stall = self._stall, None
+        route = stall["route"] if stall else "unknown"
+        event_loop_blocks_total.inc(route=route)
+        event_loop_blocked_seconds_total.inc(lag, route=route)
+        self._recent.append({
+            "at": datetime.utcnow().isoformat(),
+            "route": route,
+            "lag_ms": round(lag * 1000, 1),
+            "stack": stall["stack"] if stall else None,
+        })
+        logger.warning(f"Event loop bloccato per {lag * 1000:.0f} ms (route: {route})")
+
+    def _watch(self):
+        """Thread watchdog: cattura lo stack del loop quando l'heartbeat è fermo"""
+        while not self._stopping.wait(self.interval / 2):
+            beat = self._beat
+            if beat is None or time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            with self._lock:
+                if self._stall is not None:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stall = {
+                "route": self._route_of(frame),
+                "stack": traceback.format_list(traceback.extract_stack(frame)[-MAX_STACK_FRAMES:]),
+            }
+            del frame
+            with self._lock:
+                self._stall = stall
+
+    def start(self, app):
+        if self._task is not None:
+            return
+        self._index_routes(app)
+        self._loop_thread_id = threading.get_ident()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="futureos-loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Monitor dell'event loop attivo (soglia {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog.join(timeout=1)
+        self._watchdog = None
+
+    def report(self):
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "last_lag_ms": round(self.last_lag * 1000, 3) if self.last_lag is not None else None,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "recent_blocks": list(reversed(self._recent)),
+        }
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,255 @@
+"""Job di manutenzione eseguiti dallo scheduler"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from content_codec import CODEC_FIELD, CONTENT_COMPRESSION_MIN_BYTES, encode_content
+from content_store import REF_FIELD, content_store
+from database import (
+    ensure_indexes, filesystem_collection, jobs_collection, notepad_files_collection, terminal_history_collection
+)
+from filesystem_ops import scavenge_orphans
+from invalidation import invalidate_filesystem_path
+from jobs import job_manager
+from offload import buffer_pool
+from trash import TRASH_RETENTION_SECONDS, TRASHED_FIELD
+from versioning import VERSION_FIELD, VERSION_INCREMENT
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_HISTORY_MAX_ENTRIES = int(os.environ.get("TERMINAL_HISTORY_MAX_ENTRIES", "1000"))
+CONTENT_MIGRATION_BATCH = int(os.environ.get("CONTENT_MIGRATION_BATCH", "100"))
+
+
+async def prune_terminal_history(max_entries=TERMINAL_HISTORY_MAX_ENTRIES):
+    """Mantiene solo le voci più recenti della cronologia di ogni utente"""
+    removed = 0
+    for user_id in await terminal_history_collection.distinct("user_id"):
+        # Timestamp della voce più vecchia da conservare
+        boundary = await terminal_history_collection.find(
+            {"user_id": user_id}, {"timestamp": 1}
+        ).sort("timestamp", -1).skip(max_entries - 1).limit(1).to_list(1)
+        if not boundary or boundary[0].get("timestamp") is None:
+            continue
+        result = await terminal_history_collection.delete_many({
+            "user_id": user_id,
+            "$or": [
+                {"timestamp": {"$lt": boundary[0]["timestamp"]}},
+                {"timestamp": None}
+            ]
+        })
+        removed += result.deleted_count
+    if removed:
+        logger.info(f"Cronologia terminale: rimosse {removed} voci")
+    return removed
+
+
+async def recompute_sizes(batch_size=CONTENT_MIGRATION_BATCH):
+    """Riallinea il campo size dei file alla lunghezza del contenuto
+
+    I file vengono letti a lotti in ordine di _id e la lunghezza è calcolata
+    dal database, quindi i contenuti non vengono mai trasferiti. L'aggiornamento
+    è condizionato alla versione letta: ogni scrittura la incrementa, quindi una
+    scrittura concorrente vince sempre. Ogni file aggiornato viene invalidato
+    nelle cache, come per le altre scritture.
+    """
+    updated = 0
+    last_id = None
+    while True:
+        query = {
+            "type": "file",
+            "content": {"$type": "string"},
+            "$expr": {"$ne": [{"$ifNull": ["$size", -1]}, {"$strLenCP": "$content"}]}
+        }
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        mismatched = await filesystem_collection.aggregate([
+            {"$match": query},
+            {"$sort": {"_id": 1}},
+            {"$limit": batch_size},
+            {"$project": {
+                "_id": 1, "path": 1, "parent_path": 1, "user_id": 1, VERSION_FIELD: 1,
+                "length": {"$strLenCP": "$content"}
+            }}
+        ]).to_list(batch_size)
+        for item in mismatched:
+            result = await filesystem_collection.update_one(
+                {"_id": item["_id"], VERSION_FIELD: item.get(VERSION_FIELD)},
+                {"$set": {"size": item["length"]}, **VERSION_INCREMENT}
+            )
+            if result.modified_count:
+                invalidate_filesystem_path(
+                    item["path"], parent_path=item.get("parent_path"), user_id=item.get("user_id", "default_user")
+                )
+                updated += result.modified_count
+        if len(mismatched) < batch_size:
+            break
+        last_id = mismatched[-1]["_id"]
+        # Lascia spazio alle richieste tra un lotto e l'altro
+        await asyncio.sleep(0.05)
+    if updated:
+        logger.info(f"Dimensioni ricalcolate per {updated} file")
+    return updated
+
+
+async def compress_existing_contents(batch_size=CONTENT_MIGRATION_BATCH):
+    """Comprime i contenuti salvati prima dell'introduzione del codec
+
+    I documenti scritti dopo hanno sempre il campo content_codec (anche nullo),
+    quindi vengono considerati solo quelli che non lo hanno. L'aggiornamento è
+    condizionato al contenuto letto: una scrittura concorrente vince sempre.
+    """
+    migrated = 0
+    for collection in (filesystem_collection, notepad_files_collection):
+        last_id = None
+        while True:
+            query = {
+                "content": {"$type": "string"},
+                CODEC_FIELD: {"$exists": False},
+                # size conta i caratteri: è un limite inferiore dei byte UTF-8
+                "size": {"$gte": CONTENT_COMPRESSION_MIN_BYTES // 4},
+            }
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            documents = await collection.find(
+                query, {"_id": 1, "content": 1}
+            ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not documents:
+                break
+
+            for document in documents:
+                result = await collection.update_one(
+                    {"_id": document["_id"], "content": document["content"], CODEC_FIELD: {"$exists": False}},
+                    {"$set": await encode_content(document["content"])}
+                )
+                migrated += result.modified_count
+            last_id = documents[-1]["_id"]
+            # Lascia spazio alle richieste tra un lotto e l'altro
+            await asyncio.sleep(0.05)
+    if migrated:
+        logger.info(f"Contenuti migrati al formato compresso: {migrated}")
+    return migrated
+
+
+async def compact_content_segments():
+    """Riscrive i record vivi dei segmenti con molto spazio libero e rimuove quelli svuotati
+
+    Le operazioni sui file (stat, copia dei record, eliminazione) girano nel
+    pool di thread, fuori dall'event loop.
+    """
+    removed = await buffer_pool.submit(content_store.delete_retired, task="content_compaction")
+    collections = (filesystem_collection, notepad_files_collection)
+
+    live_bytes = {}
+    for collection in collections:
+        rows = await collection.aggregate([
+            {"$match": {REF_FIELD: {"$ne": None}}},
+            {"$group": {"_id": f"${REF_FIELD}.segment", "live": {"$sum": f"${REF_FIELD}.length"}}}
+        ]).to_list(None)
+        for row in rows:
+            live_bytes[row["_id"]] = live_bytes.get(row["_id"], 0) + row["live"]
+
+    moved = 0
+    candidates = await buffer_pool.submit(
+        content_store.compaction_candidates, live_bytes, task="content_compaction"
+    )
+    for segment in candidates:
+        for collection in collections:
+            documents = await collection.find(
+                {f"{REF_FIELD}.segment": segment}, {"_id": 1, "path": 1, REF_FIELD: 1}
+            ).to_list(None)
+            new_refs = await buffer_pool.submit(
+                content_store.copy_records, [document[REF_FIELD] for document in documents],
+                task="content_compaction"
+            )
+            for document, new_ref in zip(documents, new_refs):
+                # Se il contenuto è cambiato nel frattempo il nuovo record resta inutilizzato
+                result = await collection.update_one(
+                    {"_id": document["_id"], REF_FIELD: document[REF_FIELD]},
+                    {"$set": {REF_FIELD: new_ref}}
+                )
+                if result.modified_count and collection is filesystem_collection:
+                    invalidate_filesystem_path(document["path"])
+                moved += result.modified_count
+        # Eliminato al prossimo passaggio, quando le letture in corso sono concluse
+        content_store.retire(segment)
+
+    if moved or removed:
+        logger.info(f"Compattazione contenuti: {moved} record spostati, {removed} segmenti eliminati")
+    return moved
+
+
+async def release_content_maps():
+    """Rilascia le mappe dei segmenti eliminati dalla compattazione (in ogni worker)"""
+    return await buffer_pool.submit(content_store.release_missing, task="content_compaction")
+
+
+async def purge_expired_trash(retention_seconds=TRASH_RETENTION_SECONDS):
+    """Accoda l'eliminazione definitiva dei nodi nel cestino da più di retention_seconds"""
+    cutoff = datetime.utcnow() - timedelta(seconds=retention_seconds)
+    expired = await filesystem_collection.find_one(
+        {"user_id": "default_user", TRASHED_FIELD: {"$type": "date", "$lt": cutoff}}, {"_id": 1}
+    )
+    if expired is None:
+        return None
+    # Un purge già in coda o in esecuzione se ne occuperà
+    pending = await jobs_collection.find_one(
+        {"type": "purge_trash", "status": {"$in": ["queued", "running"]}}, {"_id": 1}
+    )
+    if pending is not None:
+        return None
+    job_id = await job_manager.submit("purge_trash", {"older_than_seconds": retention_seconds})
+    logger.info(f"Cestino: accodata l'eliminazione dei nodi scaduti (job {job_id})")
+    return job_id
+
+
+def register_maintenance_jobs(scheduler):
+    """Registra i job di manutenzione sullo scheduler"""
+    scheduler.every(
+        "orphan_scavenger",
+        float(os.environ.get("ORPHAN_SCAVENGE_INTERVAL", "3600")),
+        scavenge_orphans
+    )
+    scheduler.every(
+        "prune_terminal_history",
+        float(os.environ.get("HISTORY_PRUNE_INTERVAL", "600")),
+        prune_terminal_history
+    )
+    scheduler.every(
+        "recompute_sizes",
+        float(os.environ.get("SIZE_RECOMPUTE_INTERVAL", "3600")),
+        recompute_sizes
+    )
+    scheduler.every(
+        "check_indexes",
+        float(os.environ.get("INDEX_CHECK_INTERVAL", "86400")),
+        ensure_indexes
+    )
+    scheduler.every(
+        "compress_existing_contents",
+        float(os.environ.get("CONTENT_MIGRATION_INTERVAL", "3600")),
+        compress_existing_contents,
+        run_at_start=True
+    )
+    scheduler.every(
+        "fail_stale_jobs",
+        float(os.environ.get("JOB_STALE_CHECK_INTERVAL", "60")),
+        job_manager.fail_stale_jobs
+    )
+    scheduler.every(
+        "purge_expired_trash",
+        float(os.environ.get("TRASH_PURGE_INTERVAL", "3600")),
+        purge_expired_trash
+    )
+    if content_store is not None:
+        scheduler.every(
+            "compact_content_segments",
+            float(os.environ.get("CONTENT_COMPACTION_INTERVAL", "3600")),
+            compact_content_segments
+        )
+        scheduler.every(
+            "release_content_maps",
+            float(os.environ.get("CONTENT_COMPACTION_INTERVAL", "3600")),
+            release_content_maps,
+            leader_only=False
+        )
@@ -0,0 +1,350 @@
+"""Metriche in stile Prometheus per FutureOS API
+
+Contiene un piccolo registro di contatori, gauge e istogrammi esposto in
+formato testuale su /api/metrics, il middleware che misura ogni richiesta
+HTTP e il listener dei comandi MongoDB.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from pymongo import monitoring
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket di default per le latenze (secondi) e per le dimensioni (byte)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Etichette non valide per {self.name}: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        """Elimina la serie con queste etichette (non compare più nell'esportazione)"""
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        return Counter.collect(self)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def collect(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro delle metriche esposte in formato testuale Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Metriche HTTP
+http_requests_total = registry.counter(
+    "futureos_http_requests_total",
+    "Numero di richieste HTTP servite",
+    ("method", "route", "status"),
+)
+http_request_duration = registry.histogram(
+    "futureos_http_request_duration_seconds",
+    "Latenza delle richieste HTTP",
+    ("method", "route"),
+)
+http_request_db_time = registry.histogram(
+    "futureos_http_request_db_seconds",
+    "Tempo speso in MongoDB per ogni richiesta HTTP",
+    ("method", "route"),
+)
+http_response_size = registry.histogram(
+    "futureos_http_response_size_bytes",
+    "Dimensione del corpo delle risposte HTTP",
+    ("method", "route"),
+    buckets=SIZE_BUCKETS,
+)
+
+# Metriche del terminale
+terminal_command_duration = registry.histogram(
+    "futureos_terminal_command_duration_seconds",
+    "Durata dei comandi eseguiti da /terminal/execute",
+    ("command",),
+)
+
+# Metriche MongoDB
+mongo_operations_total = registry.counter(
+    "futureos_mongo_operations_total",
+    "Numero di comandi MongoDB eseguiti",
+    ("collection", "command", "status"),
+)
+mongo_operation_duration = registry.histogram(
+    "futureos_mongo_operation_duration_seconds",
+    "Durata dei comandi MongoDB",
+    ("collection", "command"),
+)
+mongo_pool_connections = registry.gauge(
+    "futureos_mongo_pool_connections",
+    "Connessioni del pool MongoDB (open: aperte, in_use: assegnate a un'operazione)",
+    ("state",),
+)
+
+# Tempo MongoDB accumulato dalla richiesta HTTP corrente
+_request_db_time = ContextVar("request_db_time", default=None)
+
+
+class _DbTimer:
+    __slots__ = ("seconds",)
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+class MetricsMiddleware:
+    """Middleware ASGI che misura latenza, tempo DB e dimensione delle risposte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timer = _DbTimer()
+        token = _request_db_time.set(timer)
+        state = {"status": 500, "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db_time.reset(token)
+            # Usa il template della route per non esplodere la cardinalità
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests_total.inc(method=method, route=route_path, status=state["status"])
+            http_request_duration.observe(elapsed, method=method, route=route_path)
+            http_request_db_time.observe(timer.seconds, method=method, route=route_path)
+            http_response_size.observe(state["size"], method=method, route=route_path)
+
+
+def _command_collection(event_command, command_name):
+    """Estrae il nome della collection dal documento del comando"""
+    if command_name == "getMore":
+        return event_command.get("collection", "")
+    target = event_command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Listener pymongo che conta e cronometra ogni comando MongoDB"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = _command_collection(event.command, event.command_name)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, status):
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1_000_000
+        mongo_operations_total.inc(collection=collection, command=event.command_name, status=status)
+        mongo_operation_duration.observe(seconds, collection=collection, command=event.command_name)
+        # Motor propaga il contesto nell'executor: accumula il tempo sulla richiesta
+        timer = _request_db_time.get()
+        if timer is not None:
+            timer.seconds += seconds
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Listener pymongo che tiene il conto delle connessioni aperte e in uso"""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc(state="open")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_connections.dec(state="open")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        mongo_pool_connections.inc(state="in_use")
+
+    def connection_checked_in(self, event):
+        mongo_pool_connections.dec(state="in_use")
@@ -38,6 +38,7 @@ class FileSystemItem(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     modified_at: datetime = Field(default_factory=datetime.utcnow)
     user_id: str = "default_user"
+    version: int = 0  # Incrementata a ogni scrittura, per If-Match
 
 class FileSystemItemCreate(BaseModel):
     name: str
@@ -50,6 +51,20 @@ class FileSystemItemUpdate(BaseModel):
     name: Optional[str] = None
     content: Optional[str] = None
 
+class FileSystemBatchRequest(BaseModel):
+    paths: List[str] = []  # Elementi da leggere
+    parent_paths: List[str] = []  # Directory da elencare
+    fields: Optional[List[str]] = None  # Campi da restituire, tutti se assente
+    include_settings: bool = False
+
+class TrashItem(BaseModel):
+    path: str  # Path di origine, usato per il ripristino
+    name: str
+    type: str
+    size: Optional[int] = None
+    trashed_at: datetime
+    version: int = 0
+
 # Terminal History Model
 class TerminalHistoryEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -64,6 +79,46 @@ class TerminalHistoryCreate(BaseModel):
     output: str
     directory: str
 
+class TerminalHistoryRecall(BaseModel):
+    id: str
+    command: str
+    directory: str
+    timestamp: Optional[datetime] = None
+    output: Optional[str] = None  # Solo se richiesto con include_output
+
+class TerminalHistoryPage(BaseModel):
+    entries: List[TerminalHistoryRecall]
+    next_before: Optional[str] = None  # Cursore per la pagina successiva (più vecchia)
+
+class TerminalCompletion(BaseModel):
+    token: str  # Parola completata (l'ultima della riga)
+    kind: str  # "command" o "path"
+    candidates: List[str]  # Testo che sostituisce token; le directory terminano con "/"
+    complete: bool = True  # False se l'elenco è stato troncato o la ricerca è scaduta
+
+# Job Models
+class JobCreate(BaseModel):
+    type: str  # "delete", "copy", "reindex" o "purge_trash"
+    params: Dict[str, Any] = {}
+
+class JobProgress(BaseModel):
+    done: int = 0
+    total: Optional[int] = None
+
+class Job(BaseModel):
+    id: str
+    type: str
+    params: Dict[str, Any] = {}
+    status: str  # "queued", "running", "succeeded", "failed" o "cancelled"
+    progress: JobProgress = JobProgress()
+    message: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Notepad Files Model
 class NotepadFile(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -74,6 +129,7 @@ class NotepadFile(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     modified_at: datetime = Field(default_factory=datetime.utcnow)
     user_id: str = "default_user"
+    version: int = 0  # Incrementata a ogni scrittura, per If-Match
 
 class NotepadFileCreate(BaseModel):
     name: str
@@ -93,4 +149,15 @@ class SystemInfo(BaseModel):
     memory_ram: str = "8 GB"
     disk_space: str = "256 GB SSD"
     uptime: str
-    current_user: str = "user"
\ No newline at end of file
+    current_user: str = "user"
+    # Stato reale del server, dall'ultimo campione del monitor (None se non ancora disponibile)
+    disk_free: Optional[str] = None
+    process_rss_bytes: Optional[int] = None
+    cpu_percent: Optional[float] = None
+    event_loop_lag_ms: Optional[float] = None
+    open_connections: Optional[int] = None
+    mongo_pool_open: Optional[int] = None
+    mongo_pool_in_use: Optional[int] = None
+    storage_used_bytes: Optional[int] = None
+    storage_items: Optional[int] = None
+    sampled_at: Optional[datetime] = None
\ No newline at end of file
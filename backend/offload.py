@@ -0,0 +1,127 @@
+"""Esecuzione del lavoro CPU-bound fuori dall'event loop
+
+Il lavoro in puro Python (per esempio la costruzione dell'albero del
+filesystem) va in un ProcessPoolExecutor limitato, così non tiene il GIL del
+worker. Il lavoro su buffer grandi (compressione, hashing) va invece in un
+pool di thread: zlib, brotli e hashlib rilasciano il GIL e il buffer viene
+passato come memoryview, senza copie. Sotto la soglia indicata dal chiamante
+la funzione gira inline, perché il costo del passaggio al pool supererebbe il
+lavoro stesso.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CPU_POOL_KIND = os.environ.get("CPU_POOL_KIND", "process")
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+BUFFER_POOL_WORKERS = int(os.environ.get("BUFFER_POOL_WORKERS", "4"))
+# Lavori ammessi contemporaneamente (in esecuzione o in coda) per ciascun pool
+CPU_POOL_MAX_PENDING = int(os.environ.get("CPU_POOL_MAX_PENDING", "64"))
+
+offload_queue_depth = registry.gauge(
+    "futureos_offload_queue_depth",
+    "Lavori inviati al pool e non ancora completati",
+    ("pool",),
+)
+offload_wait_seconds = registry.histogram(
+    "futureos_offload_wait_seconds",
+    "Attesa tra l'invio di un lavoro al pool e l'inizio dell'esecuzione",
+    ("pool", "task"),
+)
+offload_run_seconds = registry.histogram(
+    "futureos_offload_run_seconds",
+    "Durata dei lavori eseguiti nel pool",
+    ("pool", "task"),
+)
+offload_inline_total = registry.counter(
+    "futureos_offload_inline_total",
+    "Lavori eseguiti inline perché sotto soglia",
+    ("task",),
+)
+
+
+def _timed_call(func, args):
+    """Eseguita nel worker: restituisce l'istante di inizio insieme al risultato"""
+    started = time.time()
+    return started, func(*args)
+
+
+class OffloadPool:
+    def __init__(self, name, factory, max_pending=CPU_POOL_MAX_PENDING):
+        self.name = name
+        self._factory = factory
+        self._executor = None
+        self._semaphore = asyncio.Semaphore(max_pending)
+        self._pending = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = self._factory()
+        return self._executor
+
+    async def submit(self, func, *args, task="generic"):
+        self._pending += 1
+        offload_queue_depth.set(self._pending, pool=self.name)
+        submitted = time.time()
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                started, result = await loop.run_in_executor(
+                    self._get_executor(), _timed_call, func, args
+                )
+        finally:
+            self._pending -= 1
+            offload_queue_depth.set(self._pending, pool=self.name)
+        offload_wait_seconds.observe(max(0.0, started - submitted), pool=self.name, task=task)
+        offload_run_seconds.observe(time.time() - started, pool=self.name, task=task)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _cpu_executor_factory():
+    if CPU_POOL_KIND == "thread":
+        return ThreadPoolExecutor(CPU_POOL_WORKERS, thread_name_prefix="futureos-cpu")
+    # spawn: i worker non ereditano i thread e il client MongoDB del processo padre
+    return ProcessPoolExecutor(CPU_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+cpu_pool = OffloadPool("cpu", _cpu_executor_factory)
+buffer_pool = OffloadPool(
+    "buffer",
+    lambda: ThreadPoolExecutor(BUFFER_POOL_WORKERS, thread_name_prefix="futureos-buffer")
+)
+
+
+async def run_cpu(func, *args, size_hint=0, threshold=0, task="generic"):
+    """Esegue func(*args) nel pool CPU se size_hint supera la soglia, altrimenti inline
+
+    func e argomenti devono essere serializzabili con pickle (funzioni di modulo).
+    """
+    if size_hint < threshold:
+        offload_inline_total.inc(task=task)
+        return func(*args)
+    return await cpu_pool.submit(func, *args, task=task)
+
+
+async def run_buffer(func, buffer, *args, threshold=0, task="generic"):
+    """Esegue func(memoryview(buffer), *args) nel pool di thread senza copiare il buffer"""
+    view = memoryview(buffer)
+    if view.nbytes < threshold:
+        offload_inline_total.inc(task=task)
+        return func(view, *args)
+    return await buffer_pool.submit(func, view, *args, task=task)
+
+
+def shutdown_pools():
+    cpu_pool.shutdown()
+    buffer_pool.shutdown()
@@ -0,0 +1,153 @@
+"""Normalizzazione e risoluzione dei path del filesystem virtuale
+
+I path seguono le regole POSIX: "~" è la home dell'utente, "." e ".."
+vengono risolti e gli slash ripetuti collassati. I nodi risolti vengono
+tenuti in una cache LRU per sessione del terminale, invalidata dalle
+operazioni che modificano il filesystem. La cache tiene solo tipo e path dei
+nodi, mai i contenuti, ed è limitata anche nella sua occupazione complessiva.
+"""
+import os
+import re
+from cache import LRUCache
+from database import filesystem_collection
+from content_codec import CODEC_FIELD, REF_FIELD, decoded
+from trash import is_trashed
+
+HOME_DIRECTORY = "/home/user"
+
+PATH_CACHE_MAX_SESSIONS = int(os.environ.get("PATH_CACHE_MAX_SESSIONS", "256"))
+PATH_CACHE_MAX_ENTRIES = int(os.environ.get("PATH_CACHE_MAX_ENTRIES", "512"))
+PATH_CACHE_MAX_BYTES = int(os.environ.get("PATH_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# Stima dell'occupazione di un nodo in cache, oltre ai caratteri del path
+_NODE_OVERHEAD_BYTES = 256
+
+
+def normalize_path(path, cwd="/"):
+    """Restituisce il path assoluto e normalizzato, risolto rispetto a cwd"""
+    if path == "~" or path.startswith("~/"):
+        path = HOME_DIRECTORY + path[1:]
+    if not path.startswith("/"):
+        path = f"{cwd}/{path}"
+
+    parts = []
+    for part in path.split("/"):
+        if part in ("", "."):
+            continue
+        if part == "..":
+            if parts:
+                parts.pop()
+            continue
+        parts.append(part)
+    return "/" + "/".join(parts)
+
+
+def parent_of(path):
+    """Path della directory padre ("" per la radice)"""
+    if path == "/":
+        return ""
+    parent = path.rsplit("/", 1)[0]
+    return parent or "/"
+
+
+def base_name(path):
+    return path.rsplit("/", 1)[-1] if path != "/" else "/"
+
+
+def is_within(path, root):
+    """Vero se path coincide con root o si trova al suo interno"""
+    return root == "/" or path == root or path.startswith(root.rstrip("/") + "/")
+
+
+def subtree_regex(path):
+    """Regex ancorata che seleziona i discendenti di path (non path stesso)"""
+    return f"^{re.escape(path.rstrip('/'))}/"
+
+
+def _node_size(node):
+    # Il path compare sia nella chiave sia nel nodo
+    return _NODE_OVERHEAD_BYTES + 2 * len(node["path"])
+
+
+class SessionPathCache:
+    """Cache dei nodi risolti, una LRU per ogni sessione del terminale
+
+    Oltre ai limiti per sessione, max_bytes limita l'occupazione di tutte le
+    sessioni insieme: superato il limite vengono scartate per intero le
+    sessioni usate meno di recente.
+    """
+
+    def __init__(self, max_sessions=PATH_CACHE_MAX_SESSIONS, max_entries=PATH_CACHE_MAX_ENTRIES,
+                 max_bytes=PATH_CACHE_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._sessions = LRUCache(max_entries=max_sessions)
+        # Incrementata da ogni invalidazione: un nodo letto prima non viene messo in cache
+        self.generation = 0
+
+    def _session(self, session_id, create=False):
+        session = self._sessions.get(session_id)
+        if session is None and create:
+            if len(self._sessions) >= self.max_sessions:
+                self._evict_session()
+            session = LRUCache(max_entries=self.max_entries, sizeof=_node_size)
+            self._sessions.set(session_id, session)
+        return session
+
+    def _evict_session(self):
+        _, session = self._sessions.popitem()
+        self.current_bytes -= session.current_bytes
+
+    def get(self, session_id, path):
+        session = self._session(session_id)
+        return session.get(path) if session is not None else None
+
+    def put(self, session_id, path, node, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        session = self._session(session_id, create=True)
+        before = session.current_bytes
+        session.set(path, {"type": node["type"], "path": node["path"]})
+        self.current_bytes += session.current_bytes - before
+        while self.current_bytes > self.max_bytes and len(self._sessions) > 1:
+            self._evict_session()
+
+    def invalidate(self, path, subtree=False):
+        """Invalida il nodo (e con subtree=True i suoi discendenti) in tutte le sessioni"""
+        self.generation += 1
+        for session in self._sessions.values():
+            before = session.current_bytes
+            if subtree:
+                session.invalidate(lambda key: is_within(key, path))
+            else:
+                session.pop(path)
+            self.current_bytes += session.current_bytes - before
+
+    def clear(self):
+        self.generation += 1
+        self._sessions.clear()
+        self.current_bytes = 0
+
+
+path_cache = SessionPathCache()
+
+
+async def resolve_node(session_id, path, with_content=False):
+    """Restituisce tipo (ed eventualmente contenuto) del nodo al path, o None"""
+    cached = path_cache.get(session_id, path)
+    # La cache non tiene i contenuti: la lettura di un file con contenuto va sempre al database
+    if cached is not None and (not with_content or cached["type"] != "file"):
+        return cached
+
+    projection = {"_id": 0, "type": 1, "path": 1}
+    if with_content:
+        projection["content"] = 1
+        projection[CODEC_FIELD] = 1
+        projection[REF_FIELD] = 1
+    generation = path_cache.generation
+    node = await filesystem_collection.find_one({"path": path, "user_id": "default_user"}, projection)
+    if node is None or await is_trashed(path):
+        return None
+    path_cache.put(session_id, path, node, generation=generation)
+    return decoded(node)
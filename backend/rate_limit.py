@@ -0,0 +1,277 @@
+"""Rate limiting per utente e controllo di ammissione sulle operazioni DB
+
+Ogni classe di route (terminale, autosave del notepad) ha un token bucket per
+utente. Lo stato vive in memoria nel processo oppure, con
+RATE_LIMIT_STORE=mongo, in una collection condivisa tra più worker. In più un
+limite globale sulle richieste in corso, applicato da AdmissionMiddleware a
+tutta l'API, evita che un singolo client saturi il pool di connessioni
+MongoDB: le richieste in eccesso attendono in coda e, se la coda è piena o
+l'attesa scade, ricevono 429 con Retry-After.
+
+Dietro un load balancer o un reverse proxy l'indirizzo della connessione è
+quello del proxy: con TRUSTED_PROXIES (indirizzi o reti separati da virgole)
+il client viene letto da X-Forwarded-For, risalendo la catena da destra fino
+al primo indirizzo che non è un proxy fidato. L'header non viene mai letto se
+la connessione non arriva da un proxy fidato, perché il client può scriverlo.
+"""
+import asyncio
+import ipaddress
+import math
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from database import rate_limits_collection
+from metrics import registry
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+
+def parse_rate_limit(prefix, default_rate, default_burst, environ=None):
+    """Legge {prefix}_RATE_PER_SEC e {prefix}_RATE_BURST come (token al secondo, burst)
+
+    Solleva ValueError se il rate non è positivo (il tempo di attesa si calcola
+    dividendo per il rate) o se il burst non consente nemmeno una richiesta.
+    """
+    environ = os.environ if environ is None else environ
+    rate = float(environ.get(f"{prefix}_RATE_PER_SEC", default_rate))
+    burst = int(environ.get(f"{prefix}_RATE_BURST", default_burst))
+    if not rate > 0:
+        raise ValueError(f"{prefix}_RATE_PER_SEC deve essere positivo, non {rate}")
+    if burst < 1:
+        raise ValueError(f"{prefix}_RATE_BURST deve essere almeno 1, non {burst}")
+    return rate, burst
+
+
+# Limiti per classe di route: (token al secondo, dimensione del burst)
+RATE_LIMITS = {
+    "terminal": parse_rate_limit("TERMINAL", "10", "20"),
+    "autosave": parse_rate_limit("AUTOSAVE", "2", "10"),
+}
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.environ.get("TRUSTED_PROXIES", "").split(",") if entry.strip()
+]
+
+DB_MAX_INFLIGHT = int(os.environ.get("DB_MAX_INFLIGHT", "32"))
+DB_MAX_QUEUE = int(os.environ.get("DB_MAX_QUEUE", "128"))
+DB_QUEUE_TIMEOUT = float(os.environ.get("DB_QUEUE_TIMEOUT", "2"))
+# Route escluse dal controllo di ammissione: le metriche non usano il database e
+# gli stream SSE dei job terrebbero occupato un posto per tutta la loro durata
+ADMISSION_EXEMPT = re.compile(r"^/api/(metrics|jobs/[^/]+/events)$")
+
+rate_limited_total = registry.counter(
+    "futureos_rate_limited_total",
+    "Richieste rifiutate con 429",
+    ("route_class", "reason"),
+)
+admission_inflight = registry.gauge(
+    "futureos_admission_inflight",
+    "Richieste con accesso al database in corso",
+)
+admission_queued = registry.gauge(
+    "futureos_admission_queued",
+    "Richieste in coda per l'accesso al database",
+)
+
+
+class MemoryRateLimitStore:
+    """Token bucket in memoria, valido per un singolo processo"""
+
+    def __init__(self, max_keys=10_000):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    async def acquire(self, key, rate, capacity):
+        """Consuma un token e restituisce i secondi da attendere (0 se consentito)"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / rate
+
+        if len(self._buckets) >= self.max_keys:
+            # I dict mantengono l'ordine di inserimento: scarta il bucket meno recente
+            self._buckets.pop(next(iter(self._buckets)))
+        self._buckets[key] = (tokens, now)
+        return retry_after
+
+
+class MongoRateLimitStore:
+    """Token bucket condiviso tra worker, aggiornato atomicamente in MongoDB"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexed = False
+
+    async def acquire(self, key, rate, capacity):
+        if not self._indexed:
+            # I bucket inattivi vengono rimossi automaticamente dopo un'ora
+            await self.collection.create_index("updated", expireAfterSeconds=3600)
+            self._indexed = True
+
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, 1000]}
+        document = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [
+                        capacity,
+                        {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}
+                    ]},
+                    "updated": now
+                }},
+                # Nello stesso stage entrambe le espressioni vedono i token appena ricaricati
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]}
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            projection={"allowed": 1, "tokens": 1}
+        )
+        if document["allowed"]:
+            return 0.0
+        return (1 - document["tokens"]) / rate
+
+
+class AdmissionOverloaded(Exception):
+    pass
+
+
+class AdmissionController:
+    """Limita le richieste concorrenti che accedono al database, con coda limitata"""
+
+    def __init__(self, max_inflight, max_queue, timeout):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._queued = 0
+
+    async def acquire(self):
+        if self._semaphore.locked() and self._queued >= self.max_queue:
+            raise AdmissionOverloaded()
+
+        self._queued += 1
+        admission_queued.set(self._queued)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise AdmissionOverloaded()
+        finally:
+            self._queued -= 1
+            admission_queued.set(self._queued)
+        admission_inflight.inc()
+
+    def release(self):
+        self._semaphore.release()
+        admission_inflight.dec()
+
+
+if RATE_LIMIT_STORE == "mongo":
+    rate_limit_store = MongoRateLimitStore(rate_limits_collection)
+else:
+    rate_limit_store = MemoryRateLimitStore()
+
+db_admission = AdmissionController(DB_MAX_INFLIGHT, DB_MAX_QUEUE, DB_QUEUE_TIMEOUT)
+
+
+def _is_trusted_proxy(host, trusted_proxies):
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_proxies)
+
+
+def client_address(request, trusted_proxies=None):
+    """Indirizzo del client, da X-Forwarded-For se la connessione arriva da un proxy fidato"""
+    trusted_proxies = TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    host = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(host, trusted_proxies):
+        return host
+    forwarded = [
+        address.strip()
+        for header in request.headers.getlist("x-forwarded-for")
+        for address in header.split(",") if address.strip()
+    ]
+    # Ogni proxy aggiunge in coda l'indirizzo da cui ha ricevuto la richiesta
+    for address in reversed(forwarded):
+        if not _is_trusted_proxy(address, trusted_proxies):
+            return address
+        host = address
+    return host
+
+
+def client_key(request):
+    """Chiave del limitatore: l'app ha un solo utente, i client si distinguono per indirizzo"""
+    return f"default_user:{client_address(request)}"
+
+
+TOO_MANY_REQUESTS = "Troppe richieste, riprova più tardi"
+
+
+def _retry_after(seconds):
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+def _too_many_requests(route_class, reason, retry_after):
+    rate_limited_total.inc(route_class=route_class, reason=reason)
+    return HTTPException(status_code=429, detail=TOO_MANY_REQUESTS, headers=_retry_after(retry_after))
+
+
+def rate_limit(route_class):
+    """Dipendenza FastAPI che applica il token bucket della classe di route"""
+    rate, capacity = RATE_LIMITS[route_class]
+
+    async def dependency(request: Request):
+        retry_after = await rate_limit_store.acquire(
+            f"{route_class}:{client_key(request)}", rate, capacity
+        )
+        if retry_after > 0:
+            raise _too_many_requests(route_class, "rate", retry_after)
+
+    return dependency
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI che fa passare ogni richiesta dell'API dal controllo di ammissione"""
+
+    def __init__(self, app, controller=None, exempt=ADMISSION_EXEMPT):
+        self.app = app
+        self.controller = controller or db_admission
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not path.startswith("/api/") or self.exempt.match(path):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire()
+        except AdmissionOverloaded:
+            rate_limited_total.inc(route_class="api", reason="overload")
+            response = JSONResponse(
+                {"detail": TOO_MANY_REQUESTS}, status_code=429, headers=_retry_after(self.controller.timeout)
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, HTTPException
+from database import client
+from diagnostics import slow_queries
+from scheduler import scheduler
+from loop_monitor import loop_monitor
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+@router.get("/slow-queries")
+async def get_slow_queries():
+    """Ottieni le query MongoDB lente raggruppate per forma, con i piani di explain"""
+    if slow_queries is None:
+        return {"enabled": False, "threshold_ms": None, "queries": []}
+    
+    return {
+        "enabled": True,
+        "threshold_ms": slow_queries.threshold_ms,
+        "queries": slow_queries.report()
+    }
+
+@router.post("/slow-queries/explain")
+async def explain_slow_queries():
+    """Cattura subito i piani di explain delle query più lente"""
+    if slow_queries is None:
+        return {"enabled": False, "queries": []}
+    
+    await slow_queries.capture_explain_plans(client)
+    return {"enabled": True, "queries": slow_queries.report()}
+
+
+@router.get("/event-loop")
+async def get_event_loop_status():
+    """Ottieni il ritardo dell'event loop e gli ultimi blocchi rilevati, con stack e route"""
+    return loop_monitor.report()
+
+
+@router.get("/scheduler")
+async def get_scheduler_status():
+    """Ottieni lo stato dello scheduler e dei job di manutenzione"""
+    return scheduler.status()
+
+@router.post("/scheduler/{job_name}/run")
+async def run_scheduler_job(job_name: str):
+    """Esegui subito un job di manutenzione"""
+    if scheduler.get_job(job_name) is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    
+    await scheduler.run_now(job_name)
+    return {"message": f"Job '{job_name}' eseguito"}
@@ -1,57 +1,239 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
-from models import FileSystemItem, FileSystemItemCreate, FileSystemItemUpdate
-from database import filesystem_collection
+import os
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import List, Optional
+from models import FileSystemItem, FileSystemItemCreate, FileSystemItemUpdate, FileSystemBatchRequest, UserSettings
+from database import filesystem_collection, user_settings_collection
+from serialization import model_projection, requested_fields, select_fields, trusted_response
+from http_cache import collection_etag, etag_matches, fields_etag, not_modified, set_cache_headers
+from paths import normalize_path
+from listing_cache import get_listing, listing_cache
+from invalidation import invalidate_filesystem_path
+from filesystem_ops import create_node, delete_node, trash_node, NodeExistsError, ParentNotFoundError
+from offload import buffer_pool, run_cpu
+from tree_builder import build_tree
+from content_codec import decoded, encode_content
+from content_store import REF_FIELD, content_store
+from trash import NOT_TRASHED, is_trashed, trash_filter
+from versioning import (
+    VERSION_FIELD, VERSION_INCREMENT, VersionConflictError, conflict, document_etag, expected_condition,
+    if_match_version, matches_expected
+)
+from pymongo import ReturnDocument
 from datetime import datetime
+from urllib.parse import quote
 
 router = APIRouter(prefix="/filesystem", tags=["filesystem"])
 
+# Sopra questo numero di nodi l'albero viene costruito nel pool CPU
+TREE_OFFLOAD_MIN_ITEMS = 500
+# Nodi massimi dell'albero; oltre, la risposta ha l'header TREE_TRUNCATED_HEADER
+TREE_MAX_ITEMS = int(os.environ.get("TREE_MAX_ITEMS", "10000"))
+TREE_TRUNCATED_HEADER = "X-Tree-Truncated"
+# Dimensione dei blocchi inviati nel download di contenuti dall'archivio locale
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+# Numero massimo di path ed elenchi in una singola richiesta batch
+MAX_BATCH_PATHS = 200
+
+
+class BufferStreamingResponse(StreamingResponse):
+    """StreamingResponse che invia i blocchi memoryview senza convertirli in bytes"""
+
+    async def stream_response(self, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for chunk in self.body_iterator:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _item_fields(fields):
+    """Campi scelti con fields= (400 se sconosciuti); path e parent_path sono sempre inclusi"""
+    fields = requested_fields(FileSystemItem, fields)
+    if fields is not None:
+        fields |= {"path", "parent_path"}
+    return fields
+
+
+async def _item_etag(query):
+    """ETag dell'elemento (versione e _id), letto con una query di sola proiezione; 404 se non esiste"""
+    current = await filesystem_collection.find_one(query, {"_id": 1, VERSION_FIELD: 1})
+    if current is None:
+        raise HTTPException(status_code=404, detail="Elemento non trovato")
+    return document_etag(current)
+
 @router.get("/", response_model=List[FileSystemItem])
-async def get_filesystem_items(path: str = "/"):
-    """Ottieni gli elementi del filesystem per un determinato path"""
-    # Trova tutti gli elementi che hanno il path specificato come parent
-    items = await filesystem_collection.find({
-        "parent_path": path,
-        "user_id": "default_user"
-    }).to_list(1000)
-    
-    result = []
-    for item in items:
-        item["id"] = str(item.get("_id", ""))
-        if "_id" in item:
-            del item["_id"]
-        result.append(FileSystemItem(**item))
-    
-    return result
+async def get_filesystem_items(request: Request, path: str = "/", fields: Optional[str] = None):
+    """Ottieni gli elementi del filesystem per un determinato path
+
+    fields (separati da virgola) limita i campi restituiti, ad esempio per
+    non leggere content quando servono solo i nomi; path e parent_path sono
+    sempre inclusi.
+    """
+    path = normalize_path(path)
+    fields = _item_fields(fields)
+    # Elementi che hanno il path specificato come parent, dalla cache se possibile
+    listing = await get_listing(path, fields=fields)
+    etag = fields_etag(listing.etag, fields)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    return set_cache_headers(await trusted_response(FileSystemItem, listing.items, fields), etag)
 
 @router.get("/item", response_model=FileSystemItem)
-async def get_filesystem_item(path: str):
+async def get_filesystem_item(path: str, request: Request, response: Response, fields: Optional[str] = None):
     """Ottieni un singolo elemento del filesystem"""
-    item = await filesystem_collection.find_one({
-        "path": path,
-        "user_id": "default_user"
-    })
+    path = normalize_path(path)
+    fields = _item_fields(fields)
+    if await is_trashed(path):
+        raise HTTPException(status_code=404, detail="Elemento non trovato")
+    query = {"path": path, "user_id": "default_user"}
+    etag = fields_etag(await _item_etag(query), fields)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    if fields is not None:
+        items = await filesystem_collection.aggregate([
+            {"$match": query},
+            {"$limit": 1},
+            model_projection(FileSystemItem, fields)
+        ]).to_list(1)
+        if not items:
+            raise HTTPException(status_code=404, detail="Elemento non trovato")
+        return set_cache_headers(ORJSONResponse(decoded(items[0])), etag)
+    
+    item = await filesystem_collection.find_one(query)
     
     if not item:
         raise HTTPException(status_code=404, detail="Elemento non trovato")
     
+    item = decoded(item)
     item["id"] = str(item.get("_id", ""))
     if "_id" in item:
         del item["_id"]
     
+    set_cache_headers(response, etag)
     return FileSystemItem(**item)
 
+@router.get("/content")
+async def download_filesystem_content(path: str, request: Request, download: bool = False):
+    """Scarica il contenuto grezzo di un file
+
+    I contenuti nell'archivio locale vengono inviati a blocchi direttamente
+    dalla mappa del segmento, senza copiarli in memoria.
+    """
+    path = normalize_path(path)
+    if await is_trashed(path):
+        raise HTTPException(status_code=404, detail="Elemento non trovato")
+    query = {"path": path, "user_id": "default_user"}
+    etag = await _item_etag(query)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    item = await filesystem_collection.find_one(
+        query, {"_id": 0, "name": 1, "type": 1, "content": 1, "content_codec": 1, REF_FIELD: 1}
+    )
+    if not item:
+        raise HTTPException(status_code=404, detail="Elemento non trovato")
+    if item["type"] != "file":
+        raise HTTPException(status_code=400, detail="L'elemento non è un file")
+    
+    headers = {}
+    if download:
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(item['name'])}"
+    media_type = "text/plain; charset=utf-8"
+    
+    ref = item.get(REF_FIELD)
+    if ref and content_store is not None:
+        # La prima lettura di un segmento apre e mappa il file: fuori dall'event loop
+        view = await buffer_pool.submit(content_store.view, ref, task="content_view")
+        
+        async def chunks():
+            for offset in range(0, len(view), DOWNLOAD_CHUNK_BYTES):
+                yield view[offset:offset + DOWNLOAD_CHUNK_BYTES]
+        
+        headers["Content-Length"] = str(len(view))
+        return set_cache_headers(BufferStreamingResponse(chunks(), media_type=media_type, headers=headers), etag)
+    
+    content = decoded(item).get("content") or ""
+    return set_cache_headers(Response(content, media_type=media_type, headers=headers), etag)
+
+@router.post("/batch")
+async def get_filesystem_batch(batch: FileSystemBatchRequest):
+    """Leggi più elementi ed elenchi di directory con una sola richiesta
+
+    Gli elenchi già in cache vengono serviti da lì; elementi ed elenchi
+    mancanti sono risolti con un'unica query $in. Con fields si possono
+    escludere i campi non necessari, come content (path e parent_path sono
+    sempre inclusi).
+    """
+    if len(batch.paths) + len(batch.parent_paths) > MAX_BATCH_PATHS:
+        raise HTTPException(status_code=400, detail=f"Al massimo {MAX_BATCH_PATHS} path per richiesta")
+    fields = _item_fields(batch.fields)
+    
+    paths = list(dict.fromkeys(normalize_path(path) for path in batch.paths))
+    parent_paths = list(dict.fromkeys(normalize_path(path) for path in batch.parent_paths))
+    
+    items = dict.fromkeys(paths)
+    listings = {}
+    missing = []
+    generations = {}
+    hidden = await trash_filter()
+    for parent_path in parent_paths:
+        if hidden(parent_path):
+            listings[parent_path] = []
+            continue
+        listing = listing_cache.get("default_user", parent_path)
+        if listing is None:
+            missing.append(parent_path)
+            generations[parent_path] = listing_cache.generation("default_user", parent_path)
+        else:
+            listings[parent_path] = [select_fields(item, fields) for item in listing.items]
+    
+    clauses = []
+    if paths:
+        clauses.append({"path": {"$in": paths}})
+    if missing:
+        clauses.append({"parent_path": {"$in": missing}})
+    if clauses:
+        documents = await filesystem_collection.aggregate([
+            {"$match": {"user_id": "default_user", "$or": clauses, **NOT_TRASHED}},
+            model_projection(FileSystemItem, fields)
+        ]).to_list(None)
+        fetched = {parent_path: [] for parent_path in missing}
+        for document in documents:
+            if document["path"] in items and not hidden(document["path"]):
+                items[document["path"]] = document
+            if document["parent_path"] in fetched:
+                fetched[document["parent_path"]].append(document)
+        for parent_path, children in fetched.items():
+            # Solo gli elenchi completi possono popolare la cache
+            if fields is None:
+                listing_cache.put("default_user", parent_path, children, generation=generations[parent_path])
+            listings[parent_path] = children
+    
+    def serialize(item):
+        if fields is None:
+            # Stessa forma di /filesystem/item, con i valori di default dei campi mancanti
+            return FileSystemItem.model_construct(**decoded(item)).model_dump()
+        return decoded(item)
+    
+    result = {
+        "items": {path: serialize(item) if item else None for path, item in items.items()},
+        "listings": {path: [serialize(item) for item in listings[path]] for path in parent_paths},
+    }
+    if batch.include_settings:
+        settings = await user_settings_collection.find_one({"user_id": "default_user"})
+        if settings:
+            settings["id"] = str(settings.pop("_id", ""))
+        result["settings"] = UserSettings(**settings).model_dump() if settings else None
+    return ORJSONResponse(result)
+
 @router.post("/", response_model=FileSystemItem)
-async def create_filesystem_item(item: FileSystemItemCreate):
-    """Crea un nuovo elemento nel filesystem"""
-    # Controlla se esiste già un elemento con lo stesso path
-    existing_item = await filesystem_collection.find_one({
-        "path": item.path,
-        "user_id": "default_user"
-    })
-    
-    if existing_item:
-        raise HTTPException(status_code=400, detail="Un elemento con questo path esiste già")
+async def create_filesystem_item(item: FileSystemItemCreate, response: Response):
+    """Crea un nuovo elemento nel filesystem (l'header ETag vale come If-Match per le modifiche)"""
+    item.path = normalize_path(item.path)
+    if item.parent_path:
+        item.parent_path = normalize_path(item.parent_path)
     
     # Prepara i dati per l'inserimento
     item_data = item.dict()
@@ -61,12 +243,19 @@ async def create_filesystem_item(item: FileSystemItemCreate):
     
     if item.type == "file" and item.content:
         item_data["size"] = len(item.content)
+        item_data.update(await encode_content(item.content))
     
-    # Inserisci nel database
-    result = await filesystem_collection.insert_one(item_data)
+    # Inserisci nel database (in transazione con il controllo del padre)
+    try:
+        inserted_id = await create_node(item_data)
+    except NodeExistsError:
+        raise HTTPException(status_code=400, detail="Un elemento con questo path esiste già")
+    except ParentNotFoundError:
+        raise HTTPException(status_code=400, detail="Directory padre non trovata")
     
     # Recupera l'elemento inserito
-    created_item = await filesystem_collection.find_one({"_id": result.inserted_id})
+    created_item = decoded(await filesystem_collection.find_one({"_id": inserted_id}))
+    response.headers["ETag"] = document_etag(created_item)
     created_item["id"] = str(created_item.get("_id", ""))
     if "_id" in created_item:
         del created_item["_id"]
@@ -74,38 +263,58 @@ async def create_filesystem_item(item: FileSystemItemCreate):
     return FileSystemItem(**created_item)
 
 @router.put("/{item_path:path}", response_model=FileSystemItem)
-async def update_filesystem_item(item_path: str, update: FileSystemItemUpdate):
-    """Aggiorna un elemento del filesystem"""
-    # Trova l'elemento esistente
-    existing_item = await filesystem_collection.find_one({
-        "path": f"/{item_path}",
-        "user_id": "default_user"
-    })
-    
-    if not existing_item:
+async def update_filesystem_item(item_path: str, update: FileSystemItemUpdate, request: Request, response: Response):
+    """Aggiorna un elemento del filesystem
+
+    Con If-Match (l'ETag dell'elemento o la sola versione) l'aggiornamento
+    avviene solo se l'elemento ha ancora quella versione, altrimenti risponde
+    409. La risposta contiene il nuovo ETag.
+    """
+    item_path = normalize_path(item_path)
+    expected_version = if_match_version(request)
+    if await is_trashed(item_path):
         raise HTTPException(status_code=404, detail="Elemento non trovato")
+    query = {"path": item_path, "user_id": "default_user", **NOT_TRASHED}
     
     # Prepara i dati da aggiornare
     update_data = update.dict(exclude_unset=True)
-    update_data["modified_at"] = datetime.utcnow()
-    
-    if "content" in update_data and existing_item["type"] == "file":
-        update_data["size"] = len(update_data["content"])
-    
-    # Aggiorna nel database
-    result = await filesystem_collection.update_one(
-        {"path": f"/{item_path}", "user_id": "default_user"},
-        {"$set": update_data}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=400, detail="Errore nell'aggiornamento dell'elemento")
+    if not update_data:
+        # Nessuna modifica: si restituisce l'elemento senza cambiarne la versione
+        item = await filesystem_collection.find_one(query)
+        if not item:
+            raise HTTPException(status_code=404, detail="Elemento non trovato")
+        if expected_version is not None and not matches_expected(item, expected_version):
+            raise conflict(item)
+        updated_item = decoded(item)
+    else:
+        update_data["modified_at"] = datetime.utcnow()
+        if "content" in update_data:
+            update_data["size"] = len(update_data["content"])
+            update_data.update(await encode_content(update_data["content"]))
+        
+        # Compare-and-set in un unico round-trip
+        condition = dict(query)
+        if "content" in update_data:
+            # Solo i file hanno un contenuto
+            condition["type"] = "file"
+        if expected_version is not None:
+            condition.update(expected_condition(expected_version))
+        updated_item = await filesystem_collection.find_one_and_update(
+            condition,
+            {"$set": update_data, **VERSION_INCREMENT},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_item is None:
+            current = await filesystem_collection.find_one(query, {"type": 1, VERSION_FIELD: 1})
+            if not current:
+                raise HTTPException(status_code=404, detail="Elemento non trovato")
+            if "content" in update_data and current["type"] != "file":
+                raise HTTPException(status_code=400, detail="Solo i file hanno un contenuto")
+            raise conflict(current)
+        invalidate_filesystem_path(item_path)
+        updated_item = decoded(updated_item)
     
-    # Recupera l'elemento aggiornato
-    updated_item = await filesystem_collection.find_one({
-        "path": f"/{item_path}",
-        "user_id": "default_user"
-    })
+    response.headers["ETag"] = document_etag(updated_item)
     updated_item["id"] = str(updated_item.get("_id", ""))
     if "_id" in updated_item:
         del updated_item["_id"]
@@ -113,80 +322,65 @@ async def update_filesystem_item(item_path: str, update: FileSystemItemUpdate):
     return FileSystemItem(**updated_item)
 
 @router.delete("/{item_path:path}")
-async def delete_filesystem_item(item_path: str):
-    """Elimina un elemento del filesystem"""
-    # Trova l'elemento
-    existing_item = await filesystem_collection.find_one({
-        "path": f"/{item_path}",
-        "user_id": "default_user"
-    })
-    
-    if not existing_item:
-        raise HTTPException(status_code=404, detail="Elemento non trovato")
-    
-    # Se è una cartella, elimina anche tutti i suoi contenuti
-    if existing_item["type"] == "folder":
-        await filesystem_collection.delete_many({
-            "parent_path": {"$regex": f"^/{item_path}"},
-            "user_id": "default_user"
-        })
+async def delete_filesystem_item(item_path: str, request: Request, permanent: bool = False):
+    """Sposta un elemento del filesystem nel cestino (con If-Match solo se ha ancora quella versione)
+
+    Con permanent=true l'elemento e i suoi contenuti vengono eliminati
+    definitivamente in un'unica transazione.
+    """
+    item_path = normalize_path(item_path)
+    if item_path == "/":
+        raise HTTPException(status_code=400, detail="La directory radice non può essere eliminata")
+    expected_version = if_match_version(request)
     
-    # Elimina l'elemento principale
-    result = await filesystem_collection.delete_one({
-        "path": f"/{item_path}",
-        "user_id": "default_user"
-    })
+    try:
+        if not permanent:
+            if not await trash_node(item_path, expected_version=expected_version):
+                raise HTTPException(status_code=404, detail="Elemento non trovato")
+            return {"message": "Elemento spostato nel cestino"}
+        if await is_trashed(item_path):
+            raise HTTPException(status_code=404, detail="Elemento non trovato")
+        deleted_count = await delete_node(item_path, expected_version=expected_version)
+    except VersionConflictError as e:
+        raise conflict(e.current)
     
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=400, detail="Errore nell'eliminazione dell'elemento")
+    if deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Elemento non trovato")
     
     return {"message": "Elemento eliminato con successo"}
 
 @router.get("/tree", response_model=dict)
-async def get_filesystem_tree():
-    """Ottieni l'intero albero del filesystem"""
-    # Recupera tutti gli elementi del filesystem
-    all_items = await filesystem_collection.find({
-        "user_id": "default_user"
-    }).to_list(1000)
-    
-    # Costruisci l'albero
-    tree = {}
-    
-    def add_to_tree(item, tree_node):
-        path_parts = item["path"].strip("/").split("/")
-        current_node = tree_node
-        
-        for i, part in enumerate(path_parts):
-            if not part:  # Root case
-                if "/" not in current_node:
-                    current_node["/"] = {
-                        "type": item["type"],
-                        "name": item["name"],
-                        "children": {} if item["type"] == "folder" else None,
-                        "content": item.get("content"),
-                        "size": item.get("size"),
-                        "modified": item.get("modified_at")
-                    }
-                current_node = current_node["/"]
-                continue
-                
-            if "children" not in current_node:
-                current_node["children"] = {}
-            
-            if part not in current_node["children"]:
-                current_node["children"][part] = {
-                    "type": item["type"],
-                    "name": item["name"],
-                    "children": {} if item["type"] == "folder" else None,
-                    "content": item.get("content"),
-                    "size": item.get("size"),
-                    "modified": item.get("modified_at")
-                }
-            
-            current_node = current_node["children"][part]
-    
-    for item in all_items:
-        add_to_tree(item, tree)
-    
-    return tree
\ No newline at end of file
+async def get_filesystem_tree(request: Request, response: Response):
+    """Ottieni l'intero albero del filesystem
+
+    Oltre TREE_MAX_ITEMS nodi l'albero viene troncato (in ordine di path) e la
+    risposta lo segnala con l'header X-Tree-Truncated: true.
+    """
+    # Il troncamento si conta dopo aver nascosto il cestino, quindi non si esprime come
+    # $limit: l'ETag copre tutti i nodi dell'utente (calcolato con un solo $group)
+    etag = await collection_etag(filesystem_collection, {"user_id": "default_user"})
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    
+    # Recupera gli elementi del filesystem (solo i campi usati dall'albero), esclusi quelli nel cestino
+    hidden = await trash_filter()
+    all_items = []
+    cursor = filesystem_collection.find(
+        {"user_id": "default_user"},
+        {"_id": 0, "path": 1, "type": 1, "name": 1, "content": 1,
+         "content_codec": 1, "content_ref": 1, "size": 1, "modified_at": 1}
+    ).sort("path", 1)
+    async for item in cursor:
+        if hidden(item["path"]):
+            continue
+        if len(all_items) >= TREE_MAX_ITEMS:
+            response.headers[TREE_TRUNCATED_HEADER] = "true"
+            break
+        all_items.append(item)
+    
+    # Costruisci l'albero, fuori dall'event loop se i nodi sono molti
+    return await run_cpu(
+        build_tree, all_items,
+        size_hint=len(all_items), threshold=TREE_OFFLOAD_MIN_ITEMS, task="filesystem_tree"
+    )
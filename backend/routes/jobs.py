@@ -0,0 +1,106 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import List
+from bson import ObjectId
+from bson.errors import InvalidId
+import orjson
+import time
+from models import Job, JobCreate
+from database import jobs_collection
+from serialization import model_projection
+from jobs import job_manager, FINISHED_STATUSES
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# Intervallo massimo tra due letture del job nello stream SSE
+EVENTS_POLL_SECONDS = 1.0
+# Commento inviato periodicamente per tenere aperta la connessione
+EVENTS_KEEPALIVE_SECONDS = 15.0
+
+
+def _job_id(job_id):
+    try:
+        return ObjectId(job_id)
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+
+
+def _to_model(job):
+    job["id"] = str(job.pop("_id"))
+    return Job(**job)
+
+
+@router.post("/", response_model=Job, status_code=202)
+async def create_job(job: JobCreate):
+    """Accoda un'operazione lunga e restituisci subito il job creato"""
+    try:
+        job_id = await job_manager.submit(job.type, job.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _to_model(await jobs_collection.find_one({"_id": job_id}))
+
+@router.get("/", response_model=List[Job])
+async def get_jobs(limit: int = Query(50, ge=1, le=500)):
+    """Ottieni i job più recenti"""
+    jobs = await jobs_collection.find({"user_id": "default_user"}).sort("created_at", -1).to_list(limit)
+    return [_to_model(job) for job in jobs]
+
+@router.get("/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    """Ottieni stato e avanzamento di un job"""
+    job = await jobs_collection.find_one({"_id": _job_id(job_id), "user_id": "default_user"})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return _to_model(job)
+
+@router.post("/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str):
+    """Annulla un job in coda o chiedi l'interruzione di uno in esecuzione"""
+    job = await job_manager.cancel(_job_id(job_id))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return _to_model(job)
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Stream SSE dell'avanzamento del job, fino al suo termine
+
+    Ogni evento "job" contiene lo stato completo; lo stream si chiude con
+    l'evento "end" quando il job è terminato.
+    """
+    object_id = _job_id(job_id)
+    projection = model_projection(Job)["$project"]
+    projection.pop("id")
+    
+    async def read():
+        return await jobs_collection.find_one({"_id": object_id, "user_id": "default_user"}, projection)
+    
+    job = await read()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    
+    async def events():
+        nonlocal job
+        last = None
+        last_sent = time.monotonic()
+        while True:
+            payload = _to_model(dict(job, _id=object_id)).model_dump_json()
+            if payload != last:
+                yield f"event: job\ndata: {payload}\n\n"
+                last = payload
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= EVENTS_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            if job["status"] in FINISHED_STATUSES:
+                yield f"event: end\ndata: {orjson.dumps({'status': job['status']}).decode()}\n\n"
+                return
+            # Gli aggiornamenti fatti in questo processo svegliano subito lo stream
+            await job_manager.wait_for_change(object_id, EVENTS_POLL_SECONDS)
+            job = await read() or dict(job, status="failed", error="Job rimosso")
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
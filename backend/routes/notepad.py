@@ -1,30 +1,67 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Request, Response, Depends
+from fastapi.responses import ORJSONResponse
+from typing import List, Optional
 from models import NotepadFile, NotepadFileCreate, NotepadFileUpdate
 from database import notepad_files_collection
+from serialization import model_projection, requested_fields, trusted_response
+from http_cache import collection_etag, etag_matches, fields_etag, not_modified, set_cache_headers
+from rate_limit import rate_limit
+from content_codec import decoded, encode_content
+from versioning import (
+    INITIAL_VERSION, VERSION_FIELD, VERSION_INCREMENT, conflict, document_etag, expected_condition,
+    if_match_version
+)
+from pymongo import ReturnDocument
 from datetime import datetime
 
 router = APIRouter(prefix="/notepad", tags=["notepad"])
 
+# File restituiti dall'elenco, i più recenti
+FILES_LIST_LIMIT = 1000
+FILES_LIST_SORT = {"modified_at": -1}
+
 @router.get("/files", response_model=List[NotepadFile])
-async def get_notepad_files():
-    """Ottieni tutti i file del notepad"""
-    files = await notepad_files_collection.find({
-        "user_id": "default_user"
-    }).sort("modified_at", -1).to_list(1000)
-    
-    result = []
-    for file in files:
-        file["id"] = str(file.get("_id", ""))
-        if "_id" in file:
-            del file["_id"]
-        result.append(NotepadFile(**file))
-    
-    return result
+async def get_notepad_files(request: Request, fields: Optional[str] = None):
+    """Ottieni tutti i file del notepad (fields limita i campi restituiti)"""
+    fields = requested_fields(NotepadFile, fields)
+    etag = fields_etag(await collection_etag(
+        notepad_files_collection, {"user_id": "default_user"}, sort=FILES_LIST_SORT, limit=FILES_LIST_LIMIT
+    ), fields)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    files = await notepad_files_collection.aggregate([
+        {"$match": {"user_id": "default_user"}},
+        {"$sort": FILES_LIST_SORT},
+        {"$limit": FILES_LIST_LIMIT},
+        model_projection(NotepadFile, fields)
+    ]).to_list(FILES_LIST_LIMIT)
+    
+    return set_cache_headers(await trusted_response(NotepadFile, files, fields), etag)
 
 @router.get("/files/{file_name}", response_model=NotepadFile)
-async def get_notepad_file(file_name: str):
-    """Ottieni un file specifico del notepad"""
+async def get_notepad_file(file_name: str, request: Request, response: Response, fields: Optional[str] = None):
+    """Ottieni un file specifico del notepad (l'ETag vale come If-Match per le modifiche)"""
+    fields = requested_fields(NotepadFile, fields)
+    current = await notepad_files_collection.find_one(
+        {"name": file_name, "user_id": "default_user"}, {"_id": 1, VERSION_FIELD: 1}
+    )
+    if not current:
+        raise HTTPException(status_code=404, detail="File non trovato")
+    etag = fields_etag(document_etag(current), fields)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    if fields is not None:
+        files = await notepad_files_collection.aggregate([
+            {"$match": {"name": file_name, "user_id": "default_user"}},
+            {"$limit": 1},
+            model_projection(NotepadFile, fields)
+        ]).to_list(1)
+        if not files:
+            raise HTTPException(status_code=404, detail="File non trovato")
+        return set_cache_headers(ORJSONResponse(decoded(files[0])), etag)
+    
     file = await notepad_files_collection.find_one({
         "name": file_name,
         "user_id": "default_user"
@@ -33,20 +70,22 @@ async def get_notepad_file(file_name: str):
     if not file:
         raise HTTPException(status_code=404, detail="File non trovato")
     
+    file = decoded(file)
     file["id"] = str(file.get("_id", ""))
     if "_id" in file:
         del file["_id"]
     
+    set_cache_headers(response, etag)
     return NotepadFile(**file)
 
 @router.post("/files", response_model=NotepadFile)
-async def create_notepad_file(file: NotepadFileCreate):
+async def create_notepad_file(file: NotepadFileCreate, response: Response):
     """Crea un nuovo file nel notepad"""
     # Controlla se esiste già un file con lo stesso nome
     existing_file = await notepad_files_collection.find_one({
         "name": file.name,
         "user_id": "default_user"
-    })
+    }, {"_id": 1})
     
     if existing_file:
         raise HTTPException(status_code=400, detail="Un file con questo nome esiste già")
@@ -55,31 +94,51 @@ async def create_notepad_file(file: NotepadFileCreate):
     file_data = file.dict()
     file_data["user_id"] = "default_user"
     file_data["size"] = len(file.content)
+    file_data.update(await encode_content(file.content))
     file_data["created_at"] = datetime.utcnow()
     file_data["modified_at"] = datetime.utcnow()
+    file_data[VERSION_FIELD] = INITIAL_VERSION
     
     # Inserisci nel database
     result = await notepad_files_collection.insert_one(file_data)
     
     # Recupera il file inserito
-    created_file = await notepad_files_collection.find_one({"_id": result.inserted_id})
+    created_file = decoded(await notepad_files_collection.find_one({"_id": result.inserted_id}))
+    response.headers["ETag"] = document_etag(created_file)
     created_file["id"] = str(created_file.get("_id", ""))
     if "_id" in created_file:
         del created_file["_id"]
     
     return NotepadFile(**created_file)
 
+async def _update_file(file_name, update_data, expected_version, response):
+    """Aggiornamento compare-and-set: restituisce il file aggiornato (e il nuovo ETag), 404 o 409"""
+    query = {"name": file_name, "user_id": "default_user"}
+    condition = dict(query)
+    if expected_version is not None:
+        condition.update(expected_condition(expected_version))
+    updated_file = await notepad_files_collection.find_one_and_update(
+        condition,
+        {"$set": update_data, **VERSION_INCREMENT},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_file is None:
+        current = await notepad_files_collection.find_one(query, {VERSION_FIELD: 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="File non trovato")
+        raise conflict(current)
+    
+    response.headers["ETag"] = document_etag(updated_file)
+    updated_file = decoded(updated_file)
+    updated_file["id"] = str(updated_file.get("_id", ""))
+    if "_id" in updated_file:
+        del updated_file["_id"]
+    return NotepadFile(**updated_file)
+
 @router.put("/files/{file_name}", response_model=NotepadFile)
-async def update_notepad_file(file_name: str, update: NotepadFileUpdate):
-    """Aggiorna un file del notepad"""
-    # Trova il file esistente
-    existing_file = await notepad_files_collection.find_one({
-        "name": file_name,
-        "user_id": "default_user"
-    })
-    
-    if not existing_file:
-        raise HTTPException(status_code=404, detail="File non trovato")
+async def update_notepad_file(file_name: str, update: NotepadFileUpdate, request: Request, response: Response):
+    """Aggiorna un file del notepad (con If-Match solo se ha ancora quella versione)"""
+    expected_version = if_match_version(request)
     
     # Prepara i dati da aggiornare
     update_data = update.dict(exclude_unset=True)
@@ -87,109 +146,75 @@ async def update_notepad_file(file_name: str, update: NotepadFileUpdate):
     
     if "content" in update_data:
         update_data["size"] = len(update_data["content"])
+        update_data.update(await encode_content(update_data["content"]))
     
     # Se il nome cambia, controlla che non esista già
     if "name" in update_data and update_data["name"] != file_name:
         existing_with_new_name = await notepad_files_collection.find_one({
             "name": update_data["name"],
             "user_id": "default_user"
-        })
+        }, {"_id": 1})
         if existing_with_new_name:
             raise HTTPException(status_code=400, detail="Un file con questo nome esiste già")
     
-    # Aggiorna nel database
-    result = await notepad_files_collection.update_one(
-        {"name": file_name, "user_id": "default_user"},
-        {"$set": update_data}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=400, detail="Errore nell'aggiornamento del file")
-    
-    # Recupera il file aggiornato
-    updated_file = await notepad_files_collection.find_one({
-        "name": update_data.get("name", file_name),
-        "user_id": "default_user"
-    })
-    updated_file["id"] = str(updated_file.get("_id", ""))
-    if "_id" in updated_file:
-        del updated_file["_id"]
-    
-    return NotepadFile(**updated_file)
+    return await _update_file(file_name, update_data, expected_version, response)
 
 @router.delete("/files/{file_name}")
-async def delete_notepad_file(file_name: str):
-    """Elimina un file del notepad"""
-    # Trova il file
-    existing_file = await notepad_files_collection.find_one({
-        "name": file_name,
-        "user_id": "default_user"
-    })
-    
-    if not existing_file:
-        raise HTTPException(status_code=404, detail="File non trovato")
+async def delete_notepad_file(file_name: str, request: Request):
+    """Elimina un file del notepad (con If-Match solo se ha ancora quella versione)"""
+    expected_version = if_match_version(request)
+    query = {"name": file_name, "user_id": "default_user"}
+    condition = dict(query)
+    if expected_version is not None:
+        condition.update(expected_condition(expected_version))
     
-    # Elimina il file
-    result = await notepad_files_collection.delete_one({
-        "name": file_name,
-        "user_id": "default_user"
-    })
+    result = await notepad_files_collection.delete_one(condition)
     
     if result.deleted_count == 0:
-        raise HTTPException(status_code=400, detail="Errore nell'eliminazione del file")
+        current = await notepad_files_collection.find_one(query, {VERSION_FIELD: 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="File non trovato")
+        raise conflict(current)
     
     return {"message": "File eliminato con successo"}
 
-@router.post("/files/{file_name}/save")
-async def save_notepad_file(file_name: str, content: str):
-    """Salva o aggiorna il contenuto di un file del notepad"""
-    # Controlla se il file esiste
-    existing_file = await notepad_files_collection.find_one({
+@router.post("/files/{file_name}/save", dependencies=[Depends(rate_limit("autosave"))])
+async def save_notepad_file(file_name: str, content: str, request: Request, response: Response):
+    """Salva o aggiorna il contenuto di un file del notepad
+
+    Con If-Match il salvataggio sovrascrive solo la versione indicata; senza,
+    un file inesistente viene creato.
+    """
+    expected_version = if_match_version(request)
+    update_data = {
+        **await encode_content(content),
+        "size": len(content),
+        "modified_at": datetime.utcnow()
+    }
+    
+    try:
+        return await _update_file(file_name, update_data, expected_version, response)
+    except HTTPException as e:
+        if e.status_code != 404 or expected_version is not None:
+            raise
+    
+    # Crea un nuovo file
+    file_data = {
         "name": file_name,
-        "user_id": "default_user"
-    })
+        **update_data,
+        "path": f"/home/user/Documents/{file_name}",
+        "user_id": "default_user",
+        "created_at": update_data["modified_at"],
+        VERSION_FIELD: INITIAL_VERSION
+    }
     
-    if existing_file:
-        # Aggiorna il file esistente
-        update_data = {
-            "content": content,
-            "size": len(content),
-            "modified_at": datetime.utcnow()
-        }
-        
-        await notepad_files_collection.update_one(
-            {"name": file_name, "user_id": "default_user"},
-            {"$set": update_data}
-        )
-        
-        # Recupera il file aggiornato
-        updated_file = await notepad_files_collection.find_one({
-            "name": file_name,
-            "user_id": "default_user"
-        })
-        updated_file["id"] = str(updated_file.get("_id", ""))
-        if "_id" in updated_file:
-            del updated_file["_id"]
-        
-        return NotepadFile(**updated_file)
-    else:
-        # Crea un nuovo file
-        file_data = {
-            "name": file_name,
-            "content": content,
-            "path": f"/home/user/Documents/{file_name}",
-            "size": len(content),
-            "user_id": "default_user",
-            "created_at": datetime.utcnow(),
-            "modified_at": datetime.utcnow()
-        }
-        
-        result = await notepad_files_collection.insert_one(file_data)
-        
-        # Recupera il file creato
-        created_file = await notepad_files_collection.find_one({"_id": result.inserted_id})
-        created_file["id"] = str(created_file.get("_id", ""))
-        if "_id" in created_file:
-            del created_file["_id"]
-        
-        return NotepadFile(**created_file)
\ No newline at end of file
+    result = await notepad_files_collection.insert_one(file_data)
+    
+    # Recupera il file creato
+    created_file = decoded(await notepad_files_collection.find_one({"_id": result.inserted_id}))
+    response.headers["ETag"] = document_etag(created_file)
+    created_file["id"] = str(created_file.get("_id", ""))
+    if "_id" in created_file:
+        del created_file["_id"]
+    
+    return NotepadFile(**created_file)
@@ -1,18 +1,25 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from models import UserSettings, UserSettingsUpdate, SystemInfo
 from database import user_settings_collection
+from http_cache import collection_etag, etag_matches, not_modified, set_cache_headers
+from system_monitor import system_monitor
 from datetime import datetime
-import time
 
 router = APIRouter(prefix="/settings", tags=["settings"])
 
 @router.get("/", response_model=UserSettings)
-async def get_user_settings():
+async def get_user_settings(request: Request, response: Response):
     """Ottieni le impostazioni utente"""
+    etag = await collection_etag(user_settings_collection, {"user_id": "default_user"})
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
     settings = await user_settings_collection.find_one({"user_id": "default_user"})
     if not settings:
         raise HTTPException(status_code=404, detail="Impostazioni utente non trovate")
     
+    set_cache_headers(response, etag)
+    
     # Converti ObjectId in string per la risposta
     settings["id"] = str(settings.get("_id", ""))
     if "_id" in settings:
@@ -51,14 +58,8 @@ async def update_user_settings(settings_update: UserSettingsUpdate):
 
 @router.get("/system-info", response_model=SystemInfo)
 async def get_system_info():
-    """Ottieni informazioni di sistema"""
-    uptime_seconds = time.time() - 1234567890  # Tempo simulato
-    uptime_hours = int(uptime_seconds // 3600)
-    uptime_minutes = int((uptime_seconds % 3600) // 60)
-    
-    return SystemInfo(
-        uptime=f"{uptime_hours}h {uptime_minutes}m"
-    )
+    """Ottieni informazioni di sistema (dall'ultimo campione, senza accessi al database)"""
+    return SystemInfo(**system_monitor.system_info())
 
 @router.post("/setup-complete")
 async def complete_setup(language: str):
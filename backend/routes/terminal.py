@@ -1,26 +1,138 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
-from models import TerminalHistoryEntry, TerminalHistoryCreate
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import List, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import ExecutionTimeout
+from models import (
+    TerminalHistoryEntry, TerminalHistoryCreate, TerminalHistoryRecall, TerminalHistoryPage,
+    TerminalCompletion
+)
 from database import terminal_history_collection, filesystem_collection
+from metrics import terminal_command_duration
+from serialization import model_projection, trusted_response
+from rate_limit import rate_limit
+from paths import (
+    HOME_DIRECTORY, normalize_path, parent_of, base_name, is_within, resolve_node
+)
+from listing_cache import get_listing, listing_cache
+from invalidation import invalidate_filesystem_path
+from filesystem_ops import create_node, trash_node, NodeExistsError, ParentNotFoundError
+from trash import NOT_TRASHED, is_trashed
+from versioning import VERSION_FIELD, VERSION_INCREMENT, version_condition
+from content_codec import CODEC_FIELD, REF_FIELD, decoded, encode_content
+from shell import ShellSyntaxError, expand_words, iter_lines, parse
 from datetime import datetime
+import re
+import time
 
 router = APIRouter(prefix="/terminal", tags=["terminal"])
 
+# Comandi supportati da execute_command
+KNOWN_COMMANDS = (
+    "ls", "pwd", "cd", "cat", "echo", "grep", "mkdir", "touch", "rm",
+    "clear", "help", "whoami", "date", "uname",
+)
+# Tempo massimo della query di completamento dei path
+COMPLETION_TIMEOUT_MS = 50
+
 @router.get("/history", response_model=List[TerminalHistoryEntry])
 async def get_terminal_history():
     """Ottieni la cronologia del terminale"""
-    history = await terminal_history_collection.find({
-        "user_id": "default_user"
-    }).sort("timestamp", 1).to_list(1000)
+    history = await terminal_history_collection.aggregate([
+        {"$match": {"user_id": "default_user"}},
+        {"$sort": {"timestamp": 1}},
+        {"$limit": 1000},
+        model_projection(TerminalHistoryEntry)
+    ]).to_list(1000)
+    
+    return await trusted_response(TerminalHistoryEntry, history)
+
+def _older_than(timestamp, entry_id):
+    """Filtro delle voci che seguono (timestamp, _id) nell'ordine decrescente
+
+    Le voci senza timestamp (cronologia di default) vengono ordinate per ultime.
+    """
+    if timestamp is None:
+        return {"timestamp": None, "_id": {"$lt": entry_id}}
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$lt": entry_id}},
+        {"timestamp": None}
+    ]}
+
+@router.get("/history/search", response_model=TerminalHistoryPage)
+async def search_terminal_history(
+    prefix: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    dedup: bool = True,
+    include_output: bool = False
+):
+    """Cerca nella cronologia dalla voce più recente (richiamo con freccia su e reverse-i-search)
+
+    prefix filtra i comandi che iniziano con il testo indicato, q quelli che lo
+    contengono (senza distinzione tra maiuscole e minuscole). before è il
+    cursore restituito dalla pagina precedente.
+    """
+    query = {"user_id": "default_user"}
+    if prefix:
+        # Regex ancorata e case-sensitive: usa l'indice (user_id, command)
+        query["command"] = {"$regex": f"^{re.escape(prefix)}"}
+    if q:
+        query.setdefault("$and", []).append(
+            {"command": {"$regex": re.escape(q), "$options": "i"}}
+        )
+    if before:
+        try:
+            cursor_id = ObjectId(before)
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Cursore non valido")
+        cursor_entry = await terminal_history_collection.find_one(
+            {"_id": cursor_id}, {"timestamp": 1, "command": 1}
+        )
+        if not cursor_entry:
+            raise HTTPException(status_code=400, detail="Cursore non valido")
+        query.setdefault("$and", []).append(_older_than(cursor_entry.get("timestamp"), cursor_id))
     
-    result = []
-    for entry in history:
-        entry["id"] = str(entry.get("_id", ""))
-        if "_id" in entry:
-            del entry["_id"]
-        result.append(TerminalHistoryEntry(**entry))
+    projection = {"command": 1, "directory": 1, "timestamp": 1}
+    if include_output:
+        projection["output"] = 1
     
-    return result
+    # Con dedup si leggono lotti un po' più grandi finché la pagina non è piena
+    batch_size = limit * 2 if dedup else limit
+    entries = []
+    # Il cursore è l'ultima voce letta: il suo comando è l'ultimo restituito
+    last_command = cursor_entry["command"] if before else None
+    last_id = None
+    last_timestamp = None
+    exhausted = False
+    while len(entries) < limit:
+        batch_query = query
+        if last_id is not None:
+            batch_query = {"$and": [query, _older_than(last_timestamp, last_id)]}
+        batch = await terminal_history_collection.find(batch_query, projection).sort(
+            [("timestamp", -1), ("_id", -1)]
+        ).limit(batch_size).to_list(batch_size)
+        
+        for entry in batch:
+            last_id, last_timestamp = entry["_id"], entry.get("timestamp")
+            scanned_all = entry is batch[-1]
+            if dedup and entry["command"] == last_command:
+                continue
+            last_command = entry["command"]
+            entry["id"] = str(entry.pop("_id"))
+            entries.append(TerminalHistoryRecall(**entry))
+            if len(entries) == limit:
+                break
+        if len(batch) < batch_size:
+            exhausted = not batch or scanned_all
+            break
+    
+    return TerminalHistoryPage(
+        entries=entries,
+        next_before=None if exhausted else str(last_id)
+    )
 
 @router.post("/history", response_model=TerminalHistoryEntry)
 async def add_terminal_history(entry: TerminalHistoryCreate):
@@ -45,226 +157,424 @@ async def clear_terminal_history():
     result = await terminal_history_collection.delete_many({"user_id": "default_user"})
     return {"message": f"Cronologia pulita: {result.deleted_count} voci eliminate"}
 
-@router.post("/execute")
-async def execute_command(command: str, current_directory: str = "/home/user"):
-    """Esegui un comando del terminale e restituisci l'output"""
-    parts = command.strip().split(' ')
-    cmd = parts[0]
-    args = parts[1:] if len(parts) > 1 else []
+async def _complete_names(directory, prefix, limit, folders_only):
+    """Elementi della directory il cui nome inizia con prefix, ordinati per nome
+
+    Usa l'elenco in cache se presente, altrimenti una query per intervallo
+    sull'indice (user_id, parent_path, name). Restituisce anche se la ricerca
+    è arrivata in fondo.
+    """
+    listing = listing_cache.get("default_user", directory)
+    if listing is not None:
+        matches = sorted(
+            (item for item in listing.items
+             if item["name"].startswith(prefix) and (not folders_only or item["type"] == "folder")),
+            key=lambda item: item["name"]
+        )
+        return matches[:limit], len(matches) <= limit
     
-    output = ""
-    new_directory = current_directory
+    query = {"user_id": "default_user", "parent_path": directory, **NOT_TRASHED}
+    if prefix:
+        query["name"] = {"$gte": prefix, "$lt": prefix + "\U0010ffff"}
+    if folders_only:
+        query["type"] = "folder"
+    try:
+        items = await filesystem_collection.find(
+            query, {"_id": 0, "name": 1, "type": 1},
+            sort=[("name", 1)], limit=limit + 1, max_time_ms=COMPLETION_TIMEOUT_MS
+        ).to_list(limit + 1)
+    except ExecutionTimeout:
+        return [], False
+    return items[:limit], len(items) <= limit
+
+@router.get("/complete", response_model=TerminalCompletion)
+async def complete_command(
+    line: str,
+    current_directory: str = HOME_DIRECTORY,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Completa l'ultima parola della riga: nome del comando o path relativo a current_directory"""
+    # Dopo una pipe si completa di nuovo il nome del comando
+    words = line.rsplit("|", 1)[-1].lstrip().split(" ")
+    token = words[-1]
+    if len(words) == 1:
+        candidates = [name for name in KNOWN_COMMANDS if name.startswith(token)]
+        return TerminalCompletion(
+            token=token, kind="command", candidates=candidates[:limit], complete=len(candidates) <= limit
+        )
     
+    # La parte fino all'ultimo "/" resta com'è, si completa solo il nome
+    typed_directory, separator, prefix = token.rpartition("/")
+    if separator:
+        directory = normalize_path(typed_directory or "/", normalize_path(current_directory))
+    else:
+        directory = normalize_path(current_directory)
+    items, complete = await _complete_names(directory, prefix, limit, folders_only=words[0] == "cd")
+    candidates = [
+        f"{typed_directory}{separator}{item['name']}{'/' if item['type'] == 'folder' else ''}"
+        for item in items
+    ]
+    return TerminalCompletion(token=token, kind="path", candidates=candidates, complete=complete)
+
+class _ShellContext:
+    """Stato condiviso dai comandi di una riga: directory e messaggi di errore"""
+
+    def __init__(self, session_key, current_directory):
+        self.session_key = session_key
+        self.cwd = current_directory
+        self.new_directory = current_directory
+        self.errors = []
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+# Ogni comando è un generatore asincrono: riceve gli argomenti già espansi e
+# lo stream del comando precedente (None se non è in una pipe) e produce il
+# proprio output a blocchi. interactive è falso se l'output va in una pipe o
+# in un file.
+
+async def _ls(ctx, args, stdin, interactive):
+    targets = args or ["."]
+    for target in targets:
+        path = normalize_path(target, ctx.cwd)
+        if args:
+            item = await resolve_node(ctx.session_key, path)
+            if item is None:
+                ctx.error(f"ls: {target}: File o directory non trovata")
+                continue
+            if item["type"] != "folder":
+                yield f"{target}\n"
+                continue
+        # Elenco completo, condiviso con il file manager: dalla cache, o letto e messo in cache
+        names = [item["name"] for item in (await get_listing(path)).items]
+        if len(targets) > 1:
+            yield f"{target}:\n"
+        if not interactive:
+            yield "".join(f"{name}\n" for name in names)
+        elif names:
+            yield "  ".join(names) + "\n"
+        elif not args:
+            yield "Directory vuota\n"
+
+async def _pwd(ctx, args, stdin, interactive):
+    yield f"{ctx.cwd}\n"
+
+async def _cd(ctx, args, stdin, interactive):
+    if not args:
+        ctx.new_directory = HOME_DIRECTORY
+        return
+    target_path = normalize_path(args[0], ctx.cwd)
+    item = await resolve_node(ctx.session_key, target_path)
+    if item and item["type"] == "folder":
+        ctx.new_directory = target_path
+    else:
+        ctx.error(f"cd: {args[0]}: Directory non trovata")
+    return
+    yield
+
+async def _cat(ctx, args, stdin, interactive):
+    if not args:
+        if stdin is None:
+            ctx.error("cat: specificare un file")
+            return
+        async for chunk in stdin:
+            yield chunk
+        return
+    for filename in args:
+        file_item = await resolve_node(ctx.session_key, normalize_path(filename, ctx.cwd), with_content=True)
+        if file_item and file_item["type"] == "file":
+            yield file_item.get("content") or ""
+        else:
+            ctx.error(f"cat: {filename}: File non trovato")
+
+async def _echo(ctx, args, stdin, interactive):
+    yield " ".join(args) + "\n"
+
+async def _grep(ctx, args, stdin, interactive):
+    flags = 0
+    invert = False
+    while args and args[0].startswith("-") and len(args[0]) > 1:
+        for option in args[0][1:]:
+            if option == "i":
+                flags |= re.IGNORECASE
+            elif option == "v":
+                invert = True
+            else:
+                ctx.error(f"grep: opzione non valida: -{option}")
+                return
+        args = args[1:]
+    if not args:
+        ctx.error("grep: specificare un pattern")
+        return
     try:
-        if cmd == "ls":
-            # Lista contenuti directory corrente
-            items = await filesystem_collection.find({
-                "parent_path": current_directory,
+        pattern = re.compile(args[0], flags)
+    except re.error as e:
+        ctx.error(f"grep: pattern non valido: {e}")
+        return
+    
+    async def matching(lines, prefix=""):
+        async for line in lines:
+            if (pattern.search(line) is None) == invert:
+                yield prefix + line if line.endswith("\n") else f"{prefix}{line}\n"
+    
+    files = args[1:]
+    if not files:
+        if stdin is None:
+            ctx.error("grep: specificare un file o usare una pipe")
+            return
+        async for line in matching(iter_lines(stdin)):
+            yield line
+        return
+    for filename in files:
+        file_item = await resolve_node(ctx.session_key, normalize_path(filename, ctx.cwd), with_content=True)
+        if not file_item or file_item["type"] != "file":
+            ctx.error(f"grep: {filename}: File non trovato")
+            continue
+        async for line in matching(iter_lines(_once(file_item.get("content") or "")),
+                                   f"{filename}:" if len(files) > 1 else ""):
+            yield line
+
+async def _once(text):
+    yield text
+
+async def _mkdir(ctx, args, stdin, interactive):
+    if not args:
+        ctx.error("mkdir: specificare il nome della directory")
+    for dir_name in args:
+        new_path = normalize_path(dir_name, ctx.cwd)
+        
+        # Crea la directory
+        new_dir = {
+            "name": base_name(new_path),
+            "type": "folder",
+            "path": new_path,
+            "parent_path": parent_of(new_path),
+            "user_id": "default_user",
+            "created_at": datetime.utcnow(),
+            "modified_at": datetime.utcnow()
+        }
+        try:
+            if new_path == "/":
+                raise NodeExistsError(new_path)
+            await create_node(new_dir)
+            yield f"Directory '{dir_name}' creata\n"
+        except NodeExistsError:
+            ctx.error(f"mkdir: {dir_name}: File o directory esistente")
+        except ParentNotFoundError:
+            ctx.error(f"mkdir: {dir_name}: Directory padre non trovata")
+
+async def _touch(ctx, args, stdin, interactive):
+    if not args:
+        ctx.error("touch: specificare il nome del file")
+    for file_name in args:
+        new_path = normalize_path(file_name, ctx.cwd)
+        
+        # Controlla se esiste già (un elemento nel cestino conta come assente)
+        existing = None
+        if not await is_trashed(new_path):
+            existing = await filesystem_collection.find_one({
+                "path": new_path,
                 "user_id": "default_user"
-            }).to_list(1000)
-            
-            if items:
-                names = [item["name"] for item in items]
-                output = "  ".join(names)
-            else:
-                output = "Directory vuota"
-                
-        elif cmd == "pwd":
-            output = current_directory
-            
-        elif cmd == "cd":
-            if not args:
-                new_directory = "/home/user"
-                output = ""
+            }, {"type": 1})
+        
+        if existing:
+            # Aggiorna timestamp se è un file
+            if existing["type"] == "file":
+                await filesystem_collection.update_one(
+                    {"path": new_path, "user_id": "default_user"},
+                    {"$set": {"modified_at": datetime.utcnow()}, **VERSION_INCREMENT}
+                )
+                invalidate_filesystem_path(new_path)
+                yield f"Timestamp di '{file_name}' aggiornato\n"
             else:
-                target_path = args[0]
-                if target_path == "..":
-                    # Vai alla directory parent
-                    if current_directory != "/":
-                        parts = current_directory.rstrip("/").split("/")
-                        if len(parts) > 1:
-                            parts.pop()
-                            new_directory = "/".join(parts) if len(parts) > 1 else "/"
-                        else:
-                            new_directory = "/"
-                    output = ""
-                elif target_path.startswith("/"):
-                    # Path assoluto
-                    item = await filesystem_collection.find_one({
-                        "path": target_path,
-                        "type": "folder",
-                        "user_id": "default_user"
-                    })
-                    if item:
-                        new_directory = target_path
-                        output = ""
-                    else:
-                        output = f"cd: {target_path}: Directory non trovata"
-                else:
-                    # Path relativo
-                    full_path = f"{current_directory.rstrip('/')}/{target_path}"
-                    item = await filesystem_collection.find_one({
-                        "path": full_path,
-                        "type": "folder",
-                        "user_id": "default_user"
-                    })
-                    if item:
-                        new_directory = full_path
-                        output = ""
-                    else:
-                        output = f"cd: {target_path}: Directory non trovata"
-                        
-        elif cmd == "cat":
-            if not args:
-                output = "cat: specificare un file"
-            else:
-                filename = args[0]
-                file_path = f"{current_directory.rstrip('/')}/{filename}"
-                
-                file_item = await filesystem_collection.find_one({
-                    "path": file_path,
-                    "type": "file",
-                    "user_id": "default_user"
-                })
-                
-                if file_item:
-                    output = file_item.get("content", "")
-                else:
-                    output = f"cat: {filename}: File non trovato"
-                    
-        elif cmd == "mkdir":
-            if not args:
-                output = "mkdir: specificare il nome della directory"
-            else:
-                dir_name = args[0]
-                new_path = f"{current_directory.rstrip('/')}/{dir_name}"
-                
-                # Controlla se esiste già
-                existing = await filesystem_collection.find_one({
-                    "path": new_path,
-                    "user_id": "default_user"
-                })
-                
-                if existing:
-                    output = f"mkdir: {dir_name}: File o directory esistente"
-                else:
-                    # Crea la directory
-                    new_dir = {
-                        "name": dir_name,
-                        "type": "folder",
-                        "path": new_path,
-                        "parent_path": current_directory,
-                        "user_id": "default_user",
-                        "created_at": datetime.utcnow(),
-                        "modified_at": datetime.utcnow()
-                    }
-                    await filesystem_collection.insert_one(new_dir)
-                    output = f"Directory '{dir_name}' creata"
-                    
-        elif cmd == "touch":
-            if not args:
-                output = "touch: specificare il nome del file"
-            else:
-                file_name = args[0]
-                new_path = f"{current_directory.rstrip('/')}/{file_name}"
-                
-                # Controlla se esiste già
-                existing = await filesystem_collection.find_one({
-                    "path": new_path,
-                    "user_id": "default_user"
-                })
-                
-                if existing:
-                    # Aggiorna timestamp se è un file
-                    if existing["type"] == "file":
-                        await filesystem_collection.update_one(
-                            {"path": new_path, "user_id": "default_user"},
-                            {"$set": {"modified_at": datetime.utcnow()}}
-                        )
-                        output = f"Timestamp di '{file_name}' aggiornato"
-                    else:
-                        output = f"touch: {file_name}: È una directory"
-                else:
-                    # Crea il file
-                    new_file = {
-                        "name": file_name,
-                        "type": "file",
-                        "path": new_path,
-                        "parent_path": current_directory,
-                        "content": "",
-                        "size": 0,
-                        "user_id": "default_user",
-                        "created_at": datetime.utcnow(),
-                        "modified_at": datetime.utcnow()
-                    }
-                    await filesystem_collection.insert_one(new_file)
-                    output = f"File '{file_name}' creato"
-                    
-        elif cmd == "rm":
-            if not args:
-                output = "rm: specificare un file o directory"
-            else:
-                item_name = args[0]
-                item_path = f"{current_directory.rstrip('/')}/{item_name}"
-                
-                item = await filesystem_collection.find_one({
-                    "path": item_path,
-                    "user_id": "default_user"
-                })
-                
-                if not item:
-                    output = f"rm: {item_name}: File o directory non trovata"
-                else:
-                    # Elimina l'elemento
-                    if item["type"] == "folder":
-                        # Elimina ricorsivamente tutti i contenuti
-                        await filesystem_collection.delete_many({
-                            "path": {"$regex": f"^{item_path}"},
-                            "user_id": "default_user"
-                        })
-                    else:
-                        await filesystem_collection.delete_one({
-                            "path": item_path,
-                            "user_id": "default_user"
-                        })
-                    output = f"'{item_name}' eliminato"
-                    
-        elif cmd == "clear":
-            # Il clear viene gestito dal frontend
-            output = ""
-            
-        elif cmd == "help":
-            output = """Comandi disponibili:
-ls          - Lista file e directory
+                ctx.error(f"touch: {file_name}: È una directory")
+            continue
+        
+        # Crea il file
+        try:
+            await _create_file(new_path, "")
+            yield f"File '{file_name}' creato\n"
+        except NodeExistsError:
+            ctx.error(f"touch: {file_name}: File o directory esistente")
+        except ParentNotFoundError:
+            ctx.error(f"touch: {file_name}: Directory padre non trovata")
+
+async def _rm(ctx, args, stdin, interactive):
+    if not args:
+        ctx.error("rm: specificare un file o directory")
+    for item_name in args:
+        item_path = normalize_path(item_name, ctx.cwd)
+        
+        if item_path == "/" or is_within(ctx.cwd, item_path):
+            ctx.error(f"rm: {item_name}: Impossibile eliminare la directory corrente o un suo antenato")
+        # Sposta l'elemento (con tutti i suoi contenuti) nel cestino
+        elif not await trash_node(item_path):
+            ctx.error(f"rm: {item_name}: File o directory non trovata")
+        else:
+            yield f"'{item_name}' spostato nel cestino\n"
+
+async def _clear(ctx, args, stdin, interactive):
+    # Il clear viene gestito dal frontend
+    return
+    yield
+
+async def _help(ctx, args, stdin, interactive):
+    yield """Comandi disponibili:
+ls [path]   - Lista file e directory
 pwd         - Mostra directory corrente
 cd [path]   - Cambia directory
 cat [file]  - Mostra contenuto file
+echo [testo]- Stampa il testo
+grep [-iv] pattern [file] - Filtra le righe che contengono il pattern
 clear       - Pulisce il terminale
 mkdir [dir] - Crea directory
 touch [file]- Crea file vuoto
-rm [item]   - Elimina file o directory
+rm [item]   - Sposta file o directory nel cestino
 help        - Mostra questo messaggio
 whoami      - Mostra utente corrente
 date        - Mostra data e ora
-uname       - Mostra informazioni sistema"""
-            
-        elif cmd == "whoami":
-            output = "user"
-            
-        elif cmd == "date":
-            output = datetime.now().strftime("%a %b %d %H:%M:%S %Y")
-            
-        elif cmd == "uname":
-            if args and args[0] == "-a":
-                output = "FutureOS 1.0.0 5.4.0-future x86_64"
-            else:
-                output = "FutureOS"
-                
+uname       - Mostra informazioni sistema
+
+Sono supportati i caratteri jolly (*, ?, [...]), le pipe (ls | grep txt)
+e la redirezione dell'output su file (> sovrascrive, >> aggiunge)
+"""
+
+async def _whoami(ctx, args, stdin, interactive):
+    yield "user\n"
+
+async def _date(ctx, args, stdin, interactive):
+    yield datetime.now().strftime("%a %b %d %H:%M:%S %Y") + "\n"
+
+async def _uname(ctx, args, stdin, interactive):
+    if args and args[0] == "-a":
+        yield "FutureOS 1.0.0 5.4.0-future x86_64\n"
+    else:
+        yield "FutureOS\n"
+
+COMMANDS = {
+    "ls": _ls, "pwd": _pwd, "cd": _cd, "cat": _cat, "echo": _echo, "grep": _grep,
+    "mkdir": _mkdir, "touch": _touch, "rm": _rm, "clear": _clear, "help": _help,
+    "whoami": _whoami, "date": _date, "uname": _uname,
+}
+
+
+async def _create_file(path, content):
+    new_file = {
+        "name": base_name(path),
+        "type": "file",
+        "path": path,
+        "parent_path": parent_of(path),
+        "size": len(content),
+        "user_id": "default_user",
+        "created_at": datetime.utcnow(),
+        "modified_at": datetime.utcnow()
+    }
+    new_file.update(await encode_content(content))
+    await create_node(new_file)
+
+async def _redirect(ctx, stream, target, append):
+    """Scrive lo stream nel file target (in coda con append) e non produce output"""
+    # Il documento contiene l'intero file: qui il contenuto va unito in memoria
+    text = "".join([chunk async for chunk in stream])
+    path = normalize_path(target, ctx.cwd)
+    existing = None
+    if not await is_trashed(path):
+        existing = await filesystem_collection.find_one(
+            {"path": path, "user_id": "default_user"},
+            {"type": 1, "content": 1, CODEC_FIELD: 1, REF_FIELD: 1, VERSION_FIELD: 1} if append
+            else {"type": 1}
+        )
+    if existing is None:
+        try:
+            await _create_file(path, text)
+        except NodeExistsError:
+            ctx.error(f"{target}: File creato da un'altra operazione, riprovare")
+        except ParentNotFoundError:
+            ctx.error(f"{target}: Directory padre non trovata")
+    elif existing["type"] != "file":
+        ctx.error(f"{target}: È una directory")
+    else:
+        condition = {"_id": existing["_id"]}
+        if append:
+            text = (decoded(existing).get("content") or "") + text
+            # Compare-and-set: un'altra scrittura nel frattempo non viene sovrascritta
+            condition[VERSION_FIELD] = version_condition(existing.get(VERSION_FIELD, 0))
+        update = {"size": len(text), "modified_at": datetime.utcnow(), **await encode_content(text)}
+        result = await filesystem_collection.update_one(condition, {"$set": update, **VERSION_INCREMENT})
+        if result.matched_count == 0:
+            ctx.error(f"{target}: File modificato da un'altra operazione, riprovare")
         else:
-            output = f"{cmd}: comando non trovato. Usa 'help' per vedere i comandi disponibili."
+            invalidate_filesystem_path(path)
+    return
+    yield
+
+async def _draining(output, stdin):
+    """Output del comando; al termine esegue fino in fondo il comando precedente anche se non letto"""
+    async for chunk in output:
+        yield chunk
+    if stdin is not None:
+        async for _ in stdin:
+            pass
+
+async def _run_pipeline(ctx, commands):
+    """Collega i comandi della riga e restituisce l'output finale"""
+    stream = None
+    for index, command in enumerate(commands):
+        name = command.words[0].text
+        handler = COMMANDS.get(name)
+        if handler is None:
+            ctx.error(f"{name}: comando non trovato. Usa 'help' per vedere i comandi disponibili.")
+            # Nessun output, ma i comandi precedenti vanno comunque eseguiti
+            stream = _draining(_once(""), stream)
+            continue
+        args = await expand_words(command.words[1:], ctx.cwd)
+        interactive = index == len(commands) - 1 and command.redirect is None
+        stream = _draining(handler(ctx, args, stream, interactive), stream)
+        if command.redirect is not None:
+            target = (await expand_words([command.redirect], ctx.cwd))
+            if len(target) != 1:
+                ctx.error(f"{command.redirect.text}: redirezione ambigua")
+                stream = _draining(_once(""), stream)
+                continue
+            stream = _redirect(ctx, stream, target[0], command.append)
+    
+    if stream is None:
+        return ""
+    output = "".join([chunk async for chunk in stream])
+    return output[:-1] if output.endswith("\n") else output
+
+@router.post("/execute", dependencies=[Depends(rate_limit("terminal"))])
+async def execute_command(command: str, current_directory: str = HOME_DIRECTORY, session_id: str = "default"):
+    """Esegui una riga di comando del terminale e restituisci l'output
+
+    La riga può collegare più comandi con | e redirigere l'output su file
+    con > e >>; i caratteri jolly vengono espansi sul filesystem.
+    """
+    current_directory = normalize_path(current_directory)
+    ctx = _ShellContext(f"default_user:{session_id}", current_directory)
+    
+    output = ""
+    started = time.perf_counter()
+    commands = []
     
+    try:
+        commands = parse(command)
+        output = await _run_pipeline(ctx, commands)
+    except ShellSyntaxError as e:
+        ctx.error(f"Errore di sintassi: {e}")
     except Exception as e:
-        output = f"Errore nell'esecuzione del comando: {str(e)}"
+        ctx.error(f"Errore nell'esecuzione del comando: {str(e)}")
+    # Gli errori precedono l'output, come stderr in un terminale
+    output = "\n".join(ctx.errors + ([output] if output else []))
+    
+    if len(commands) > 1:
+        metric_command = "pipeline"
+    elif commands and commands[0].words[0].text in KNOWN_COMMANDS:
+        metric_command = commands[0].words[0].text
+    else:
+        metric_command = "unknown"
+    terminal_command_duration.observe(time.perf_counter() - started, command=metric_command)
     
     # Salva nella cronologia
     history_entry = {
@@ -280,5 +590,5 @@ uname       - Mostra informazioni sistema"""
         "command": command,
         "output": output,
         "directory": current_directory,
-        "new_directory": new_directory
-    }
\ No newline at end of file
+        "new_directory": ctx.new_directory
+    }
@@ -0,0 +1,57 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import List
+from models import Job, TrashItem
+from database import filesystem_collection, jobs_collection
+from paths import normalize_path
+from filesystem_ops import restore_node, ParentNotFoundError
+from jobs import job_manager
+from trash import IS_TRASHED, TRASHED_FIELD
+
+router = APIRouter(prefix="/trash", tags=["trash"])
+
+
+async def _submit_purge(params):
+    job_id = await job_manager.submit("purge_trash", params)
+    job = await jobs_collection.find_one({"_id": job_id})
+    job["id"] = str(job.pop("_id"))
+    return Job(**job)
+
+
+@router.get("/", response_model=List[TrashItem])
+async def get_trash(limit: int = Query(500, ge=1, le=5000)):
+    """Ottieni gli elementi nel cestino, dal più recente
+
+    Sono elencate solo le radici eliminate: i loro contenuti tornano
+    visibili con il ripristino.
+    """
+    items = await filesystem_collection.find(
+        {"user_id": "default_user", **IS_TRASHED},
+        {"_id": 0, "path": 1, "name": 1, "type": 1, "size": 1, TRASHED_FIELD: 1, "version": 1}
+    ).sort(TRASHED_FIELD, -1).to_list(limit)
+    return [TrashItem(**item) for item in items]
+
+@router.post("/restore")
+async def restore_trash_item(path: str):
+    """Ripristina un elemento del cestino nella sua posizione di origine"""
+    path = normalize_path(path)
+    try:
+        restored = await restore_node(path)
+    except ParentNotFoundError:
+        raise HTTPException(status_code=409, detail="La directory di origine non esiste più")
+    if not restored:
+        raise HTTPException(status_code=404, detail="Elemento non trovato nel cestino")
+    return {"message": "Elemento ripristinato"}
+
+@router.delete("/", response_model=Job, status_code=202)
+async def empty_trash():
+    """Svuota il cestino: l'eliminazione definitiva avviene in un job in background"""
+    return await _submit_purge({})
+
+@router.delete("/item", response_model=Job, status_code=202)
+async def purge_trash_item(path: str):
+    """Elimina definitivamente un elemento del cestino (in un job in background)"""
+    path = normalize_path(path)
+    item = await filesystem_collection.find_one({"path": path, "user_id": "default_user", **IS_TRASHED}, {"_id": 1})
+    if not item:
+        raise HTTPException(status_code=404, detail="Elemento non trovato nel cestino")
+    return await _submit_purge({"paths": [path]})
@@ -0,0 +1,202 @@
+"""Scheduler in-process per i job di manutenzione
+
+I job periodici e one-shot girano come task asyncio avviati e fermati con
+l'applicazione, fuori dal percorso delle richieste. Con più worker uvicorn
+solo il leader, eletto tramite un documento di lease in MongoDB, esegue i
+job marcati leader_only; gli altri (per esempio quelli che lavorano su
+stato locale al processo) girano su ogni worker.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import scheduler_leases_collection
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = float(os.environ.get("SCHEDULER_LEASE_SECONDS", "30"))
+LEASE_ID = "maintenance"
+
+job_duration = registry.histogram(
+    "futureos_scheduler_job_duration_seconds",
+    "Durata delle esecuzioni dei job di manutenzione",
+    ("job",),
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0),
+)
+job_runs_total = registry.counter(
+    "futureos_scheduler_job_runs_total",
+    "Esecuzioni dei job di manutenzione",
+    ("job", "status"),
+)
+scheduler_leader = registry.gauge(
+    "futureos_scheduler_leader",
+    "1 se questo worker detiene il lease dello scheduler",
+)
+
+
+class Job:
+    def __init__(self, name, func, interval=None, delay=0.0, jitter=0.0, leader_only=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.delay = delay
+        self.jitter = jitter
+        self.leader_only = leader_only
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.next_run = None
+
+    def _next_delay(self, base):
+        # Il jitter evita che i worker (o i job) partano tutti nello stesso istante
+        return max(0.0, base + random.uniform(-self.jitter, self.jitter) * base)
+
+    def status(self):
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "leader_only": self.leader_only,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "next_run": self.next_run.isoformat() if self.next_run else None,
+        }
+
+
+class Scheduler:
+    def __init__(self, lease_collection, lease_seconds=LEASE_SECONDS):
+        self.lease_collection = lease_collection
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._jobs = {}
+        self._tasks = []
+        self._running = False
+
+    def every(self, name, interval, func, jitter=0.1, leader_only=True, run_at_start=False):
+        """Registra un job periodico"""
+        job = Job(name, func, interval=interval, delay=0.0 if run_at_start else interval,
+                  jitter=jitter, leader_only=leader_only)
+        self._add(job)
+        return job
+
+    def once(self, name, func, delay=0.0, jitter=0.0, leader_only=False):
+        """Registra un job da eseguire una sola volta dopo delay secondi"""
+        job = Job(name, func, delay=delay, jitter=jitter, leader_only=leader_only)
+        self._add(job)
+        return job
+
+    def _add(self, job):
+        self._jobs[job.name] = job
+        if self._running:
+            self._tasks.append(asyncio.create_task(self._run_job(job)))
+
+    async def start(self):
+        self._running = True
+        await self._renew_lease()
+        self._tasks.append(asyncio.create_task(self._lease_loop()))
+        for job in self._jobs.values():
+            self._tasks.append(asyncio.create_task(self._run_job(job)))
+        logger.info(f"Scheduler avviato ({len(self._jobs)} job, leader: {self.is_leader})")
+
+    async def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.is_leader:
+            # Rilascia il lease così un altro worker può subentrare subito
+            await self.lease_collection.delete_one({"_id": LEASE_ID, "holder": self.worker_id})
+            self.is_leader = False
+            scheduler_leader.set(0)
+
+    async def _renew_lease(self):
+        now = datetime.utcnow()
+        try:
+            lease = await self.lease_collection.find_one_and_update(
+                {"_id": LEASE_ID, "$or": [{"holder": self.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"holder": self.worker_id, "expires_at": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            leader = lease is not None and lease["holder"] == self.worker_id
+        except DuplicateKeyError:
+            # Il lease esiste ed è valido per un altro worker
+            leader = False
+        except Exception as e:
+            logger.warning(f"Rinnovo del lease dello scheduler fallito: {e}")
+            leader = False
+
+        if leader != self.is_leader:
+            logger.info(f"Scheduler {self.worker_id}: {'leader' if leader else 'follower'}")
+        self.is_leader = leader
+        scheduler_leader.set(1 if leader else 0)
+
+    async def _lease_loop(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self._renew_lease()
+
+    def get_job(self, name):
+        return self._jobs.get(name)
+
+    async def run_now(self, name):
+        """Esegue subito un job registrato, indipendentemente dalla sua pianificazione"""
+        await self._execute(self._jobs[name])
+
+    async def _run_job(self, job):
+        delay = job._next_delay(job.delay)
+        while True:
+            job.next_run = datetime.utcnow() + timedelta(seconds=delay)
+            await asyncio.sleep(delay)
+            if job.leader_only and not self.is_leader:
+                job.skipped += 1
+            else:
+                await self._execute(job)
+            if job.interval is None:
+                job.next_run = None
+                return
+            delay = job._next_delay(job.interval)
+
+    async def _execute(self, job):
+        started = time.perf_counter()
+        job.last_run = datetime.utcnow()
+        try:
+            await job.func()
+            job.last_error = None
+            status = "ok"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            status = "error"
+            logger.error(f"Job di manutenzione '{job.name}' fallito: {e}")
+        job.runs += 1
+        job.last_duration = time.perf_counter() - started
+        job_duration.observe(job.last_duration, job=job.name)
+        job_runs_total.inc(job=job.name, status=status)
+
+    def status(self):
+        return {
+            "worker_id": self.worker_id,
+            "leader": self.is_leader,
+            "jobs": [job.status() for job in self._jobs.values()],
+        }
+
+
+scheduler = Scheduler(scheduler_leases_collection)
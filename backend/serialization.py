@@ -0,0 +1,75 @@
+"""Serializzazione veloce delle risposte a partire dai documenti MongoDB
+
+I documenti letti dal database sono già nella forma dei modelli: lo stage
+$project rinomina _id in id lato server e le risposte vengono costruite con
+model_construct e codificate con ORJSON, senza la doppia validazione Pydantic
+fatta da FastAPI tramite response_model.
+"""
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from content_codec import CODEC_FIELD, REF_FIELD, decode_documents
+
+
+def parse_fields(model, fields):
+    """Campi richiesti dal client (lista o stringa separata da virgole), None per tutti
+
+    Solleva ValueError se un campo non appartiene al modello.
+    """
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    selected = {name.strip() for name in fields if name.strip()}
+    unknown = selected - set(model.model_fields)
+    if unknown:
+        raise ValueError(f"Campi non validi: {', '.join(sorted(unknown))}")
+    return selected or None
+
+
+def requested_fields(model, fields):
+    """Come parse_fields, con errore 400 per i campi sconosciuti (parametro fields=)"""
+    try:
+        return parse_fields(model, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def model_projection(model, fields=None):
+    """Stage $project con i soli campi del modello (o quelli scelti) e _id convertito in id"""
+    names = model.model_fields if fields is None else fields
+    projection = {name: 1 for name in names if name != "id"}
+    projection["_id"] = 0
+    if fields is None or "id" in fields:
+        projection["id"] = {"$toString": "$_id"}
+    if "content" in projection:
+        # Serve a decomprimere il contenuto al momento della risposta
+        projection[CODEC_FIELD] = 1
+        projection[REF_FIELD] = 1
+    return {"$project": projection}
+
+
+def select_fields(document, fields):
+    """Documento ridotto ai campi scelti, per i dati già letti per intero (es. dalla cache)"""
+    if fields is None:
+        return document
+    if "content" in fields:
+        fields = fields | {CODEC_FIELD, REF_FIELD}
+    return {key: value for key, value in document.items() if key in fields}
+
+
+async def construct_models(model, documents):
+    """Costruisce i modelli senza validazione (i dati arrivano dal database)
+
+    I contenuti compressi vengono decodificati fuori dall'event loop se grandi.
+    """
+    return [model.model_construct(**document) for document in await decode_documents(documents)]
+
+
+async def trusted_response(model, documents, fields=None):
+    """Risposta JSON per documenti fidati, codificata direttamente con ORJSON
+
+    Con fields la risposta contiene solo i campi scelti, senza i default del modello.
+    """
+    if fields is not None:
+        return ORJSONResponse(await decode_documents([select_fields(document, fields) for document in documents]))
+    return ORJSONResponse([item.model_dump() for item in await construct_models(model, documents)])
@@ -1,8 +1,7 @@
 from fastapi import FastAPI, APIRouter
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from starlette.responses import PlainTextResponse
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
@@ -11,17 +10,25 @@ import uuid
 from datetime import datetime
 
 # Importa le routes
-from routes import settings, filesystem, terminal, notepad
-from database import init_default_data
+from routes import settings, filesystem, terminal, notepad, admin, jobs, trash
+from database import init_default_data, ensure_indexes, client, db
+from scheduler import scheduler
+from maintenance import register_maintenance_jobs
+from system_monitor import register_system_monitor
+from loop_monitor import loop_monitor, LOOP_MONITOR_ENABLED
+from offload import shutdown_pools
+from content_store import content_store
+from jobs import job_manager
+from coherence import coherence_bus
+from invalidation import apply_invalidation
+from metrics import MetricsMiddleware, registry, CONTENT_TYPE_LATEST
+from compression import CompressionMiddleware
+from rate_limit import AdmissionMiddleware
+from diagnostics import slow_queries, EXPLAIN_INTERVAL_SECONDS
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
 # Create the main app without a prefix
 app = FastAPI(title="FutureOS API", version="1.0.0")
 
@@ -54,15 +61,25 @@ async def get_status_checks():
     status_checks = await db.status_checks.find().to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+@api_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Esponi le metriche in formato testuale Prometheus"""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE_LATEST)
+
 # Include all the new routes
 api_router.include_router(settings.router)
 api_router.include_router(filesystem.router)
 api_router.include_router(terminal.router)
 api_router.include_router(notepad.router)
+api_router.include_router(admin.router)
+api_router.include_router(jobs.router)
+api_router.include_router(trash.router)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Dall'interno verso l'esterno: ammissione, CORS (anche sui 429), compressione, metriche
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -70,6 +87,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -82,9 +101,34 @@ logger = logging.getLogger(__name__)
 async def startup_event():
     """Inizializza i dati di default all'avvio"""
     logger.info("Inizializzazione FutureOS API...")
+    await ensure_indexes()
     await init_default_data()
+    await coherence_bus.start(apply_invalidation)
+    register_maintenance_jobs(scheduler)
+    register_system_monitor(scheduler)
+    if slow_queries is not None:
+        # Diagnostica opzionale: le shape lente sono locali al worker, quindi ogni
+        # worker spiega le proprie e il job gira su tutti
+        scheduler.every(
+            "capture_explain_plans",
+            EXPLAIN_INTERVAL_SECONDS,
+            lambda: slow_queries.capture_explain_plans(client),
+            leader_only=False
+        )
+        logger.info(f"Slow-query log attivo (soglia {slow_queries.threshold_ms} ms)")
+    await scheduler.start()
+    await job_manager.start()
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start(app)
     logger.info("FutureOS API inizializzata con successo!")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await loop_monitor.stop()
+    await job_manager.stop()
+    await scheduler.stop()
+    await coherence_bus.stop()
+    shutdown_pools()
+    if content_store is not None:
+        content_store.close()
     client.close()
\ No newline at end of file
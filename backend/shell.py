@@ -0,0 +1,262 @@
+"""Analisi delle righe di comando del terminale
+
+Il tokenizer segue le regole essenziali della shell POSIX: apici singoli e
+doppi, backslash, e gli operatori |, > e >> anche senza spazi intorno. I
+caratteri jolly (*, ? e [...]) fuori dagli apici vengono espansi sul
+filesystem virtuale con una sola query per parola: sull'indice
+(user_id, parent_path, name) quando solo l'ultimo componente contiene
+caratteri jolly, altrimenti con una regex ancorata sul path, che usa il
+prefisso letterale come intervallo dell'indice.
+
+L'output dei comandi passa da uno all'altro come flusso asincrono di
+stringhe (stream); iter_lines lo divide in righe senza concatenarlo.
+"""
+import re
+from database import filesystem_collection
+from paths import is_within, normalize_path
+from trash import NOT_TRASHED, trash_filter
+
+PIPE = "|"
+REDIRECT = ">"
+APPEND = ">>"
+# Risultati massimi dell'espansione di una singola parola
+MAX_GLOB_MATCHES = 1000
+
+_GLOB_CHARS = "*?["
+
+
+class ShellSyntaxError(ValueError):
+    pass
+
+
+class Word:
+    """Parola della riga: testo senza apici e pattern con i caratteri quotati protetti da backslash"""
+
+    __slots__ = ("text", "pattern", "magic")
+
+    def __init__(self, text, pattern, magic):
+        self.text = text
+        self.pattern = pattern
+        self.magic = magic
+
+
+class Command:
+    __slots__ = ("words", "redirect", "append")
+
+    def __init__(self, words, redirect=None, append=False):
+        self.words = words
+        self.redirect = redirect
+        self.append = append
+
+
+def tokenize(line):
+    """Divide la riga in parole (Word) e operatori (PIPE, REDIRECT, APPEND)"""
+    tokens = []
+    text, pattern = [], []
+    in_word = magic = False
+    i, length = 0, len(line)
+
+    def quoted(char):
+        text.append(char)
+        pattern.append("\\" + char if char in _GLOB_CHARS + "]\\" else char)
+
+    def end_word():
+        nonlocal in_word, magic
+        if in_word:
+            tokens.append(Word("".join(text), "".join(pattern), magic))
+        text.clear()
+        pattern.clear()
+        in_word = magic = False
+
+    while i < length:
+        char = line[i]
+        if char.isspace():
+            end_word()
+        elif char == "|":
+            end_word()
+            tokens.append(PIPE)
+        elif char == ">":
+            end_word()
+            if line.startswith(">>", i):
+                tokens.append(APPEND)
+                i += 1
+            else:
+                tokens.append(REDIRECT)
+        elif char == "'":
+            end = line.find("'", i + 1)
+            if end < 0:
+                raise ShellSyntaxError("apice singolo non chiuso")
+            in_word = True
+            for quoted_char in line[i + 1:end]:
+                quoted(quoted_char)
+            i = end
+        elif char == '"':
+            in_word = True
+            i += 1
+            while i < length and line[i] != '"':
+                # Dentro i doppi apici il backslash protegge solo " e \
+                if line[i] == "\\" and i + 1 < length and line[i + 1] in '"\\':
+                    i += 1
+                quoted(line[i])
+                i += 1
+            if i >= length:
+                raise ShellSyntaxError("doppio apice non chiuso")
+        elif char == "\\":
+            in_word = True
+            if i + 1 < length:
+                i += 1
+                quoted(line[i])
+        else:
+            in_word = True
+            text.append(char)
+            pattern.append(char)
+            magic = magic or char in _GLOB_CHARS
+        i += 1
+    end_word()
+    return tokens
+
+
+def parse(line):
+    """Divide la riga nei comandi della pipeline, ciascuno con l'eventuale redirezione"""
+    commands = []
+    command = Command([])
+    tokens = iter(tokenize(line))
+    for token in tokens:
+        if token == PIPE:
+            if not command.words:
+                raise ShellSyntaxError("pipe senza comando")
+            commands.append(command)
+            command = Command([])
+        elif token in (REDIRECT, APPEND):
+            target = next(tokens, None)
+            if not isinstance(target, Word):
+                raise ShellSyntaxError(f"manca il file dopo {token}")
+            command.redirect = target
+            command.append = token == APPEND
+        else:
+            command.words.append(token)
+    if not command.words:
+        if commands or command.redirect is not None:
+            raise ShellSyntaxError("comando mancante")
+        return []
+    commands.append(command)
+    return commands
+
+
+def _has_magic(pattern):
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in _GLOB_CHARS:
+            return True
+    return False
+
+
+def _unescape(pattern):
+    return re.sub(r"\\(.)", r"\1", pattern)
+
+
+def glob_regex(pattern):
+    """Traduce un pattern glob (un componente o più, separati da /) in regex; i jolly non attraversano /"""
+    regex = []
+    i, length = 0, len(pattern)
+    while i < length:
+        char = pattern[i]
+        if char == "\\" and i + 1 < length:
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        elif char == "*":
+            regex.append("[^/]*")
+        elif char == "?":
+            regex.append("[^/]")
+        elif char == "[":
+            end = i + 1
+            if end < length and pattern[end] in "!^":
+                end += 1
+            if end < length and pattern[end] == "]":
+                end += 1
+            end = pattern.find("]", end)
+            if end < 0:
+                regex.append(re.escape(char))
+            else:
+                members = _unescape(pattern[i + 1:end])
+                negate = members[:1] in ("!", "^")
+                if negate:
+                    members = members[1:]
+                members = members.replace("\\", "\\\\").replace("^", "\\^").replace("[", "\\[")
+                regex.append(f"[^/{members}]" if negate else f"[{members}]")
+                i = end
+        else:
+            regex.append(re.escape(char))
+        i += 1
+    return "".join(regex)
+
+
+async def expand_word(word, cwd, user_id="default_user"):
+    """Espande i caratteri jolly della parola; senza corrispondenze resta il testo letterale"""
+    if not word.magic or not _has_magic(word.pattern):
+        return [word.text]
+
+    absolute = normalize_path(word.pattern, cwd)
+    components = absolute.split("/")[1:]
+    first_magic = next((index for index, component in enumerate(components) if _has_magic(component)), None)
+    if first_magic is None:
+        # Il componente con i jolly è stato eliminato da un ".." successivo
+        return [normalize_path(_unescape(word.pattern), cwd)]
+    literal = "/" + "/".join(_unescape(component) for component in components[:first_magic])
+
+    if first_magic == len(components) - 1:
+        # Solo il nome contiene jolly: elenco di una sola directory
+        query = {"parent_path": literal, "name": {"$regex": f"^{glob_regex(components[-1])}$"}}
+    else:
+        prefix = literal.rstrip("/") + "/"
+        rest = glob_regex("/".join(components[first_magic:]))
+        query = {"path": {"$regex": f"^{re.escape(prefix)}{rest}$"}}
+    documents = await filesystem_collection.find(
+        {"user_id": user_id, **query, **NOT_TRASHED}, {"_id": 0, "path": 1},
+        sort=[("path", 1)], limit=MAX_GLOB_MATCHES + 1
+    ).to_list(MAX_GLOB_MATCHES + 1)
+    if len(documents) > MAX_GLOB_MATCHES:
+        raise ShellSyntaxError(f"{word.text}: troppi risultati (massimo {MAX_GLOB_MATCHES})")
+    hidden = await trash_filter(user_id)
+    paths = [document["path"] for document in documents if not hidden(document["path"])]
+    if not paths:
+        return [word.text]
+
+    # I risultati mantengono la forma della parola scritta: assoluta o relativa a cwd
+    if word.text.startswith(("/", "~")):
+        return paths
+    typed_directory, separator, _ = word.text.rstrip("/").rpartition("/")
+    if first_magic == len(components) - 1 and separator:
+        return [f"{typed_directory}/{path.rsplit('/', 1)[1]}" for path in paths]
+    base = cwd.rstrip("/") + "/"
+    return [path[len(base):] if is_within(path, cwd) and path != cwd else path for path in paths]
+
+
+async def expand_words(words, cwd, user_id="default_user"):
+    args = []
+    for word in words:
+        args.extend(await expand_word(word, cwd, user_id))
+    return args
+
+
+async def iter_lines(stream):
+    """Righe di uno stream di stringhe, ciascuna con il suo \\n (tranne eventualmente l'ultima)"""
+    pending = ""
+    async for chunk in stream:
+        start = 0
+        end = chunk.find("\n")
+        while end >= 0:
+            if pending:
+                yield pending + chunk[start:end + 1]
+                pending = ""
+            else:
+                yield chunk[start:end + 1]
+            start = end + 1
+            end = chunk.find("\n", start)
+        pending += chunk[start:]
+    if pending:
+        yield pending
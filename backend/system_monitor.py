@@ -0,0 +1,248 @@
+"""Campionamento dello stato del server per l'app System Info
+
+Un job dello scheduler, eseguito su ogni worker, raccoglie a intervallo fisso
+memoria e CPU del processo, ritardo dell'event loop, connessioni aperte e uso
+del pool MongoDB. I totali di spazio per utente richiedono un'aggregazione su
+tutte le collection: la esegue solo il leader, con una cadenza più lenta, e
+salva il risultato in system_samples, da cui gli altri worker lo rileggono
+con una sola find_one. L'ultimo campione resta in memoria:
+/settings/system-info lo legge senza accedere al database.
+"""
+import asyncio
+import os
+import resource
+import shutil
+import time
+from datetime import datetime
+from database import filesystem_collection, notepad_files_collection, system_samples_collection
+from metrics import registry, mongo_pool_connections
+from loop_monitor import loop_monitor
+
+SYSTEM_SAMPLE_INTERVAL = float(os.environ.get("SYSTEM_SAMPLE_INTERVAL", "10"))
+STORAGE_SAMPLE_INTERVAL = float(os.environ.get("STORAGE_SAMPLE_INTERVAL", "300"))
+# Documento di system_samples con gli ultimi totali di spazio calcolati dal leader
+_STORAGE_SAMPLE_ID = "storage"
+
+process_resident_memory = registry.gauge(
+    "futureos_process_resident_memory_bytes",
+    "Memoria residente del processo",
+)
+process_cpu_percent = registry.gauge(
+    "futureos_process_cpu_percent",
+    "Uso di CPU del processo nell'ultimo intervallo di campionamento",
+)
+process_open_connections = registry.gauge(
+    "futureos_process_open_connections",
+    "Socket aperti dal processo (client HTTP e connessioni MongoDB)",
+)
+user_storage_bytes = registry.gauge(
+    "futureos_user_storage_bytes",
+    "Spazio occupato dai contenuti di file e note per utente",
+    ("user_id",),
+)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _resident_memory():
+    """RSS attuale da /proc (Linux); altrove il picco riportato da getrusage"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss è in KiB su Linux e in byte su macOS
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def _open_sockets():
+    try:
+        descriptors = os.listdir("/proc/self/fd")
+    except OSError:
+        return None
+    count = 0
+    for descriptor in descriptors:
+        try:
+            if os.readlink(f"/proc/self/fd/{descriptor}").startswith("socket:"):
+                count += 1
+        except OSError:
+            continue
+    return count
+
+
+def _host_memory_total():
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if hasattr(os, "sysconf"):
+        try:
+            return os.sysconf("SC_PHYS_PAGES") * _PAGE_SIZE
+        except (ValueError, OSError):
+            pass
+    return None
+
+
+def _format_uptime(seconds):
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    return f"{hours}h {minutes}m"
+
+
+def _format_gigabytes(value):
+    return f"{round(value / 1024 ** 3)} GB"
+
+
+class SystemMonitor:
+    def __init__(self):
+        self.started_at = time.time()
+        self._snapshot = {}
+        self._storage = {}
+        self._storage_sampled_at = None
+        self._last_cpu = None
+
+    def snapshot(self):
+        """Ultimo campione disponibile (vuoto prima del primo campionamento)"""
+        return self._snapshot
+
+    async def _loop_lag(self):
+        """Ritardo dell'event loop: dal monitor dedicato se attivo, altrimenti misurato qui"""
+        if loop_monitor.running and loop_monitor.last_lag is not None:
+            return loop_monitor.last_lag
+        loop = asyncio.get_running_loop()
+        scheduled = loop.time()
+        await asyncio.sleep(0)
+        return loop.time() - scheduled
+
+    def _cpu_percent(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_seconds = usage.ru_utime + usage.ru_stime
+        now = time.monotonic()
+        previous, self._last_cpu = self._last_cpu, (cpu_seconds, now)
+        if previous is None or now <= previous[1]:
+            return None
+        return round(100 * (cpu_seconds - previous[0]) / (now - previous[1]), 1)
+
+    async def sample(self):
+        """Aggiorna il campione dei valori di processo (nessun accesso al database)"""
+        rss = _resident_memory()
+        cpu = self._cpu_percent()
+        lag = await self._loop_lag()
+        sockets = _open_sockets()
+        disk = shutil.disk_usage("/")
+
+        process_resident_memory.set(rss)
+        if cpu is not None:
+            process_cpu_percent.set(cpu)
+        if sockets is not None:
+            process_open_connections.set(sockets)
+
+        self._snapshot = {
+            "sampled_at": datetime.utcnow(),
+            "uptime_seconds": time.time() - self.started_at,
+            "memory_total_bytes": _host_memory_total(),
+            "disk_total_bytes": disk.total,
+            "disk_free_bytes": disk.free,
+            "process_rss_bytes": rss,
+            "cpu_percent": cpu,
+            "event_loop_lag_ms": round(lag * 1000, 3),
+            "open_connections": sockets,
+            "mongo_pool_open": mongo_pool_connections.value(state="open"),
+            "mongo_pool_in_use": mongo_pool_connections.value(state="in_use"),
+        }
+
+    async def sample_storage(self):
+        """Calcola i totali di spazio e numero di elementi per utente e li condivide (solo leader)"""
+        totals = {}
+        for collection in (filesystem_collection, notepad_files_collection):
+            rows = await collection.aggregate([
+                {"$group": {
+                    "_id": "$user_id",
+                    "bytes": {"$sum": {"$ifNull": ["$size", 0]}},
+                    "items": {"$sum": 1}
+                }}
+            ]).to_list(None)
+            for row in rows:
+                total = totals.setdefault(row["_id"], {"bytes": 0, "items": 0})
+                total["bytes"] += row["bytes"]
+                total["items"] += row["items"]
+        sampled_at = datetime.utcnow()
+        await system_samples_collection.update_one(
+            {"_id": _STORAGE_SAMPLE_ID},
+            {"$set": {
+                "sampled_at": sampled_at,
+                # Lista e non dizionario: gli user_id possono contenere punti
+                "totals": [{"user_id": user_id, **total} for user_id, total in totals.items()],
+            }},
+            upsert=True
+        )
+        self._apply_storage(totals, sampled_at)
+
+    async def load_storage(self):
+        """Rilegge gli ultimi totali calcolati dal leader"""
+        document = await system_samples_collection.find_one({"_id": _STORAGE_SAMPLE_ID})
+        if document is None or document["sampled_at"] == self._storage_sampled_at:
+            return
+        totals = {
+            row["user_id"]: {"bytes": row["bytes"], "items": row["items"]} for row in document["totals"]
+        }
+        self._apply_storage(totals, document["sampled_at"])
+
+    def _apply_storage(self, totals, sampled_at):
+        for user_id in self._storage.keys() - totals.keys():
+            # Utente senza più contenuti: la serie sparisce invece di restare all'ultimo valore
+            user_storage_bytes.remove(user_id=user_id)
+        for user_id, total in totals.items():
+            user_storage_bytes.set(total["bytes"], user_id=user_id)
+        self._storage = totals
+        self._storage_sampled_at = sampled_at
+
+    def system_info(self, user_id="default_user"):
+        """Campi di SystemInfo ricavati dall'ultimo campione"""
+        snapshot = self._snapshot
+        info = {
+            "uptime": _format_uptime(snapshot.get("uptime_seconds", time.time() - self.started_at)),
+            "process_rss_bytes": snapshot.get("process_rss_bytes"),
+            "cpu_percent": snapshot.get("cpu_percent"),
+            "event_loop_lag_ms": snapshot.get("event_loop_lag_ms"),
+            "open_connections": snapshot.get("open_connections"),
+            "mongo_pool_open": snapshot.get("mongo_pool_open"),
+            "mongo_pool_in_use": snapshot.get("mongo_pool_in_use"),
+            "sampled_at": snapshot.get("sampled_at"),
+        }
+        if snapshot.get("memory_total_bytes"):
+            info["memory_ram"] = _format_gigabytes(snapshot["memory_total_bytes"])
+        if snapshot.get("disk_total_bytes"):
+            info["disk_space"] = _format_gigabytes(snapshot["disk_total_bytes"])
+            info["disk_free"] = _format_gigabytes(snapshot["disk_free_bytes"])
+        storage = self._storage.get(user_id)
+        if storage is not None:
+            info["storage_used_bytes"] = storage["bytes"]
+            info["storage_items"] = storage["items"]
+        return info
+
+
+system_monitor = SystemMonitor()
+
+
+def register_system_monitor(scheduler):
+    """Registra i campionamenti: ogni worker mantiene il proprio campione
+
+    L'aggregazione dello spazio gira solo sul leader; gli altri worker
+    rileggono il risultato, con un ritardo massimo di un intervallo.
+    """
+    scheduler.every(
+        "system_sample", SYSTEM_SAMPLE_INTERVAL, system_monitor.sample,
+        jitter=0.0, leader_only=False, run_at_start=True
+    )
+    scheduler.every(
+        "storage_sample", STORAGE_SAMPLE_INTERVAL, system_monitor.sample_storage,
+        leader_only=True, run_at_start=True
+    )
+    scheduler.every(
+        "storage_sample_load", STORAGE_SAMPLE_INTERVAL, system_monitor.load_storage,
+        leader_only=False, run_at_start=True
+    )
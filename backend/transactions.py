@@ -0,0 +1,83 @@
+"""Transazioni MongoDB multi-documento con retry automatico
+
+run_transaction esegue una callback dentro una transazione, ripetendola in
+caso di errori transitori (conflitti di scrittura, elezioni) e ritentando il
+commit quando il suo esito è incerto (fino a TRANSACTION_MAX_ATTEMPTS volte,
+poi l'errore arriva al chiamante). Su un mongod standalone, dove le
+transazioni non sono disponibili, la callback viene eseguita senza sessione.
+"""
+import asyncio
+import logging
+import random
+from pymongo.errors import OperationFailure, PyMongoError
+from database import SESSIONS_SUPPORTED, client
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_MAX_ATTEMPTS = 5
+TRANSACTION_BACKOFF_SECONDS = 0.02
+
+# Codice restituito da un mongod standalone ("IllegalOperation")
+_TRANSACTIONS_UNSUPPORTED_CODE = 20
+
+transaction_retries = registry.counter(
+    "futureos_transaction_retries_total",
+    "Transazioni ripetute per errori transitori",
+)
+
+# None finché il primo tentativo non ha mostrato se il server supporta le transazioni
+_transactions_supported = None if SESSIONS_SUPPORTED else False
+
+
+def _transactions_unsupported(error):
+    return isinstance(error, OperationFailure) and error.code == _TRANSACTIONS_UNSUPPORTED_CODE
+
+
+def _backoff(attempt):
+    return TRANSACTION_BACKOFF_SECONDS * attempt * (1 + random.random())
+
+
+async def _commit_with_retry(session, max_attempts=TRANSACTION_MAX_ATTEMPTS):
+    """Ritenta il commit dall'esito incerto; dopo max_attempts tentativi solleva l'ultimo errore"""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            await session.commit_transaction()
+            return
+        except PyMongoError as e:
+            if not e.has_error_label("UnknownTransactionCommitResult") or attempt == max_attempts:
+                raise
+            transaction_retries.inc()
+            await asyncio.sleep(_backoff(attempt))
+
+
+async def run_transaction(callback, max_attempts=TRANSACTION_MAX_ATTEMPTS):
+    """Esegue callback(session) in una transazione e ne restituisce il risultato"""
+    global _transactions_supported
+    if _transactions_supported is False:
+        return await callback(None)
+
+    for attempt in range(1, max_attempts + 1):
+        session = await client.start_session()
+        async with session:
+            try:
+                session.start_transaction()
+                try:
+                    result = await callback(session)
+                except BaseException:
+                    if session.in_transaction:
+                        await session.abort_transaction()
+                    raise
+                await _commit_with_retry(session)
+                _transactions_supported = True
+                return result
+            except PyMongoError as e:
+                if _transactions_unsupported(e):
+                    logger.warning("Transazioni non supportate dal server MongoDB: operazioni senza transazione")
+                    _transactions_supported = False
+                    return await callback(None)
+                if e.has_error_label("TransientTransactionError") and attempt < max_attempts:
+                    transaction_retries.inc()
+                    await asyncio.sleep(_backoff(attempt))
+                    continue
+                raise
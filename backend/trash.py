@@ -0,0 +1,75 @@
+"""Cestino: eliminazione logica dei sottoalberi del filesystem
+
+Eliminare un nodo lo marca soltanto con trashed_at, con una sola scrittura
+qualunque sia la dimensione del sottoalbero. I discendenti restano invariati
+e sono nascosti perché un loro antenato è nel cestino. Le radici nel cestino
+di un utente sono poche: vengono lette con l'indice parziale su trashed_at e
+tenute in memoria, quindi il controllo costa un lookup per ogni livello del
+path. L'eliminazione fisica avviene a lotti in background (job purge_trash).
+"""
+import os
+from database import filesystem_collection
+
+TRASHED_FIELD = "trashed_at"
+# Nodo preso in carico da un purge in corso: non può più essere ripristinato
+PURGING_FIELD = "purging_at"
+# Dopo questo tempo i nodi nel cestino vengono eliminati definitivamente
+TRASH_RETENTION_SECONDS = float(os.environ.get("TRASH_RETENTION_SECONDS", str(30 * 24 * 3600)))
+
+# Condizioni per i nodi fuori dal cestino (campo assente o null) e per le radici nel cestino
+NOT_TRASHED = {TRASHED_FIELD: None}
+IS_TRASHED = {TRASHED_FIELD: {"$type": "date"}}
+
+
+class TrashedRoots:
+    """Path delle radici nel cestino per utente, invalidati da ogni operazione sul cestino"""
+
+    def __init__(self):
+        self._roots = {}
+        self._generation = 0
+
+    async def get(self, user_id):
+        roots = self._roots.get(user_id)
+        if roots is None:
+            generation = self._generation
+            documents = await filesystem_collection.find(
+                {"user_id": user_id, **IS_TRASHED}, {"_id": 0, "path": 1}
+            ).to_list(None)
+            roots = frozenset(document["path"] for document in documents)
+            # Un'invalidazione arrivata durante la lettura rende il risultato inaffidabile
+            if generation == self._generation:
+                self._roots[user_id] = roots
+        return roots
+
+    def invalidate(self, user_id=None):
+        self._generation += 1
+        if user_id is None:
+            self._roots.clear()
+        else:
+            self._roots.pop(user_id, None)
+
+
+trashed_roots = TrashedRoots()
+
+
+def within_trash(path, roots):
+    """Vero se path o uno dei suoi antenati è tra le radici nel cestino"""
+    if not roots:
+        return False
+    while path:
+        if path in roots:
+            return True
+        if path == "/":
+            return False
+        path = path.rsplit("/", 1)[0] or "/"
+    return False
+
+
+async def is_trashed(path, user_id="default_user"):
+    return within_trash(path, await trashed_roots.get(user_id))
+
+
+async def trash_filter(user_id="default_user"):
+    """Predicato sincrono sui path, per filtrare molti nodi con una sola lettura delle radici"""
+    roots = await trashed_roots.get(user_id)
+    return lambda path: within_trash(path, roots)
@@ -0,0 +1,51 @@
+"""Costruzione dell'albero del filesystem a partire dall'elenco dei nodi
+
+build_tree può essere eseguita in un processo del pool CPU (vedi
+offload.py): il modulo dipende solo da content_codec per decodificare i
+contenuti, e nel processo del pool content_store apre la stessa directory
+dei segmenti a partire dalla configurazione d'ambiente. I nodi vanno passati
+ordinati per path, così ogni directory precede i suoi contenuti.
+"""
+from content_codec import decoded
+
+
+def add_to_tree(item, tree_node):
+    path_parts = item["path"].strip("/").split("/")
+    current_node = tree_node
+    
+    for i, part in enumerate(path_parts):
+        if not part:  # Root case
+            if "/" not in current_node:
+                current_node["/"] = {
+                    "type": item["type"],
+                    "name": item["name"],
+                    "children": {} if item["type"] == "folder" else None,
+                    "content": item.get("content"),
+                    "size": item.get("size"),
+                    "modified": item.get("modified_at")
+                }
+            current_node = current_node["/"]
+            continue
+            
+        if "children" not in current_node:
+            current_node["children"] = {}
+        
+        if part not in current_node["children"]:
+            current_node["children"][part] = {
+                "type": item["type"],
+                "name": item["name"],
+                "children": {} if item["type"] == "folder" else None,
+                "content": item.get("content"),
+                "size": item.get("size"),
+                "modified": item.get("modified_at")
+            }
+        
+        current_node = current_node["children"][part]
+
+
+def build_tree(items):
+    """Costruisce l'albero annidato dei nodi indicizzato per nome"""
+    tree = {}
+    for item in items:
+        add_to_tree(decoded(item), tree)
+    return tree
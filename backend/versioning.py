@@ -0,0 +1,101 @@
+"""Versioni dei documenti e scritture compare-and-set
+
+Nodi del filesystem e file del notepad hanno un campo version intero che
+ogni scrittura incrementa. L'ETag di un singolo documento è
+"<versione>-<_id>": il client lo rimanda nell'header If-Match (oppure
+invia la sola versione) e la scrittura viene eseguita con versione e _id
+nella condizione della query, in un unico round-trip. Se nel frattempo il
+documento è cambiato risponde 409 con l'ETag attuale invece di
+sovrascriverlo. Le scritture riuscite restituiscono il nuovo ETag.
+
+I documenti creati prima dell'introduzione del campo valgono come versione 0.
+"""
+from bson import ObjectId
+from fastapi import HTTPException
+
+VERSION_FIELD = "version"
+INITIAL_VERSION = 1
+
+# Da aggiungere all'update di ogni scrittura sul documento
+VERSION_INCREMENT = {"$inc": {VERSION_FIELD: 1}}
+
+
+class VersionConflictError(Exception):
+    """Il documento ha un'altra versione; current è il documento attuale (almeno _id e version)"""
+
+    def __init__(self, current):
+        super().__init__(current.get(VERSION_FIELD, 0))
+        self.current = current
+
+    @property
+    def current_version(self):
+        return self.current.get(VERSION_FIELD, 0)
+
+
+class ExpectedVersion:
+    """Precondizione letta da If-Match; document_id è presente se il client ha inviato un ETag"""
+
+    __slots__ = ("version", "document_id")
+
+    def __init__(self, version, document_id=None):
+        self.version = version
+        self.document_id = document_id
+
+
+def document_etag(document):
+    """ETag di un singolo documento, valido anche come If-Match"""
+    return f'"{document.get(VERSION_FIELD, 0)}-{document["_id"]}"'
+
+
+def if_match_version(request):
+    """Precondizione dall'header If-Match: None se assente o "*"
+
+    Accetta l'ETag del documento (anche con i suffissi di fields= e della
+    compressione) o la sola versione intera.
+    """
+    header = request.headers.get("if-match")
+    if header is None or header.strip() == "*":
+        return None
+    # "<versione>-<_id>[-f<variante>][-gzip]" oppure "<versione>"
+    parts = header.strip().removeprefix("W/").strip('"').split("-")
+    try:
+        version = int(parts[0])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match deve contenere l'ETag o la versione del documento")
+    return ExpectedVersion(version, parts[1] if len(parts) > 1 and parts[1] else None)
+
+
+def version_condition(expected_version):
+    """Condizione sul campo version per la query di una scrittura compare-and-set"""
+    if expected_version == 0:
+        # $in con None corrisponde anche ai documenti senza il campo
+        return {"$in": [0, None]}
+    return expected_version
+
+
+def expected_condition(expected):
+    """Condizioni da aggiungere alla query di una scrittura compare-and-set"""
+    condition = {VERSION_FIELD: version_condition(expected.version)}
+    if expected.document_id is not None:
+        document_id = expected.document_id
+        condition["_id"] = ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id
+    return condition
+
+
+def matches_expected(document, expected):
+    """Verifica in memoria della precondizione su un documento già letto"""
+    if document.get(VERSION_FIELD, 0) != expected.version:
+        return False
+    return expected.document_id is None or str(document["_id"]) == expected.document_id
+
+
+def conflict(current):
+    """409 con la versione e l'ETag attuali del documento"""
+    return HTTPException(
+        status_code=409,
+        detail=(
+            "Conflitto di versione: il documento è stato modificato "
+            f"(versione attuale {current.get(VERSION_FIELD, 0)})"
+        ),
+        headers={"ETag": document_etag(current)}
+    )
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+FutureOS Backend Benchmark Suite
+Measures latency and throughput of the FutureOS API under a mixed workload.
+
+The API can be driven in-process (ASGI transport, no network), under a local
+uvicorn process, or at an existing URL. Storage is either a local mongod
+(MONGO_URL) or the embedded engine, in memory or persisted to SQLite.
+Everything it imports (httpx, uvicorn and the backend itself) is listed in
+backend/requirements.txt; no extra package is needed for the memory mode.
+
+Examples:
+    python backend_bench.py --storage memory --duration 20
+    python backend_bench.py --mode uvicorn --depth 3 --fanout 5 --output run.json
+    python backend_bench.py --baseline bench_results.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / "backend"
+BENCH_ROOT = "/bench"
+DEFAULT_WORKLOAD = "ls=25,cd=15,cat=20,listing=10,tree=5,autosave=15,history=10"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_workload(spec):
+    """Parse 'op=weight,op=weight' into a list of (op, weight)"""
+    weights = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in FutureOSBenchmark.OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}', expected one of {sorted(FutureOSBenchmark.OPERATIONS)}")
+        weights.append((name, float(weight or 1)))
+    return weights
+
+
+class FutureOSBenchmark:
+    OPERATIONS = ("ls", "cd", "cat", "listing", "tree", "autosave", "history")
+
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.workload = parse_workload(args.workload)
+        self.directories = []
+        self.files = []
+        self.notes = []
+        self.samples = {}
+
+    async def seed(self):
+        """Create a tree of folders and files under /bench plus some notepad files"""
+        rng = random.Random(self.args.seed)
+        content = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz \n") for _ in range(self.args.file_size))
+
+        await self.client.delete(f"/api/filesystem{BENCH_ROOT}")
+        await self._create(BENCH_ROOT, "/", "folder")
+        self.directories.append(BENCH_ROOT)
+
+        level = [BENCH_ROOT]
+        for _ in range(self.args.depth):
+            next_level = []
+            for parent in level:
+                for i in range(self.args.fanout):
+                    path = f"{parent}/dir{i}"
+                    await self._create(path, parent, "folder")
+                    next_level.append(path)
+            self.directories.extend(next_level)
+            level = next_level
+
+        for directory in self.directories:
+            for i in range(self.args.files_per_dir):
+                path = f"{directory}/file{i}.txt"
+                await self._create(path, directory, "file", content)
+                self.files.append(path)
+
+        for i in range(self.args.notes):
+            name = f"bench_note_{i}.txt"
+            await self.client.post(f"/api/notepad/files/{name}/save", params={"content": content})
+            self.notes.append(name)
+
+        print(f"🌱 Seeded {len(self.directories)} folders, {len(self.files)} files, {len(self.notes)} notes")
+
+    async def _create(self, path, parent_path, item_type, content=None):
+        response = await self.client.post("/api/filesystem/", json={
+            "name": path.rsplit("/", 1)[-1],
+            "type": item_type,
+            "path": path,
+            "parent_path": parent_path,
+            "content": content,
+        })
+        if response.status_code != 200:
+            raise RuntimeError(f"Seeding {path} failed: HTTP {response.status_code}: {response.text}")
+
+    async def cleanup(self):
+        await self.client.delete(f"/api/filesystem{BENCH_ROOT}")
+        for name in self.notes:
+            await self.client.delete(f"/api/notepad/files/{name}")
+
+    def _request_for(self, op, rng):
+        """Return (method, url, params) for one operation of the workload"""
+        if op == "ls":
+            return "POST", "/api/terminal/execute", {
+                "command": "ls", "current_directory": rng.choice(self.directories)}
+        if op == "cd":
+            target = rng.choice(self.directories)
+            parent, _, name = target.rpartition("/")
+            return "POST", "/api/terminal/execute", {
+                "command": f"cd {name}", "current_directory": parent or "/"}
+        if op == "cat":
+            target = rng.choice(self.files)
+            directory, _, name = target.rpartition("/")
+            return "POST", "/api/terminal/execute", {
+                "command": f"cat {name}", "current_directory": directory}
+        if op == "listing":
+            return "GET", "/api/filesystem/", {"path": rng.choice(self.directories)}
+        if op == "tree":
+            return "GET", "/api/filesystem/tree", None
+        if op == "autosave":
+            name = rng.choice(self.notes) if self.notes else "bench_note.txt"
+            return "POST", f"/api/notepad/files/{name}/save", {
+                "content": f"autosave {rng.random()}"}
+        return "GET", "/api/terminal/history", None
+
+    async def _worker(self, worker_id, deadline, budget):
+        rng = random.Random(self.args.seed + worker_id)
+        ops = [op for op, _ in self.workload]
+        weights = [weight for _, weight in self.workload]
+        while time.perf_counter() < deadline and budget["remaining"] != 0:
+            budget["remaining"] -= 1
+            op = rng.choices(ops, weights)[0]
+            method, url, params = self._request_for(op, rng)
+            start = time.perf_counter()
+            try:
+                response = await self.client.request(method, url, params=params)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            latencies, errors = self.samples.setdefault(op, ([], [0]))
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+    async def run(self):
+        if self.args.warmup:
+            await asyncio.gather(*(self._worker(i, float("inf"), {"remaining": self.args.warmup})
+                                   for i in range(self.args.concurrency)))
+            self.samples = {}
+
+        budget = {"remaining": self.args.requests or -1}
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        await asyncio.gather(*(self._worker(i, deadline, budget) for i in range(self.args.concurrency)))
+        return self.report(time.perf_counter() - start)
+
+    def report(self, wall_time):
+        endpoints = {}
+        all_latencies = []
+        for op, (latencies, errors) in sorted(self.samples.items()):
+            latencies.sort()
+            all_latencies.extend(latencies)
+            endpoints[op] = {
+                "requests": len(latencies),
+                "errors": errors[0],
+                "rps": round(len(latencies) / wall_time, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+            }
+        all_latencies.sort()
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "config": {key: value for key, value in vars(self.args).items() if key not in ("output", "baseline")},
+            "wall_time_s": round(wall_time, 3),
+            "total": {
+                "requests": len(all_latencies),
+                "rps": round(len(all_latencies) / wall_time, 2),
+                "p50_ms": round(percentile(all_latencies, 50) * 1000, 3),
+                "p99_ms": round(percentile(all_latencies, 99) * 1000, 3),
+            },
+            "endpoints": endpoints,
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    print("\n" + "=" * 78)
+    print("📊 BENCHMARK RESULTS")
+    print("=" * 78)
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'rps':>10} {'p50 ms':>10} {'p99 ms':>10}   vs baseline")
+    rows = list(results["endpoints"].items()) + [("TOTAL", results["total"])]
+    for name, stats in rows:
+        line = (f"{name:<10} {stats['requests']:>9} {stats.get('errors', 0):>7} "
+                f"{stats['rps']:>10.1f} {stats['p50_ms']:>10.2f} {stats['p99_ms']:>10.2f}")
+        if baseline:
+            base = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+            if base:
+                line += "   " + "  ".join(
+                    f"{key} {delta(stats[key], base[key])}" for key in ("rps", "p50_ms", "p99_ms"))
+        print(line)
+
+
+def delta(current, base):
+    if not base:
+        return "n/a"
+    return f"{(current - base) / base * 100:+.1f}%"
+
+
+async def run_inprocess(args):
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_benchmark(client, args)
+
+
+async def run_against_url(args, base_url):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        return await run_benchmark(client, args)
+
+
+async def run_benchmark(client, args):
+    # httpx logs every request at INFO once the backend configures logging: that
+    # would time the console output along with the API
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    bench = FutureOSBenchmark(client, args)
+    await bench.seed()
+    print(f"🚀 Running for {args.duration}s with concurrency {args.concurrency}")
+    try:
+        return await bench.run()
+    finally:
+        if not args.keep_data:
+            await bench.cleanup()
+
+
+def start_uvicorn(args):
+    cmd = [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port),
+           "--workers", str(args.workers), "--log-level", "warning"]
+    process = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=os.environ.copy())
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/").status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start within 30 seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FutureOS API benchmark")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn", "url"), default="inprocess")
+    parser.add_argument("--url", help="Base URL of a running server (mode=url)")
+    parser.add_argument("--storage", choices=("mongo", "memory", "sqlite"), default="mongo",
+                        help="Local mongod from MONGO_URL or the embedded engine (STORAGE_BACKEND)")
+    parser.add_argument("--storage-path", default=os.path.join(tempfile.gettempdir(), "futureos_bench.db"),
+                        help="SQLite file used with --storage sqlite")
+    parser.add_argument("--db-name", default="futureos_bench", help="Database used for the run")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (mode=uvicorn)")
+    parser.add_argument("--depth", type=int, default=2, help="Folder nesting depth under /bench")
+    parser.add_argument("--fanout", type=int, default=4, help="Sub-folders per folder")
+    parser.add_argument("--files-per-dir", type=int, default=5)
+    parser.add_argument("--file-size", type=int, default=512, help="Characters per seeded file")
+    parser.add_argument("--notes", type=int, default=10, help="Notepad files used by autosave")
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD,
+                        help=f"Weighted operation mix (default: {DEFAULT_WORKLOAD})")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after N requests (0 = duration only)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20, help="Warm-up requests per worker")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep-data", action="store_true", help="Do not delete seeded data")
+    parser.add_argument("--keep-rate-limits", action="store_true",
+                        help="Keep the per-client rate limits instead of lifting them for the run")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    args = parser.parse_args()
+    if args.storage != "mongo" and args.workers > 1:
+        # The embedded engine keeps its data in each process: every worker would see its own dataset
+        parser.error(f"--storage {args.storage} supports a single worker")
+
+    if args.mode != "url":
+        os.environ["DB_NAME"] = args.db_name
+        os.environ["STORAGE_BACKEND"] = args.storage
+        if args.storage == "sqlite":
+            os.environ["STORAGE_PATH"] = args.storage_path
+        if not args.keep_rate_limits:
+            # All benchmark workers share one client address and would be throttled together
+            for name in ("TERMINAL_RATE_PER_SEC", "TERMINAL_RATE_BURST",
+                         "AUTOSAVE_RATE_PER_SEC", "AUTOSAVE_RATE_BURST"):
+                os.environ.setdefault(name, "1000000")
+
+    if args.mode == "inprocess":
+        results = asyncio.run(run_inprocess(args))
+    elif args.mode == "uvicorn":
+        process, base_url = start_uvicorn(args)
+        try:
+            results = asyncio.run(run_against_url(args, base_url))
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        if not args.url:
+            parser.error("--url is required with --mode url")
+        results = asyncio.run(run_against_url(args, args.url.rstrip("/")))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print_report(results, baseline)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Configurazione comune dei test: backend importabile e storage embedded in memoria"""
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("DB_NAME", "futureos_test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def filesystem():
+    """Filesystem vuoto con la sola radice e le cache locali svuotate"""
+    from database import filesystem_collection
+    from invalidation import clear_local_caches
+
+    await filesystem_collection.delete_many({})
+    clear_local_caches()
+    now = datetime.utcnow()
+    await filesystem_collection.insert_one({
+        "name": "/", "type": "folder", "path": "/", "parent_path": "",
+        "user_id": "default_user", "created_at": now, "modified_at": now, "version": 1,
+    })
+    yield filesystem_collection
+    await filesystem_collection.delete_many({})
+    clear_local_caches()
+
+
+def _node(path, type="file", content=""):
+    parent_path, _, name = path.rpartition("/")
+    now = datetime.utcnow()
+    return {
+        "name": name, "type": type, "path": path, "parent_path": parent_path or "/",
+        "user_id": "default_user", "content": content if type == "file" else None,
+        "size": len(content), "created_at": now, "modified_at": now,
+    }
+
+
+@pytest.fixture
+def make_node():
+    """Documento di un nodo del filesystem: make_node(path, type="file", content="")"""
+    return _node
+
+
+@pytest.fixture
+def create_nodes(filesystem):
+    """Crea con create_node le cartelle (path) e poi i file (path o coppie path, contenuto)"""
+    from filesystem_ops import create_node
+
+    async def create(folders=(), files=()):
+        for path in folders:
+            await create_node(_node(path, "folder"))
+        for entry in files:
+            path, content = (entry, "") if isinstance(entry, str) else entry
+            await create_node(_node(path, content=content))
+    return create
+
+
+@pytest.fixture
+async def home(filesystem, create_nodes):
+    """Filesystem con la home dell'utente, /home/user"""
+    await create_nodes(folders=("/home", "/home/user"))
+    return filesystem
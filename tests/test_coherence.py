@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+
+from coherence import LocalBus
+from invalidation import apply_invalidation
+from listing_cache import listing_cache
+from paths import path_cache
+from trash import trashed_roots
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_local_bus_delivers_to_the_other_buses_only():
+    hub = []
+    received = {"a": [], "b": [], "c": []}
+    buses = {name: LocalBus(hub) for name in received}
+    for name, bus in buses.items():
+        await bus.start(received[name].append)
+
+    buses["a"].publish({"kind": "trash", "user_id": "u"})
+    assert received["a"] == []
+    assert received["b"] == received["c"] == [{"kind": "trash", "user_id": "u"}]
+
+    await buses["c"].stop()
+    buses["b"].publish({"kind": "reset"})
+    assert received["a"] == [{"kind": "reset"}]
+    assert len(received["c"]) == 1
+
+
+async def test_local_bus_delivers_a_copy_of_the_event():
+    hub = []
+    sender, receiver = LocalBus(hub), LocalBus(hub)
+    events = []
+    await sender.start(lambda event: None)
+    await receiver.start(events.append)
+    event = {"kind": "trash", "user_id": "u"}
+    sender.publish(event)
+    events[0]["user_id"] = "changed"
+    assert event["user_id"] == "u"
+
+
+def test_filesystem_event_evicts_listing_path_and_generation():
+    listing_cache.put("u", "/docs", [])
+    listing_cache.put("u", "/docs/sub", [])
+    path_cache.put("s", "/docs/sub/a.txt", {"type": "file", "path": "/docs/sub/a.txt"})
+    generation = listing_cache.generation("u", "/docs")
+    path_generation = path_cache.generation
+
+    apply_invalidation({
+        "kind": "filesystem", "path": "/docs/sub", "subtree": True, "parent_path": "/docs", "user_id": "u",
+    })
+
+    assert listing_cache.get("u", "/docs") is None
+    assert listing_cache.get("u", "/docs/sub") is None
+    assert path_cache.get("s", "/docs/sub/a.txt") is None
+    assert listing_cache.generation("u", "/docs") != generation
+    assert path_cache.generation != path_generation
+
+
+def test_event_during_a_read_prevents_caching_it():
+    """Un altro worker sta leggendo /docs quando arriva l'invalidazione dal bus"""
+    generation = listing_cache.generation("u", "/docs")
+    path_generation = path_cache.generation
+    apply_invalidation({"kind": "filesystem", "path": "/docs/a.txt", "subtree": False,
+                        "parent_path": "/docs", "user_id": "u"})
+    listing_cache.put("u", "/docs", [], generation=generation)
+    path_cache.put("s", "/docs/a.txt", {"type": "file", "path": "/docs/a.txt"}, generation=path_generation)
+    assert listing_cache.get("u", "/docs") is None
+    assert path_cache.get("s", "/docs/a.txt") is None
+
+
+async def test_trash_event_invalidates_trashed_roots(filesystem):
+    assert await trashed_roots.get("default_user") == frozenset()
+    await filesystem.insert_one({"name": "x", "type": "folder", "path": "/x", "parent_path": "/",
+                                 "user_id": "default_user", "trashed_at": datetime.utcnow()})
+    assert await trashed_roots.get("default_user") == frozenset()
+    apply_invalidation({"kind": "trash", "user_id": "default_user"})
+    assert await trashed_roots.get("default_user") == frozenset({"/x"})
+
+
+@pytest.mark.parametrize("event", [{"kind": "reset"}, {"kind": "from-a-newer-version"}])
+def test_reset_and_unknown_events_clear_everything(event):
+    listing_cache.put("u", "/docs", [])
+    path_cache.put("s", "/docs", {"type": "folder", "path": "/docs"})
+    generation = listing_cache.generation("u", "/elsewhere")
+    apply_invalidation(event)
+    assert listing_cache.get("u", "/docs") is None
+    assert path_cache.get("s", "/docs") is None
+    assert listing_cache.generation("u", "/elsewhere") != generation
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from compression import CompressionMiddleware
+from routes import filesystem as filesystem_routes
+
+pytestmark = pytest.mark.anyio
+
+
+def _app():
+    app = FastAPI()
+    app.include_router(filesystem_routes.router)
+    app.add_middleware(CompressionMiddleware, minimum_size=256)
+    return app
+
+
+@pytest.fixture
+async def client(filesystem):
+    now = datetime.utcnow()
+    await filesystem.insert_many([
+        {
+            "name": f"file-{index}.txt", "type": "file", "path": f"/file-{index}.txt",
+            "parent_path": "/", "user_id": "default_user", "content": "x", "size": 1,
+            "created_at": now, "modified_at": now, "version": 1,
+        }
+        for index in range(10)
+    ])
+    transport = httpx.ASGITransport(app=_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def test_revalidating_a_compressed_response_keeps_its_etag(client):
+    headers = {"Accept-Encoding": "gzip"}
+    response = await client.get("/filesystem/", params={"path": "/"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    etag = response.headers["etag"]
+    assert etag.endswith('-gzip"')
+
+    revalidated = await client.get(
+        "/filesystem/", params={"path": "/"}, headers={**headers, "If-None-Match": etag}
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+
+
+async def test_revalidating_an_uncompressed_response_keeps_the_bare_etag(client):
+    response = await client.get(
+        "/filesystem/", params={"path": "/"}, headers={"Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+    etag = response.headers["etag"]
+
+    revalidated = await client.get(
+        "/filesystem/", params={"path": "/"},
+        headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
@@ -0,0 +1,133 @@
+import json
+import threading
+from datetime import datetime
+
+import pytest
+from bson import Binary
+from starlette.responses import Response
+
+import content_codec as content_codec_module
+import maintenance as maintenance_module
+from content_codec import CODEC_FIELD, decoded, encode_content
+from content_store import CONTENT_STORE_MIN_BYTES, REF_FIELD, ContentStore
+from maintenance import compress_existing_contents
+from models import FileSystemItemCreate, FileSystemItemUpdate
+from routes.filesystem import create_filesystem_item, get_filesystem_items, update_filesystem_item
+
+pytestmark = pytest.mark.anyio
+
+MIN_BYTES = 64
+
+
+class _Request:
+    headers = {}
+
+
+@pytest.fixture(autouse=True)
+def small_threshold(monkeypatch):
+    monkeypatch.setattr(content_codec_module, "CONTENT_COMPRESSION_MIN_BYTES", MIN_BYTES)
+    monkeypatch.setattr(content_codec_module, "CONTENT_CODEC", "zlib")
+
+
+@pytest.mark.parametrize("content, compressed", [
+    ("a" * (MIN_BYTES - 1), False),
+    ("a" * MIN_BYTES, True),
+    # La soglia è in byte UTF-8, non in caratteri
+    ("é" * (MIN_BYTES // 2 - 1), False),
+    ("é" * (MIN_BYTES // 2), True),
+    ("", False),
+    (None, False),
+])
+async def test_threshold_boundary_and_roundtrip(content, compressed):
+    fields = await encode_content(content)
+    assert (fields[CODEC_FIELD] == "zlib") is compressed
+    assert isinstance(fields["content"], Binary) is compressed
+    assert decoded(fields)["content"] == content
+    assert CODEC_FIELD not in decoded(fields)
+
+
+async def test_incompressible_content_stays_plain(monkeypatch):
+    monkeypatch.setattr(content_codec_module, "_MIN_SAVING_RATIO", 0.0)
+    assert await encode_content("a" * MIN_BYTES) == {"content": "a" * MIN_BYTES, CODEC_FIELD: None}
+
+
+async def test_codec_none_disables_compression(monkeypatch):
+    monkeypatch.setattr(content_codec_module, "CONTENT_CODEC", "none")
+    assert (await encode_content("a" * MIN_BYTES * 4))[CODEC_FIELD] is None
+
+
+def test_legacy_documents_are_returned_unchanged():
+    legacy = {"name": "a.txt", "content": "a" * MIN_BYTES * 4, "size": MIN_BYTES * 4}
+    assert decoded(legacy) is legacy
+
+    plain = {"name": "a.txt", "content": "abc", CODEC_FIELD: None}
+    assert decoded(plain) == {"name": "a.txt", "content": "abc"}
+
+
+async def test_decoding_does_not_modify_the_stored_document():
+    stored = {"name": "a.txt", **await encode_content("b" * MIN_BYTES * 2)}
+    compressed = stored["content"]
+    assert decoded(stored)["content"] == "b" * MIN_BYTES * 2
+    assert stored["content"] is compressed
+    assert stored[CODEC_FIELD] == "zlib"
+
+
+async def test_size_is_the_logical_length_of_the_content(filesystem):
+    content = "é" * MIN_BYTES
+    await create_filesystem_item(
+        FileSystemItemCreate(name="a.txt", type="file", path="/a.txt", parent_path="/", content=content),
+        Response()
+    )
+    stored = await filesystem.find_one({"path": "/a.txt"})
+    assert stored[CODEC_FIELD] == "zlib"
+    assert stored["size"] == MIN_BYTES
+
+    [item] = json.loads((await get_filesystem_items(_Request(), path="/", fields=None)).body)
+    assert (item["content"], item["size"]) == (content, MIN_BYTES)
+    assert CODEC_FIELD not in item
+
+    updated = await update_filesystem_item(
+        "/a.txt", FileSystemItemUpdate(content="x" * (MIN_BYTES + 1)), _Request(), Response()
+    )
+    assert (updated.content, updated.size) == ("x" * (MIN_BYTES + 1), MIN_BYTES + 1)
+    assert (await filesystem.find_one({"path": "/a.txt"}))["size"] == MIN_BYTES + 1
+
+
+async def test_migration_compresses_legacy_documents_only(filesystem, monkeypatch):
+    monkeypatch.setattr(maintenance_module, "CONTENT_COMPRESSION_MIN_BYTES", MIN_BYTES)
+    now = datetime.utcnow()
+    legacy = {
+        "name": "old.txt", "type": "file", "path": "/old.txt", "parent_path": "/",
+        "user_id": "default_user", "content": "c" * MIN_BYTES, "size": MIN_BYTES,
+        "created_at": now, "modified_at": now,
+    }
+    await filesystem.insert_many([
+        legacy, {**legacy, "name": "new.txt", "path": "/new.txt", CODEC_FIELD: None}
+    ])
+
+    assert await compress_existing_contents() == 1
+    migrated = await filesystem.find_one({"path": "/old.txt"})
+    assert migrated[CODEC_FIELD] == "zlib"
+    assert migrated["size"] == MIN_BYTES
+    assert decoded(migrated)["content"] == "c" * MIN_BYTES
+    assert (await filesystem.find_one({"path": "/new.txt"}))["content"] == "c" * MIN_BYTES
+    assert await compress_existing_contents() == 0
+
+
+async def test_store_writes_run_in_the_buffer_pool(tmp_path, monkeypatch):
+    store = ContentStore(tmp_path)
+    monkeypatch.setattr(content_codec_module, "content_store", store)
+    threads = []
+    put = store.put
+    monkeypatch.setattr(store, "put", lambda data: threads.append(threading.current_thread()) or put(data))
+
+    content = "d" * CONTENT_STORE_MIN_BYTES
+    fields = await encode_content(content)
+    assert fields["content"] is None and fields[CODEC_FIELD] is None
+    assert threads and threads[0] is not threading.main_thread()
+    assert decoded(fields)["content"] == content
+
+    # Sotto la soglia dell'archivio il contenuto resta nel documento e il riferimento viene azzerato
+    assert await encode_content("small") == {"content": "small", CODEC_FIELD: None, REF_FIELD: None}
+    assert len(threads) == 1
+    store.close()
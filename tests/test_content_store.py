@@ -0,0 +1,73 @@
+import pytest
+
+import content_store as content_store_module
+from content_store import CLOSED_SUFFIX, ContentStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(content_store_module, "SEGMENT_IDLE_SECONDS", 0)
+    return ContentStore(tmp_path, segment_max_bytes=8)
+
+
+def test_roundtrip_and_roll_closes_the_previous_segment(store):
+    first = store.put(b"abcdef")
+    second = store.put(b"ghijkl")
+    assert first["segment"] != second["segment"]
+    assert store.read_text(first) == "abcdef"
+    assert bytes(store.view(second)) == b"ghijkl"
+    assert store.is_closed(first["segment"])
+    assert not store.is_closed(second["segment"])
+
+
+def test_candidates_skip_segments_still_written_by_another_process(store, tmp_path):
+    other = ContentStore(tmp_path, segment_max_bytes=8)
+    other_ref = other.put(b"xx")
+    ref = store.put(b"abcdef")
+    store.put(b"ghijkl")
+
+    # Nessun dato vivo: sarebbero tutti da compattare, ma solo il segmento chiuso è candidato
+    assert store.compaction_candidates({}) == [ref["segment"]]
+
+    other.close()
+    assert (tmp_path / f"{other_ref['segment']}{CLOSED_SUFFIX}").exists()
+    assert set(store.compaction_candidates({})) == {ref["segment"], other_ref["segment"]}
+
+
+def test_candidates_include_segments_of_dead_processes(store, tmp_path, monkeypatch):
+    (tmp_path / "4194999-abcdef-000001.seg").write_bytes(b"orphan")
+    monkeypatch.setattr(content_store_module, "_process_alive", lambda pid: pid != 4194999)
+    assert store.compaction_candidates({}) == ["4194999-abcdef-000001"]
+    assert store.compaction_candidates({"4194999-abcdef-000001": 6}) == []
+
+
+def test_copy_records_and_retire_release_the_mapping(store):
+    old = store.put(b"abcdef")
+    store.put(b"ghijkl")
+    assert bytes(store.view(old)) == b"abcdef"
+    assert old["segment"] in store._maps
+
+    [new] = store.copy_records([old])
+    assert new["segment"] != old["segment"]
+    assert bytes(store.view(new)) == b"abcdef"
+
+    held = store.view(old)
+    store.retire(old["segment"])
+    assert old["segment"] not in store._maps
+    assert store.delete_retired() == 1
+    assert not store._path(old["segment"]).exists()
+    assert not store._path(old["segment"], CLOSED_SUFFIX).exists()
+    # Le slice già restituite restano leggibili
+    assert bytes(held) == b"abcdef"
+
+
+def test_mappings_are_bounded_and_released_when_missing(tmp_path):
+    store = ContentStore(tmp_path, segment_max_bytes=4, max_maps=2)
+    refs = [store.put(bytes([65 + index]) * 4) for index in range(4)]
+    for ref in refs:
+        store.view(ref)
+    assert list(store._maps) == [refs[2]["segment"], refs[3]["segment"]]
+
+    store._path(refs[2]["segment"]).unlink()
+    assert store.release_missing() == 1
+    assert list(store._maps) == [refs[3]["segment"]]
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+from diagnostics import SlowQueryListener, SlowQueryRecorder, _plan_stages, extract_filter, query_shape
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("query_filter, expected", [
+    ({"path": "/docs", "user_id": "u"}, {"path": "str", "user_id": "str"}),
+    ({"_id": ObjectId()}, {"_id": "ObjectId"}),
+    ({"size": {"$gt": 10}}, {"size": {"$gt": "int"}}),
+    # Le liste hanno la stessa forma a prescindere dalla lunghezza
+    ({"path": {"$in": ["/a", "/b", "/c"]}}, {"path": {"$in": ["str"]}}),
+    ({"path": {"$in": ["/a", 1]}}, {"path": {"$in": ["str", "int"]}}),
+    ([{"$match": {"user_id": "u"}}, {"$limit": 5}], [{"$match": {"user_id": "str"}}, {"$limit": "int"}]),
+])
+def test_query_shape(query_filter, expected):
+    assert query_shape(query_filter) == expected
+
+
+def test_same_shape_is_grouped():
+    recorder = SlowQueryRecorder(10)
+    for path, duration in (("/a", 12.0), ("/b/c", 30.0)):
+        recorder.record("db", "filesystem", "find", {"find": "filesystem", "filter": {"path": path}}, duration)
+    recorder.record("db", "filesystem", "find", {"find": "filesystem", "filter": {"size": 1}}, 11.0)
+
+    [slowest, other] = recorder.report()
+    assert (slowest["count"], slowest["max_ms"], slowest["avg_ms"]) == (2, 30.0, 21.0)
+    # Il campione è quello più lento
+    assert slowest["sample_filter"] == {"path": "/b/c"}
+    assert other["shape"] == {"size": "int"}
+
+
+def test_first_statement_defines_write_shapes():
+    command = {"update": "filesystem", "updates": [{"q": {"path": "/a"}}, {"q": {"size": 1}}]}
+    assert extract_filter("update", command) == {"path": "/a"}
+    assert extract_filter("delete", {"delete": "filesystem", "deletes": []}) == {}
+
+
+def _event(request_id, command_name="find", duration_ms=0.0, **command):
+    return SimpleNamespace(
+        command_name=command_name, command={command_name: "filesystem", **command},
+        database_name="db", connection_id=("localhost", 27017), request_id=request_id,
+        duration_micros=int(duration_ms * 1000),
+    )
+
+
+def test_listener_records_only_commands_over_the_threshold():
+    recorder = SlowQueryRecorder(50)
+    listener = SlowQueryListener(recorder)
+    for request_id, duration in ((1, 49.9), (2, 50.0), (3, 120.0)):
+        event = _event(request_id, duration_ms=duration, filter={"path": "/a"})
+        listener.started(event)
+        listener.succeeded(event)
+    failed = _event(4, duration_ms=80.0, filter={"size": 1})
+    listener.started(failed)
+    listener.failed(failed)
+    # Gli explain della diagnostica non vengono registrati
+    explain = _event(5, command_name="explain", duration_ms=500.0)
+    listener.started(explain)
+    listener.succeeded(explain)
+
+    assert [(entry["shape"], entry["count"]) for entry in recorder.report()] == [
+        ({"path": "str"}, 2), ({"size": "int"}, 1)
+    ]
+
+
+def test_plan_stages_detect_collscan_in_the_winning_plan_only():
+    indexed = {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "path_1"}},
+        "rejectedPlans": [{"stage": "COLLSCAN"}],
+    }
+    assert _plan_stages(indexed, []) == ["FETCH", "IXSCAN"]
+    sharded = {"winningPlan": {"stage": "SHARD_MERGE", "shards": [{"winningPlan": {"stage": "COLLSCAN"}}]}}
+    assert "COLLSCAN" in _plan_stages(sharded, [])
+
+
+class _Client:
+    def __init__(self, plan):
+        self.plan = plan
+        self.commands = []
+
+    def __getitem__(self, name):
+        return self
+
+    async def command(self, command):
+        self.commands.append(command)
+        return {"queryPlanner": {"winningPlan": self.plan}}
+
+
+async def test_explain_uses_the_first_write_statement():
+    recorder = SlowQueryRecorder(10)
+    updates = [{"q": {"path": "/a"}, "u": {"$set": {"size": 1}}}, {"q": {"path": "/b"}, "u": {}}]
+    recorder.record("db", "filesystem", "update", {"update": "filesystem", "updates": updates}, 20.0)
+    recorder.record("db", "filesystem", "delete",
+                    {"delete": "filesystem", "deletes": [{"q": {"size": 0}}, {"q": {"size": 1}}]}, 15.0)
+    client = _Client({"stage": "UPDATE", "inputStage": {"stage": "COLLSCAN"}})
+
+    await recorder.capture_explain_plans(client)
+    [update, delete] = [command["explain"] for command in client.commands]
+    assert update["updates"] == updates[:1]
+    assert delete["deletes"] == [{"q": {"size": 0}}]
+
+    [entry, _] = recorder.report()
+    assert entry["plan"] == ["UPDATE", "COLLSCAN"]
+    assert entry["collscan"] is True
+    assert entry["explained_at"] is not None
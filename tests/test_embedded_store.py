@@ -0,0 +1,274 @@
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+import embedded_store
+from database import requested_workers
+from embedded_store import EmbeddedClient, SqliteJournal, _regex_prefix, apply_update, matches
+
+pytestmark = pytest.mark.anyio
+
+DOCUMENT = {
+    "_id": 1, "name": "a.txt", "path": "/docs/a.txt", "size": 12, "tags": ["x", "y"],
+    "meta": {"owner": "u"}, "trashed_at": None,
+}
+
+
+@pytest.fixture
+def client():
+    return EmbeddedClient()
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({"name": "a.txt"}, True),
+    ({"meta.owner": "u"}, True),
+    ({"tags": "y"}, True),
+    ({"size": {"$gte": 12, "$lt": 13}}, True),
+    ({"size": {"$gt": 12}}, False),
+    ({"name": {"$in": ["b.txt", re.compile(r"^a\.")]}}, True),
+    ({"name": {"$nin": ["a.txt"]}}, False),
+    ({"trashed_at": None}, True),
+    ({"missing": None}, True),
+    ({"missing": {"$exists": True}}, False),
+    ({"trashed_at": {"$exists": True}}, True),
+    ({"path": {"$regex": "^/docs/"}}, True),
+    ({"path": {"$regex": "^/DOCS/", "$options": "i"}}, True),
+    ({"name": {"$not": {"$regex": "txt$"}}}, False),
+    ({"size": {"$type": "int"}}, True),
+    ({"tags": {"$size": 2}}, True),
+    ({"$or": [{"size": 1}, {"name": "a.txt"}]}, True),
+    ({"$and": [{"size": 12}, {"name": "b.txt"}]}, False),
+    ({"$nor": [{"size": 1}]}, True),
+    ({"$expr": {"$gt": ["$size", 10]}}, True),
+])
+def test_matches(query, expected):
+    assert matches(DOCUMENT, query) is expected
+
+
+def test_unsupported_operators_fail_loudly():
+    with pytest.raises(OperationFailure):
+        matches(DOCUMENT, {"size": {"$mod": [2, 0]}})
+    with pytest.raises(OperationFailure):
+        apply_update(DOCUMENT, {"$pull": {"tags": "x"}})
+
+
+def test_update_operators():
+    updated = apply_update(DOCUMENT, {
+        "$set": {"meta.owner": "v"},
+        "$unset": {"trashed_at": ""},
+        "$inc": {"size": 3, "version": 1},
+        "$max": {"peak": 5},
+        "$push": {"tags": "z"},
+        "$setOnInsert": {"created": True},
+    })
+    assert updated["meta"] == {"owner": "v"}
+    assert "trashed_at" not in updated
+    assert (updated["size"], updated["version"], updated["peak"]) == (15, 1, 5)
+    assert updated["tags"] == ["x", "y", "z"]
+    assert "created" not in updated
+    # L'originale non viene modificato
+    assert DOCUMENT["meta"] == {"owner": "u"} and DOCUMENT["size"] == 12
+    assert apply_update({}, {"$setOnInsert": {"created": True}}, is_insert=True) == {"created": True}
+
+
+def test_pipeline_update():
+    updated = apply_update(DOCUMENT, [
+        {"$set": {"path": {"$concat": ["/old", "$path"]}}},
+        {"$unset": "tags"},
+    ])
+    assert updated["path"] == "/old/docs/a.txt"
+    assert "tags" not in updated
+
+
+def test_update_cannot_change_the_id():
+    with pytest.raises(OperationFailure):
+        apply_update(DOCUMENT, {"$set": {"_id": 2}})
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    ("^/docs/", "/docs/"),
+    (re.compile("^/docs/a\\.txt$"), "/docs/a.txt"),
+    ("^/docs/a?", "/docs/"),
+    ("^/docs(/|$)", "/docs"),
+    ("^/a[|]b", "/a"),
+    ("^/a\\|b", "/a|b"),
+    ("/docs/", None),
+    ("^abc|xyz", None),
+    ("^(a)|xyz", None),
+    ("^[]]|xyz", None),
+    ({"$regex": "^/docs", "$options": "i"}, None),
+])
+def test_regex_prefix(pattern, expected):
+    assert _regex_prefix(pattern) == expected
+
+
+async def test_alternation_is_not_a_prefix_scan(client):
+    collection = client["test"].nodes
+    await collection.insert_many([{"path": "/abc/1"}, {"path": "/xyz/2"}, {"path": "/other"}])
+    query = {"path": {"$regex": "^/abc|/xyz"}}
+    unindexed = await collection.find(query, {"_id": 0}).to_list(None)
+    await collection.create_index("path")
+    assert await collection.find(query, {"_id": 0}).to_list(None) == unindexed == [
+        {"path": "/abc/1"}, {"path": "/xyz/2"}
+    ]
+
+
+async def test_lookup_with_and_without_index(client):
+    db = client["test"]
+    await db.parents.insert_many([{"_id": "p1"}, {"_id": "p2"}])
+    await db.children.insert_many([
+        {"parent": "p1", "n": 1}, {"parent": "p1", "n": 2}, {"parent": "p3", "n": 3}
+    ])
+    pipeline = [
+        {"$lookup": {"from": "children", "localField": "_id", "foreignField": "parent", "as": "kids"}},
+        {"$project": {"count": {"$size": "$kids"}}},
+    ]
+    without_index = await db.parents.aggregate(pipeline).to_list(None)
+    await db.children.create_index("parent")
+    with_index = await db.parents.aggregate(pipeline).to_list(None)
+    assert without_index == with_index == [{"_id": "p1", "count": 2}, {"_id": "p2", "count": 0}]
+
+
+async def test_lookup_with_let_and_pipeline(client):
+    db = client["test"]
+    await db.nodes.create_index([("path", 1), ("user_id", 1)])
+    await db.nodes.insert_many([
+        {"path": "/a", "user_id": "u1", "parent_path": "/"},
+        {"path": "/a/b", "user_id": "u1", "parent_path": "/a"},
+        {"path": "/a/b", "user_id": "u2", "parent_path": "/a"},
+    ])
+    pipeline = [
+        {"$match": {"parent_path": "/a"}},
+        {"$lookup": {
+            "from": "nodes",
+            "let": {"parent_path": "$parent_path", "user_id": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$path", "$$parent_path"]}, {"$eq": ["$$user_id", "$user_id"]}
+                ]}}},
+                {"$project": {"_id": 0, "path": 1}},
+            ],
+            "as": "parent",
+        }},
+        {"$project": {"_id": 0, "user_id": 1, "parent": 1}},
+    ]
+    assert await db.nodes.aggregate(pipeline).to_list(None) == [
+        {"user_id": "u1", "parent": [{"path": "/a"}]}, {"user_id": "u2", "parent": []}
+    ]
+
+    unsupported = {"$lookup": {"from": "nodes", "pipeline": [{"$match": {"path": "/a"}}], "as": "parent"}}
+    with pytest.raises(OperationFailure):
+        await db.nodes.aggregate([unsupported]).to_list(None)
+
+
+async def test_unique_index(client):
+    collection = client["test"]["items"]
+    await collection.insert_one({"path": "/a", "user_id": "u"})
+    await collection.create_index([("path", 1), ("user_id", 1)], unique=True)
+    await collection.insert_one({"path": "/a", "user_id": "v"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_one({"path": "/a", "user_id": "u"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.update_one({"user_id": "v"}, {"$set": {"user_id": "u"}})
+    # Il valore liberato da una cancellazione torna disponibile
+    await collection.delete_one({"user_id": "u"})
+    await collection.update_one({"user_id": "v"}, {"$set": {"user_id": "u"}})
+    assert await collection.count_documents({"path": "/a"}) == 1
+
+
+async def test_unique_index_creation_rejects_existing_duplicates(client):
+    collection = client["test"]["items"]
+    await collection.insert_many([{"name": "a"}, {"name": "a"}])
+    with pytest.raises(DuplicateKeyError):
+        await collection.create_index("name", unique=True)
+
+
+async def test_ttl_index_expires_old_documents(client, monkeypatch):
+    monkeypatch.setattr(embedded_store, "TTL_SWEEP_SECONDS", 0)
+    collection = client["test"]["jobs"]
+    await collection.create_index("finished_at", expireAfterSeconds=60)
+    now = datetime.utcnow()
+    await collection.insert_many([
+        {"_id": "old", "finished_at": now - timedelta(seconds=120)},
+        {"_id": "new", "finished_at": now},
+        {"_id": "running", "finished_at": None},
+    ])
+    # La scadenza viene applicata alla scrittura successiva
+    await collection.insert_one({"_id": "other"})
+    assert sorted(await collection.distinct("_id")) == ["new", "other", "running"]
+
+
+async def test_sqlite_journal_persists_writes(tmp_path):
+    path = str(tmp_path / "store.db")
+    client = EmbeddedClient(path)
+    collection = client["test"]["items"]
+    document_id = ObjectId()
+    await collection.insert_many([{"_id": document_id, "n": 1}, {"_id": "gone", "n": 2}])
+    await collection.update_one({"_id": document_id}, {"$inc": {"n": 1}})
+    await collection.delete_one({"_id": "gone"})
+    client.close()
+
+    reopened = EmbeddedClient(path)
+    assert await reopened["test"]["items"].find({}).to_list(None) == [{"_id": document_id, "n": 2}]
+    assert await reopened["other"]["items"].count_documents({}) == 0
+    reopened.close()
+
+
+async def test_sqlite_journal_writes_each_operation_in_one_transaction(tmp_path, monkeypatch):
+    path = str(tmp_path / "store.db")
+    client = EmbeddedClient(path)
+    collection = client["test"]["items"]
+    await collection.insert_many([{"_id": index, "n": 0} for index in range(3)])
+    writes = []
+    journal_write = SqliteJournal._write
+    monkeypatch.setattr(
+        SqliteJournal, "_write",
+        lambda self, namespace, changes: writes.append(len(changes)) or journal_write(self, namespace, changes)
+    )
+
+    await collection.update_many({}, {"$inc": {"n": 1}})
+    await collection.delete_many({"_id": {"$in": [0, 1]}})
+    await collection.find({}).to_list(None)
+    assert writes == [3, 2]
+
+    # Una scrittura fallita a metà registra comunque quelle già applicate in memoria
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_many([{"_id": "new"}, {"_id": 2}])
+    assert writes == [3, 2, 1]
+    client.close()
+
+    reopened = EmbeddedClient(path)
+    assert await reopened["test"]["items"].find({}).sort("_id", 1).to_list(None) == [
+        {"_id": 2, "n": 1}, {"_id": "new"}
+    ]
+    reopened.close()
+
+
+def test_sqlite_journal_is_used_by_a_single_process(tmp_path):
+    path = str(tmp_path / "store.db")
+    client = EmbeddedClient(path)
+    with pytest.raises(RuntimeError):
+        SqliteJournal(path)
+    client.close()
+    EmbeddedClient(path).close()
+
+
+@pytest.mark.parametrize("argv, environ, expected", [
+    (["uvicorn", "server:app"], {}, 1),
+    (["uvicorn", "server:app", "--workers", "4"], {}, 4),
+    (["uvicorn", "server:app", "--workers=2"], {}, 2),
+    (["gunicorn", "-w", "3", "server:app"], {}, 3),
+    (["uvicorn", "server:app"], {"WEB_CONCURRENCY": "2"}, 2),
+    (["tool", "-w", "file.txt"], {}, 1),
+])
+def test_requested_workers(argv, environ, expected):
+    assert requested_workers(argv, environ) == expected
+
+
+async def test_sessions_are_reported_as_unsupported(client):
+    with pytest.raises(OperationFailure) as excinfo:
+        await client.start_session()
+    assert excinfo.value.code == 20
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+from starlette.responses import Response
+
+from listing_cache import get_listing, listing_cache
+from routes.filesystem import get_filesystem_item, get_filesystem_items
+
+pytestmark = pytest.mark.anyio
+
+
+class _Request:
+    def __init__(self, if_none_match=None):
+        self.headers = {} if if_none_match is None else {"if-none-match": if_none_match}
+
+
+@pytest.fixture
+async def docs(filesystem, create_nodes):
+    await create_nodes(folders=["/docs"], files=[("/docs/a.txt", "alpha" * 100), ("/docs/b.txt", "beta")])
+    return filesystem
+
+
+async def _listing(fields=None, if_none_match=None):
+    return await get_filesystem_items(_Request(if_none_match), path="/docs", fields=fields)
+
+
+@pytest.mark.parametrize("fields", ["name,secret", "contents"])
+async def test_unknown_fields_are_rejected(docs, fields):
+    with pytest.raises(HTTPException) as error:
+        await _listing(fields)
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        await get_filesystem_item("/docs/a.txt", _Request(), Response(), fields=fields)
+    assert error.value.status_code == 400
+
+
+async def test_listing_returns_only_the_requested_fields_plus_paths(docs):
+    response = await _listing("name, size")
+    items = sorted(json.loads(response.body), key=lambda item: item["name"])
+    assert items == [
+        {"name": "a.txt", "size": 500, "path": "/docs/a.txt", "parent_path": "/docs"},
+        {"name": "b.txt", "size": 4, "path": "/docs/b.txt", "parent_path": "/docs"},
+    ]
+
+
+async def test_item_returns_only_the_requested_fields_plus_paths(docs):
+    response = await get_filesystem_item("/docs/a.txt", _Request(), Response(), fields="type")
+    assert json.loads(response.body) == {"type": "file", "path": "/docs/a.txt", "parent_path": "/docs"}
+
+
+async def test_field_set_etag_is_the_same_on_cache_hit_and_miss(docs):
+    miss = await _listing("name")
+    assert listing_cache.get("default_user", "/docs") is None
+    await get_listing("/docs")
+    hit = await _listing("name")
+    assert hit.headers["etag"] == miss.headers["etag"]
+    assert json.loads(hit.body) == json.loads(miss.body)
+
+    # Ogni insieme di campi ha il proprio ETag, indipendente dall'ordine
+    full = await _listing()
+    reordered = await _listing("path,name")
+    assert full.headers["etag"] != hit.headers["etag"]
+    assert reordered.headers["etag"] == hit.headers["etag"]
+    other = await _listing("name,size")
+    assert other.headers["etag"] != hit.headers["etag"]
+
+
+async def test_field_set_etag_revalidates(docs):
+    etag = (await _listing("name")).headers["etag"]
+    assert (await _listing("name", if_none_match=etag)).status_code == 304
+    assert (await _listing("name,size", if_none_match=etag)).status_code == 200
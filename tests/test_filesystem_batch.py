@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from database import user_settings_collection
+from filesystem_ops import trash_node
+from listing_cache import get_listing, listing_cache
+from models import FileSystemBatchRequest
+from routes import filesystem as filesystem_routes
+from routes.filesystem import get_filesystem_batch
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def docs(filesystem, create_nodes):
+    await create_nodes(
+        folders=["/docs"], files=[("/docs/a.txt", "alpha"), ("/docs/b.txt", "beta"), ("/docs/old.txt", "old")]
+    )
+    await trash_node("/docs/old.txt")
+    return filesystem
+
+
+async def _batch(**kwargs):
+    response = await get_filesystem_batch(FileSystemBatchRequest(**kwargs))
+    return json.loads(response.body)
+
+
+async def test_missing_and_trashed_paths_map_to_none(docs):
+    result = await _batch(paths=["/docs/a.txt", "/docs//missing.txt", "/docs/old.txt"])
+    assert result["items"]["/docs/a.txt"]["content"] == "alpha"
+    assert result["items"]["/docs/missing.txt"] is None
+    assert result["items"]["/docs/old.txt"] is None
+    assert result["listings"] == {}
+    assert "settings" not in result
+
+
+@pytest.mark.parametrize("cached", [False, True])
+async def test_listings_are_projected_on_the_requested_fields(docs, cached):
+    if cached:
+        await get_listing("/docs")
+    result = await _batch(paths=["/docs/a.txt"], parent_paths=["/docs", "/empty"], fields=["name"])
+    listing = sorted(result["listings"]["/docs"], key=lambda item: item["name"])
+    # path e parent_path sono sempre inclusi, content no
+    assert listing == [
+        {"name": "a.txt", "path": "/docs/a.txt", "parent_path": "/docs"},
+        {"name": "b.txt", "path": "/docs/b.txt", "parent_path": "/docs"},
+    ]
+    assert result["listings"]["/empty"] == []
+    assert result["items"]["/docs/a.txt"] == {"name": "a.txt", "path": "/docs/a.txt", "parent_path": "/docs"}
+
+
+async def test_only_complete_listings_fill_the_cache(docs):
+    await _batch(parent_paths=["/docs"], fields=["name"])
+    assert listing_cache.get("default_user", "/docs") is None
+
+    result = await _batch(parent_paths=["/docs"])
+    assert {item["name"] for item in result["listings"]["/docs"]} == {"a.txt", "b.txt"}
+    assert len(listing_cache.get("default_user", "/docs").items) == 2
+
+
+async def test_listing_of_a_trashed_folder_is_empty(docs):
+    await trash_node("/docs")
+    result = await _batch(parent_paths=["/docs"])
+    assert result["listings"]["/docs"] == []
+
+
+async def test_include_settings(docs):
+    await user_settings_collection.delete_many({})
+    result = await _batch(include_settings=True)
+    assert result["settings"] is None
+
+    await user_settings_collection.insert_one({
+        "user_id": "default_user", "wallpaper": "nebula", "theme": "light",
+    })
+    try:
+        result = await _batch(include_settings=True)
+    finally:
+        await user_settings_collection.delete_many({})
+    assert result["settings"]["wallpaper"] == "nebula"
+    assert result["settings"]["theme"] == "light"
+    assert result["settings"]["id"]
+
+
+async def test_unknown_fields_and_too_many_paths_are_rejected(docs, monkeypatch):
+    with pytest.raises(HTTPException) as error:
+        await _batch(paths=["/docs/a.txt"], fields=["name", "secret"])
+    assert error.value.status_code == 400
+
+    monkeypatch.setattr(filesystem_routes, "MAX_BATCH_PATHS", 2)
+    with pytest.raises(HTTPException) as error:
+        await _batch(paths=["/a", "/b"], parent_paths=["/"])
+    assert error.value.status_code == 400
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pytest
+from starlette.responses import Response
+
+from routes import filesystem as filesystem_routes
+from routes.filesystem import TREE_TRUNCATED_HEADER, get_filesystem_tree
+from trash import TRASHED_FIELD
+
+pytestmark = pytest.mark.anyio
+
+
+class _Request:
+    headers = {}
+
+
+@pytest.fixture(autouse=True)
+def inline_tree(monkeypatch):
+    monkeypatch.setattr(filesystem_routes, "TREE_OFFLOAD_MIN_ITEMS", 10 ** 9)
+
+
+async def _insert_files(collection, count, folder="/docs", **extra):
+    now = datetime.utcnow()
+    await collection.insert_one({
+        "name": folder.rsplit("/", 1)[1], "type": "folder", "path": folder, "parent_path": "/",
+        "user_id": "default_user", "created_at": now, "modified_at": now, "version": 1, **extra,
+    })
+    await collection.insert_many([
+        {
+            "name": f"f{index:04d}.txt", "type": "file", "path": f"{folder}/f{index:04d}.txt",
+            "parent_path": folder, "user_id": "default_user", "content": "", "size": 0,
+            "created_at": now, "modified_at": now, "version": 1,
+        }
+        for index in range(count)
+    ])
+
+
+async def test_tree_returns_every_node(filesystem):
+    await _insert_files(filesystem, 1100)
+    await _insert_files(filesystem, 50, folder="/old", **{TRASHED_FIELD: datetime.utcnow()})
+    response = Response()
+    tree = await get_filesystem_tree(_Request(), response)
+    assert len(tree["children"]["docs"]["children"]) == 1100
+    assert "old" not in tree["children"]
+    assert TREE_TRUNCATED_HEADER not in response.headers
+
+
+async def test_tree_reports_truncation(filesystem, monkeypatch):
+    monkeypatch.setattr(filesystem_routes, "TREE_MAX_ITEMS", 11)
+    await _insert_files(filesystem, 20)
+    response = Response()
+    tree = await get_filesystem_tree(_Request(), response)
+    # La radice, la cartella e i primi nove file in ordine di path
+    assert sorted(tree["children"]["docs"]["children"]) == [f"f{index:04d}.txt" for index in range(9)]
+    assert response.headers[TREE_TRUNCATED_HEADER] == "true"
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from filesystem_ops import trash_node
+from http_cache import collection_etag
+
+pytestmark = pytest.mark.anyio
+
+QUERY = {"user_id": "default_user"}
+
+
+@pytest.fixture
+async def files(filesystem):
+    start = datetime(2026, 1, 1)
+    await filesystem.insert_many([
+        {
+            "name": f"{index}.txt", "type": "file", "path": f"/{index}.txt", "parent_path": "/",
+            "user_id": "default_user", "content": "x", "size": 1,
+            "created_at": start, "modified_at": start + timedelta(minutes=index), "version": 1,
+        }
+        for index in range(5)
+    ])
+    return filesystem
+
+
+async def test_etag_follows_every_kind_of_write(files):
+    etags = [await collection_etag(files, QUERY)]
+    assert await collection_etag(files, QUERY) == etags[0]
+
+    await files.insert_one({"name": "new.txt", "path": "/new.txt", "parent_path": "/", "user_id": "default_user"})
+    etags.append(await collection_etag(files, QUERY))
+    await files.delete_one({"path": "/new.txt"})
+    # Stessi documenti, stesso ETag
+    assert await collection_etag(files, QUERY) == etags[0]
+    # Il cestino incrementa solo la versione, senza toccare modified_at
+    await trash_node("/1.txt")
+    etags.append(await collection_etag(files, QUERY))
+    await files.update_one({"path": "/2.txt"}, {"$set": {"modified_at": datetime.utcnow()}})
+    etags.append(await collection_etag(files, QUERY))
+
+    assert len(set(etags)) == len(etags)
+    assert await collection_etag(files, {"user_id": "nobody"}) != etags[-1]
+
+
+async def test_etag_covers_only_the_documents_of_the_response(files):
+    newest = {"modified_at": -1}
+    etag = await collection_etag(files, QUERY, sort=newest, limit=2)
+    # Il documento più vecchio è fuori dal limite: cambiarlo non invalida la risposta
+    await files.update_one({"path": "/0.txt"}, {"$inc": {"version": 1}})
+    assert await collection_etag(files, QUERY, sort=newest, limit=2) == etag
+    await files.update_one({"path": "/4.txt"}, {"$inc": {"version": 1}})
+    assert await collection_etag(files, QUERY, sort=newest, limit=2) != etag
@@ -0,0 +1,201 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import jobs as jobs_module
+from database import jobs_collection
+from jobs import FINISHED_STATUSES, JobManager
+from models import JobCreate
+from routes import jobs as job_routes
+from routes.jobs import cancel_job, create_job, get_job, stream_job_events
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def manager(monkeypatch):
+    await jobs_collection.delete_many({})
+    manager = JobManager(workers=1)
+    manager._types = dict(jobs_module.job_manager._types)
+    monkeypatch.setattr(job_routes, "job_manager", manager)
+    yield manager
+    await manager.stop()
+    await jobs_collection.delete_many({})
+
+
+async def _finished(manager, job_id, timeout=5.0):
+    async def wait():
+        while True:
+            job = await jobs_collection.find_one({"_id": job_id})
+            if job["status"] in FINISHED_STATUSES:
+                return job
+            await manager.wait_for_change(job_id, 0.05)
+    return await asyncio.wait_for(wait(), timeout)
+
+
+async def _counting(params, progress):
+    await progress.update(done=0, total=params["count"])
+    for _ in range(params["count"]):
+        await progress.advance(1, message="passo")
+    return {"counted": params["count"]}
+
+
+async def test_job_runs_to_completion_with_progress(manager):
+    manager.register("count", _counting)
+    job = await create_job(JobCreate(type="count", params={"count": 3}))
+    assert job.status == "queued"
+
+    job_id = job_routes._job_id(job.id)
+    await manager.start()
+    finished = await _finished(manager, job_id)
+    assert finished["status"] == "succeeded"
+    assert finished["progress"] == {"done": 3, "total": 3}
+    assert finished["message"] == "passo"
+    assert finished["result"] == {"counted": 3}
+    assert finished["started_at"] <= finished["finished_at"]
+    assert finished["worker"] == manager.worker_id
+    assert (await get_job(str(job_id))).status == "succeeded"
+
+
+async def test_invalid_jobs_are_rejected(manager):
+    with pytest.raises(HTTPException) as error:
+        await create_job(JobCreate(type="unknown", params={}))
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        await create_job(JobCreate(type="delete", params={"path": "/"}))
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        await get_job("not-an-id")
+    assert error.value.status_code == 404
+    assert await jobs_collection.count_documents({}) == 0
+
+
+@pytest.mark.parametrize("error, message", [
+    (ValueError("/docs: elemento non trovato"), "/docs: elemento non trovato"),
+    (RuntimeError("guasto"), "guasto"),
+])
+async def test_failing_job_records_the_error(manager, error, message):
+    async def failing(params, progress):
+        await progress.update(done=1, total=2)
+        raise error
+
+    manager.register("failing", failing)
+    job_id = await manager.submit("failing", {})
+    await manager.start()
+    finished = await _finished(manager, job_id)
+    assert finished["status"] == "failed"
+    assert finished["error"] == message
+    assert finished["progress"] == {"done": 1, "total": 2}
+
+
+async def test_queued_job_is_cancelled_immediately(manager):
+    manager.register("count", _counting)
+    job_id = await manager.submit("count", {"count": 1})
+    cancelled = await cancel_job(str(job_id))
+    assert cancelled.status == "cancelled"
+
+    await manager.start()
+    await asyncio.sleep(0.05)
+    job = await jobs_collection.find_one({"_id": job_id})
+    assert job["status"] == "cancelled"
+    assert job["started_at"] is None
+
+
+async def test_running_job_stops_at_the_next_progress_update(manager):
+    started, resume = asyncio.Event(), asyncio.Event()
+    steps = []
+
+    async def waiting(params, progress):
+        await progress.update(done=0, total=2)
+        started.set()
+        await resume.wait()
+        steps.append("resumed")
+        await progress.advance(1)
+        steps.append("not reached")
+
+    manager.register("waiting", waiting)
+    job_id = await manager.submit("waiting", {})
+    await manager.start()
+    await asyncio.wait_for(started.wait(), 5)
+
+    requested = await cancel_job(str(job_id))
+    assert requested.status == "running"
+    assert requested.cancel_requested
+    resume.set()
+
+    finished = await _finished(manager, job_id)
+    assert finished["status"] == "cancelled"
+    assert steps == ["resumed"]
+
+
+async def test_cancelling_a_missing_job_is_not_found(manager):
+    with pytest.raises(HTTPException) as error:
+        await cancel_job("6ad6092381bdff2563dc19e4")
+    assert error.value.status_code == 404
+
+
+def _parse_events(chunks):
+    events = []
+    for block in "".join(chunks).split("\n\n"):
+        if not block or block.startswith(":"):
+            continue
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+async def test_events_stream_progress_until_the_end(manager):
+    resume = asyncio.Event()
+
+    async def stepping(params, progress):
+        await progress.update(done=0, total=2)
+        await resume.wait()
+        await progress.advance(2)
+        return {"ok": True}
+
+    manager.register("stepping", stepping)
+    job_id = await manager.submit("stepping", {})
+    response = await stream_job_events(str(job_id))
+    assert response.media_type == "text/event-stream"
+
+    chunks = []
+
+    async def consume():
+        async for chunk in response.body_iterator:
+            chunks.append(chunk)
+            if chunks[-1].startswith("event: job") and '"total":2' in chunks[-1]:
+                resume.set()
+
+    await manager.start()
+    await asyncio.wait_for(consume(), 5)
+
+    events = _parse_events(chunks)
+    assert events[0][0] == "job" and events[0][1]["status"] == "queued"
+    assert events[-1] == ("end", {"status": "succeeded"})
+    final = events[-2][1]
+    assert final["status"] == "succeeded"
+    assert final["progress"] == {"done": 2, "total": 2}
+    assert final["result"] == {"ok": True}
+    # Solo gli stati che cambiano vengono inviati
+    payloads = [json.dumps(data, sort_keys=True) for _, data in events]
+    assert len(payloads) == len(set(payloads))
+
+
+async def test_events_of_a_missing_job_are_not_found(manager):
+    with pytest.raises(HTTPException) as error:
+        await stream_job_events("6ad6092381bdff2563dc19e4")
+    assert error.value.status_code == 404
+
+
+async def test_delete_job_removes_the_subtree(manager, filesystem, create_nodes):
+    await create_nodes(folders=["/docs", "/docs/sub"], files=["/docs/a.txt", "/docs/sub/b.txt"])
+
+    job_id = await manager.submit("delete", {"path": "/docs/"})
+    await manager.start()
+    finished = await _finished(manager, job_id)
+    assert finished["status"] == "succeeded"
+    assert finished["result"] == {"deleted": 4}
+    assert finished["progress"] == {"done": 4, "total": 4}
+    assert await filesystem.count_documents({"path": {"$regex": "^/docs"}}) == 0
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+
+import listing_cache as listing_cache_module
+from invalidation import invalidate_filesystem_path
+from listing_cache import ListingCache, get_listing, listing_cache
+
+pytestmark = pytest.mark.anyio
+
+
+def _item(name, parent_path="/docs"):
+    now = datetime.utcnow()
+    return {
+        "name": name, "type": "file", "path": f"{parent_path}/{name}", "parent_path": parent_path,
+        "user_id": "default_user", "created_at": now, "modified_at": now, "version": 1,
+    }
+
+
+def test_put_discards_listing_read_before_invalidation():
+    cache = ListingCache()
+    generation = cache.generation("u", "/docs")
+    cache.invalidate("u", "/docs")
+    cache.put("u", "/docs", [], generation=generation)
+    assert cache.get("u", "/docs") is None
+
+    generation = cache.generation("u", "/docs")
+    cache.put("u", "/docs", [], generation=generation)
+    assert cache.get("u", "/docs") is not None
+
+
+def test_subtree_invalidation_and_clear_change_every_generation():
+    cache = ListingCache()
+    docs = cache.generation("u", "/docs/a")
+    other = cache.generation("u", "/other")
+    cache.invalidate_subtree("u", "/docs")
+    assert cache.generation("u", "/docs/a") != docs
+    before_clear = cache.generation("u", "/other")
+    assert before_clear != other
+    cache.clear()
+    assert cache.generation("u", "/other") != before_clear
+
+
+def test_forgotten_generations_never_look_unchanged(monkeypatch):
+    monkeypatch.setattr(listing_cache_module, "_MAX_GENERATIONS", 2)
+    cache = ListingCache()
+    cache.invalidate("u", "/a")
+    generation = cache.generation("u", "/a")
+    cache.invalidate("u", "/a")
+    cache.invalidate("u", "/b")
+    cache.invalidate("u", "/c")
+    assert cache.generation("u", "/a") != generation
+
+
+async def test_write_during_listing_read_is_not_cached(filesystem, monkeypatch):
+    await filesystem.insert_one(_item("docs", "/") | {"type": "folder", "path": "/docs"})
+    await filesystem.insert_one(_item("old.txt"))
+    aggregate = filesystem.aggregate
+
+    class ConcurrentWrite:
+        """Esegue una scrittura (con invalidazione) mentre la lettura dell'elenco è in corso"""
+
+        def __init__(self, cursor):
+            self.cursor = cursor
+
+        async def to_list(self, length):
+            items = await self.cursor.to_list(length)
+            await filesystem.insert_one(_item("new.txt"))
+            invalidate_filesystem_path("/docs/new.txt", parent_path="/docs")
+            return items
+
+    monkeypatch.setattr(filesystem, "aggregate", lambda *args, **kwargs: ConcurrentWrite(aggregate(*args, **kwargs)))
+    stale = await get_listing("/docs")
+    assert [item["name"] for item in stale.items] == ["old.txt"]
+    assert listing_cache.get("default_user", "/docs") is None
+
+    monkeypatch.setattr(filesystem, "aggregate", aggregate)
+    fresh = await get_listing("/docs")
+    assert sorted(item["name"] for item in fresh.items) == ["new.txt", "old.txt"]
+    assert listing_cache.get("default_user", "/docs") is fresh
+
+
+async def test_terminal_ls_fills_and_reuses_the_listing_cache(filesystem):
+    from routes.terminal import execute_command
+
+    await filesystem.insert_one(_item("docs", "/") | {"type": "folder", "path": "/docs"})
+    await filesystem.insert_one(_item("a.txt"))
+    result = await execute_command(command="ls", current_directory="/docs", session_id="test")
+    assert result["output"] == "a.txt"
+    cached = listing_cache.get("default_user", "/docs")
+    assert cached is not None
+
+    result = await execute_command(command="ls", current_directory="/docs", session_id="test")
+    assert result["output"] == "a.txt"
+    assert listing_cache.get("default_user", "/docs") is cached
+
+
+async def test_field_limited_listing_etag_follows_version(filesystem):
+    await filesystem.insert_one(_item("a.txt"))
+    before = await get_listing("/docs", fields={"name"})
+    await filesystem.update_one({"path": "/docs/a.txt"}, {"$inc": {"version": 1}})
+    after = await get_listing("/docs", fields={"name"})
+    assert before.etag != after.etag
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from loop_monitor import LoopMonitor, event_loop_blocked_seconds_total, event_loop_blocks_total
+
+pytestmark = pytest.mark.anyio
+
+ROUTE = "GET /blocking"
+
+
+def _blocking_app():
+    app = FastAPI()
+
+    @app.get("/blocking")
+    async def blocking():
+        # Chiamata sincrona nel thread dell'event loop
+        time.sleep(0.3)
+        return {}
+
+    @app.get("/quick")
+    async def quick():
+        return {}
+
+    return app
+
+
+async def test_a_blocking_route_is_measured_and_attributed():
+    app = _blocking_app()
+    monitor = LoopMonitor(interval=0.02, threshold_ms=100)
+    blocks = event_loop_blocks_total.value(route=ROUTE)
+    blocked = event_loop_blocked_seconds_total.value(route=ROUTE)
+    monitor.start(app)
+    try:
+        await asyncio.sleep(0.05)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            assert (await client.get("/quick")).status_code == 200
+            assert (await client.get("/blocking")).status_code == 200
+        # Il heartbeat registra il blocco al primo risveglio successivo
+        await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+
+    report = monitor.report()
+    assert report["max_lag_ms"] >= 200
+    [block] = [block for block in report["recent_blocks"] if block["route"] == ROUTE]
+    assert block["lag_ms"] >= 200
+    # Lo stack catturato durante il blocco arriva fino alla chiamata bloccante
+    assert any("time.sleep(0.3)" in frame for frame in block["stack"])
+    assert event_loop_blocks_total.value(route=ROUTE) == blocks + 1
+    assert event_loop_blocked_seconds_total.value(route=ROUTE) - blocked >= 0.2
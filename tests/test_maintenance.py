@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+from filesystem_ops import find_orphans, scavenge_orphans
+from listing_cache import get_listing, listing_cache
+from maintenance import recompute_sizes
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_recompute_sizes_invalidates_the_updated_files(filesystem):
+    now = datetime.utcnow()
+    await filesystem.insert_one({
+        "name": "a.txt", "type": "file", "path": "/a.txt", "parent_path": "/", "user_id": "default_user",
+        "content": "hello", "size": 1, "created_at": now, "modified_at": now, "version": 1,
+    })
+    stale = await get_listing("/")
+    assert listing_cache.get("default_user", "/") is stale
+
+    assert await recompute_sizes() == 1
+    assert listing_cache.get("default_user", "/") is None
+    [item] = (await get_listing("/")).items
+    assert (item["size"], item["version"]) == (5, 2)
+    assert await recompute_sizes() == 0
+
+
+async def test_recompute_sizes_walks_the_files_in_batches(filesystem):
+    now = datetime.utcnow()
+    await filesystem.insert_many([
+        {"name": f"{index}.txt", "type": "file", "path": f"/{index}.txt", "parent_path": "/",
+         "user_id": "default_user", "content": "é" * index, "size": 0 if index % 2 else index,
+         "created_at": now, "modified_at": now, "version": 1}
+        for index in range(1, 8)
+    ])
+    # I file dispari hanno la dimensione sbagliata, e la lunghezza è in caratteri
+    assert await recompute_sizes(batch_size=2) == 4
+    files = await filesystem.find({"type": "file"}).sort("name", 1).to_list(None)
+    assert [file["size"] for file in files] == list(range(1, 8))
+    assert [file["version"] for file in files] == [2, 1, 2, 1, 2, 1, 2]
+
+
+async def test_orphans_are_found_per_user_and_removed_with_their_subtrees(filesystem):
+    now = datetime.utcnow()
+    await filesystem.insert_many([
+        {"name": name, "type": "folder", "path": path, "parent_path": parent_path, "user_id": user_id,
+         "created_at": now, "modified_at": now, "version": 1}
+        for path, parent_path, name, user_id in (
+            ("/docs", "/", "docs", "default_user"),
+            ("/docs/a", "/docs", "a", "default_user"),
+            ("/gone/b", "/gone", "b", "default_user"),
+            ("/gone/b/c", "/gone/b", "c", "default_user"),
+            # Il padre esiste, ma appartiene a un altro utente
+            ("/docs/x", "/docs", "x", "other_user"),
+        )
+    ])
+
+    assert await find_orphans() == [{"path": "/gone/b", "user_id": "default_user"}]
+    assert await find_orphans("other_user") == [{"path": "/docs/x", "user_id": "other_user"}]
+    assert await scavenge_orphans() == 3
+    remaining = await filesystem.find({}, {"_id": 0, "path": 1}).sort("path", 1).to_list(None)
+    assert [node["path"] for node in remaining] == ["/", "/docs", "/docs/a"]
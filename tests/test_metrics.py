@@ -0,0 +1,125 @@
+import re
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import metrics as metrics_module
+from metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, MetricsRegistry, MongoCommandListener, http_requests_total
+
+pytestmark = pytest.mark.anyio
+
+# Una riga di campione: nome, etichette opzionali, valore
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]+="[^"]*",?)*\})? (-?[0-9.e+-]+|\+Inf)$')
+
+
+def test_counter_and_histogram_exposition():
+    registry = MetricsRegistry()
+    counter = registry.counter("demo_total", "Contatore di prova", ("route", "status"))
+    histogram = registry.histogram("demo_seconds", "Latenze di prova", ("route",), buckets=(0.1, 1.0))
+    counter.inc(route="/a", status=200)
+    counter.inc(2, route="/a", status=200)
+    counter.inc(route='/b"\n', status=500)
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(3, route="/a")
+
+    assert registry.render().splitlines() == [
+        "# HELP demo_total Contatore di prova",
+        "# TYPE demo_total counter",
+        'demo_total{route="/a",status="200"} 3',
+        'demo_total{route="/b\\"\\n",status="500"} 1',
+        "# HELP demo_seconds Latenze di prova",
+        "# TYPE demo_seconds histogram",
+        'demo_seconds_bucket{route="/a",le="0.1"} 1',
+        'demo_seconds_bucket{route="/a",le="1"} 2',
+        'demo_seconds_bucket{route="/a",le="+Inf"} 3',
+        'demo_seconds_sum{route="/a"} 3.55',
+        'demo_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_labels_must_match_the_declared_names():
+    counter = MetricsRegistry().counter("demo_total", "Contatore di prova", ("route",))
+    with pytest.raises(ValueError):
+        counter.inc(path="/a")
+    with pytest.raises(ValueError):
+        counter.inc(route="/a", status=200)
+
+
+def test_registering_a_name_twice_returns_the_same_metric():
+    registry = MetricsRegistry()
+    assert registry.counter("demo_total", "a") is registry.counter("demo_total", "b")
+
+
+async def test_metrics_endpoint_serves_the_text_format():
+    from server import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.get("/api/")
+        response = await client.get("/api/metrics", headers={"Accept-Encoding": "identity"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE_LATEST
+    lines = response.text.splitlines()
+    assert "# TYPE futureos_http_requests_total counter" in lines
+    assert "# TYPE futureos_http_request_duration_seconds histogram" in lines
+    for line in lines:
+        assert line.startswith("# HELP ") or line.startswith("# TYPE ") or SAMPLE_LINE.match(line), line
+    assert any(line.startswith('futureos_http_requests_total{method="GET",route="/api/",status="200"}')
+               for line in lines)
+
+
+def _mongo_event(request_id, seconds, command_name="find", collection="filesystem"):
+    return SimpleNamespace(
+        command_name=command_name, command={command_name: collection},
+        connection_id=("localhost", 27017), request_id=request_id,
+        duration_micros=int(seconds * 1_000_000),
+    )
+
+
+def _db_sum(route):
+    for line in metrics_module.registry.render().splitlines():
+        if line.startswith(f'futureos_http_request_db_seconds_sum{{method="GET",route="{route}"}}'):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+async def test_mongo_time_is_attributed_to_the_current_request():
+    listener = MongoCommandListener()
+    app = FastAPI()
+
+    @app.get("/items/{name}")
+    async def item(name: str):
+        # Due comandi durante la richiesta, il secondo fallito
+        for request_id, seconds in ((1, 0.25), (2, 0.5)):
+            event = _mongo_event(request_id, seconds)
+            listener.started(event)
+            (listener.succeeded if request_id == 1 else listener.failed)(event)
+        return {"name": name}
+
+    app.add_middleware(MetricsMiddleware)
+    before = http_requests_total.value(method="GET", route="/items/{name}", status="200")
+    db_before = _db_sum("/items/{name}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert (await client.get("/items/a")).status_code == 200
+        assert (await client.get("/items/b")).status_code == 200
+        assert (await client.get("/missing")).status_code == 404
+
+    # Il template della route, non il percorso, è l'etichetta
+    assert http_requests_total.value(method="GET", route="/items/{name}", status="200") == before + 2
+    assert http_requests_total.value(method="GET", route="unmatched", status="404") >= 1
+    assert _db_sum("/items/{name}") - db_before == pytest.approx(1.5)
+    assert metrics_module.mongo_operations_total.value(
+        collection="filesystem", command="find", status="error"
+    ) >= 2
+
+    # Fuori da una richiesta il tempo non viene attribuito a nessuno
+    unattributed = _db_sum("/items/{name}")
+    event = _mongo_event(3, 1.0)
+    listener.started(event)
+    listener.succeeded(event)
+    assert _db_sum("/items/{name}") == unattributed
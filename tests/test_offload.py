@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import offload as offload_module
+from offload import OffloadPool, offload_inline_total, offload_queue_depth, run_buffer, run_cpu
+
+pytestmark = pytest.mark.anyio
+
+
+def _blocking(started, release, results, value):
+    started.release()
+    release.wait(5)
+    results.append(value)
+    return value
+
+
+async def test_work_beyond_the_pool_limit_queues_instead_of_failing():
+    pool = OffloadPool("test", lambda: ThreadPoolExecutor(4), max_pending=2)
+    started, release, results = threading.Semaphore(0), threading.Event(), []
+    try:
+        tasks = [
+            asyncio.ensure_future(pool.submit(_blocking, started, release, results, value, task="test"))
+            for value in range(6)
+        ]
+        for _ in range(2):
+            assert await asyncio.to_thread(started.acquire, timeout=5)
+        await asyncio.sleep(0.05)
+
+        # Il pool ha quattro thread, ma max_pending fa entrare due lavori alla volta: gli altri attendono
+        assert results == [] and not started.acquire(blocking=False)
+        assert offload_queue_depth.value(pool="test") == 6
+        assert not any(task.done() for task in tasks)
+
+        release.set()
+        assert await asyncio.wait_for(asyncio.gather(*tasks), 5) == list(range(6))
+        assert sorted(results) == list(range(6))
+        assert offload_queue_depth.value(pool="test") == 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def _thread_name(view):
+    return threading.current_thread().name, bytes(view)
+
+
+async def test_buffers_below_the_threshold_run_inline(monkeypatch):
+    pool = OffloadPool("buffer", lambda: ThreadPoolExecutor(1, thread_name_prefix="test-buffer"))
+    monkeypatch.setattr(offload_module, "buffer_pool", pool)
+    inline = offload_inline_total.value(task="test_buffer")
+    try:
+        name, data = await run_buffer(_thread_name, b"abc", threshold=4, task="test_buffer")
+        assert (name, data) == (threading.current_thread().name, b"abc")
+        assert offload_inline_total.value(task="test_buffer") == inline + 1
+
+        name, data = await run_buffer(_thread_name, b"abcd", threshold=4, task="test_buffer")
+        assert name.startswith("test-buffer") and data == b"abcd"
+        assert offload_inline_total.value(task="test_buffer") == inline + 1
+    finally:
+        pool.shutdown()
+
+
+def _current_thread():
+    return threading.current_thread().name
+
+
+async def test_cpu_work_below_the_threshold_runs_inline(monkeypatch):
+    pool = OffloadPool("cpu", lambda: ThreadPoolExecutor(1, thread_name_prefix="test-cpu"))
+    monkeypatch.setattr(offload_module, "cpu_pool", pool)
+    try:
+        assert await run_cpu(_current_thread, size_hint=9, threshold=10) == threading.current_thread().name
+        assert (await run_cpu(_current_thread, size_hint=10, threshold=10)).startswith("test-cpu")
+    finally:
+        pool.shutdown()
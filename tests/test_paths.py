@@ -0,0 +1,130 @@
+import pytest
+
+from filesystem_ops import delete_node, trash_node
+from invalidation import invalidate_filesystem_path
+from paths import (
+    HOME_DIRECTORY, SessionPathCache, base_name, is_within, normalize_path, parent_of, path_cache,
+    resolve_node
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("path, cwd, expected", [
+    ("/", "/", "/"),
+    ("..", "/", "/"),
+    ("../../..", "/home", "/"),
+    ("/../etc/../..", "/", "/"),
+    ("../../../docs", "/home/user", "/docs"),
+    ("docs/../notes", "/home/user", "/home/user/notes"),
+    ("./a/./b/.", "/", "/a/b"),
+    ("~", "/tmp", HOME_DIRECTORY),
+    ("~/docs", "/tmp", f"{HOME_DIRECTORY}/docs"),
+    ("~/..", "/tmp", "/home"),
+    ("docs/~", "/", "/docs/~"),
+    ("~user", "/", "/~user"),
+    ("//a///b//", "/", "/a/b"),
+    ("a//b", "//home//user//", "/home/user/a/b"),
+    ("", "/home/user", "/home/user"),
+])
+def test_normalize_path(path, cwd, expected):
+    assert normalize_path(path, cwd) == expected
+
+
+def test_path_helpers():
+    assert parent_of("/") == ""
+    assert parent_of("/docs") == "/"
+    assert parent_of("/docs/a.txt") == "/docs"
+    assert base_name("/") == "/"
+    assert base_name("/docs/a.txt") == "a.txt"
+    assert is_within("/docs/a", "/docs")
+    assert is_within("/docs", "/docs")
+    assert is_within("/anything", "/")
+    assert not is_within("/docs2", "/docs")
+
+
+def test_invalidation_reaches_every_session():
+    cache = SessionPathCache()
+    for session in ("s1", "s2"):
+        cache.put(session, "/docs", {"type": "folder", "path": "/docs"})
+        cache.put(session, "/docs/a.txt", {"type": "file", "path": "/docs/a.txt"})
+        cache.put(session, "/docs2", {"type": "folder", "path": "/docs2"})
+
+    cache.invalidate("/docs/a.txt")
+    assert cache.get("s1", "/docs/a.txt") is None and cache.get("s2", "/docs/a.txt") is None
+    assert cache.get("s1", "/docs") is not None
+
+    cache.invalidate("/docs", subtree=True)
+    assert cache.get("s1", "/docs") is None and cache.get("s2", "/docs") is None
+    assert cache.get("s1", "/docs2") is not None
+
+
+def test_put_discards_nodes_read_before_an_invalidation():
+    cache = SessionPathCache()
+    generation = cache.generation
+    cache.invalidate("/docs")
+    cache.put("s1", "/docs", {"type": "folder", "path": "/docs"}, generation=generation)
+    assert cache.get("s1", "/docs") is None
+
+
+@pytest.fixture
+async def docs(filesystem, create_nodes):
+    await create_nodes(folders=["/docs", "/docs/sub"], files=[("/docs/sub/a.txt", "alpha")])
+    return filesystem
+
+
+async def test_resolved_nodes_are_cached_per_session_without_contents(docs):
+    node = await resolve_node("s1", "/docs/sub/a.txt", with_content=True)
+    assert node["content"] == "alpha"
+    assert path_cache.get("s1", "/docs/sub/a.txt") == {"type": "file", "path": "/docs/sub/a.txt"}
+    assert path_cache.get("s2", "/docs/sub/a.txt") is None
+    assert await resolve_node("s1", "/docs/missing.txt") is None
+
+    # Il nodo in cache basta per tipo e path, non per una lettura con contenuto
+    await docs.update_one({"path": "/docs/sub/a.txt"}, {"$set": {"content": "beta"}})
+    assert (await resolve_node("s1", "/docs/sub/a.txt"))["type"] == "file"
+    assert (await resolve_node("s1", "/docs/sub/a.txt", with_content=True))["content"] == "beta"
+
+
+async def test_rename_invalidates_the_old_subtree(docs):
+    await resolve_node("s1", "/docs/sub")
+    await resolve_node("s1", "/docs/sub/a.txt")
+
+    # Spostamento del sottoalbero come nelle operazioni ricorsive
+    for node in await docs.find({"path": {"$regex": "^/docs/sub(/|$)"}}).to_list(None):
+        new_path = "/docs/renamed" + node["path"][len("/docs/sub"):]
+        await docs.update_one({"_id": node["_id"]}, {"$set": {
+            "path": new_path, "parent_path": parent_of(new_path), "name": base_name(new_path)
+        }})
+    invalidate_filesystem_path("/docs/sub", subtree=True)
+
+    assert await resolve_node("s1", "/docs/sub") is None
+    assert await resolve_node("s1", "/docs/sub/a.txt") is None
+    assert (await resolve_node("s1", "/docs/renamed/a.txt"))["type"] == "file"
+
+
+async def test_delete_and_trash_invalidate_cached_nodes(docs):
+    await resolve_node("s1", "/docs/sub/a.txt")
+    await trash_node("/docs/sub")
+    assert path_cache.get("s1", "/docs/sub/a.txt") is None
+    assert await resolve_node("s1", "/docs/sub/a.txt") is None
+
+    await resolve_node("s1", "/docs")
+    await delete_node("/docs")
+    assert path_cache.get("s1", "/docs") is None
+    assert await resolve_node("s1", "/docs") is None
+
+
+def test_total_size_is_bounded_across_sessions():
+    cache = SessionPathCache(max_sessions=100, max_entries=100, max_bytes=4096)
+    for session in range(10):
+        for index in range(4):
+            path = f"/docs/{index}.txt"
+            cache.put(f"s{session}", path, {"type": "file", "path": path, "content": "x" * 10_000})
+    assert 0 < cache.current_bytes <= 4096
+    # Restano le sessioni usate più di recente
+    assert cache.get("s9", "/docs/0.txt") == {"type": "file", "path": "/docs/0.txt"}
+    assert cache.get("s0", "/docs/0.txt") is None
+
+    cache.invalidate("/docs", subtree=True)
+    assert cache.current_bytes == 0
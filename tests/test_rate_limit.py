@@ -0,0 +1,89 @@
+import asyncio
+import ipaddress
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from starlette.requests import Request
+
+from rate_limit import AdmissionController, AdmissionMiddleware, client_address, parse_rate_limit
+
+PROXIES = [ipaddress.ip_network("10.0.0.0/8"), ipaddress.ip_network("192.168.1.5")]
+
+
+def _request(host, *forwarded):
+    headers = [(b"x-forwarded-for", value.encode()) for value in forwarded]
+    return Request({"type": "http", "client": (host, 1234), "headers": headers})
+
+
+@pytest.mark.parametrize("request_, expected", [
+    # Connessione diretta: l'header è ignorato
+    (_request("203.0.113.7", "198.51.100.1"), "203.0.113.7"),
+    (_request("10.1.2.3", "198.51.100.1"), "198.51.100.1"),
+    # Il client può falsificare la parte sinistra della catena, non quella aggiunta dai proxy
+    (_request("10.1.2.3", "1.2.3.4, 198.51.100.1, 192.168.1.5"), "198.51.100.1"),
+    (_request("10.1.2.3", "1.2.3.4", "198.51.100.1"), "198.51.100.1"),
+    (_request("10.1.2.3", "10.9.9.9"), "10.9.9.9"),
+    (_request("10.1.2.3"), "10.1.2.3"),
+    (_request("10.1.2.3", "garbage"), "garbage"),
+])
+def test_client_address(request_, expected):
+    assert client_address(request_, PROXIES) == expected
+
+
+def test_forwarded_header_is_ignored_without_trusted_proxies():
+    assert client_address(_request("10.1.2.3", "198.51.100.1"), []) == "10.1.2.3"
+
+
+def test_rate_limits_are_parsed_from_the_environment():
+    assert parse_rate_limit("TERMINAL", "10", "20", {}) == (10.0, 20)
+    environ = {"TERMINAL_RATE_PER_SEC": "0.5", "TERMINAL_RATE_BURST": "3"}
+    assert parse_rate_limit("TERMINAL", "10", "20", environ) == (0.5, 3)
+
+
+@pytest.mark.parametrize("environ", [
+    {"AUTOSAVE_RATE_PER_SEC": "0"},
+    {"AUTOSAVE_RATE_PER_SEC": "-1"},
+    {"AUTOSAVE_RATE_PER_SEC": "nan"},
+    {"AUTOSAVE_RATE_BURST": "0"},
+])
+def test_non_positive_rate_limits_are_rejected(environ):
+    with pytest.raises(ValueError):
+        parse_rate_limit("AUTOSAVE", "2", "10", environ)
+
+
+@pytest.mark.anyio
+async def test_admission_applies_to_every_api_route():
+    controller = AdmissionController(max_inflight=1, max_queue=0, timeout=0.05)
+    entered, release = asyncio.Event(), asyncio.Event()
+    app = FastAPI()
+
+    @app.get("/api/slow")
+    async def slow():
+        entered.set()
+        await release.wait()
+        return {}
+
+    @app.get("/api/fast")
+    async def fast():
+        return {}
+
+    @app.get("/api/metrics")
+    async def metrics():
+        return {}
+
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        slow_request = asyncio.ensure_future(client.get("/api/slow"))
+        await asyncio.wait_for(entered.wait(), 5)
+
+        rejected = await client.get("/api/fast")
+        assert rejected.status_code == 429
+        assert rejected.headers["retry-after"] == "1"
+        # Le metriche non passano dal controllo
+        assert (await client.get("/api/metrics")).status_code == 200
+
+        release.set()
+        assert (await slow_request).status_code == 200
+        assert (await client.get("/api/fast")).status_code == 200
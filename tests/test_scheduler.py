@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import scheduler_leases_collection
+from scheduler import LEASE_ID, Scheduler
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def leases():
+    await scheduler_leases_collection.delete_many({})
+    yield scheduler_leases_collection
+    await scheduler_leases_collection.delete_many({})
+
+
+async def _lease(leases):
+    return await leases.find_one({"_id": LEASE_ID})
+
+
+async def test_only_one_scheduler_acquires_the_lease(leases):
+    first, second = Scheduler(leases), Scheduler(leases)
+    await first._renew_lease()
+    await second._renew_lease()
+    assert (first.is_leader, second.is_leader) == (True, False)
+    assert (await _lease(leases))["holder"] == first.worker_id
+
+
+async def test_the_leader_renews_its_lease(leases):
+    first, second = Scheduler(leases, lease_seconds=30), Scheduler(leases)
+    await first._renew_lease()
+    expires_at = (await _lease(leases))["expires_at"]
+
+    await asyncio.sleep(0.01)
+    await first._renew_lease()
+    await second._renew_lease()
+    lease = await _lease(leases)
+    assert lease["holder"] == first.worker_id
+    assert lease["expires_at"] > expires_at
+    assert first.is_leader and not second.is_leader
+
+
+async def test_an_expired_lease_passes_to_another_scheduler(leases):
+    first, second = Scheduler(leases), Scheduler(leases)
+    await first._renew_lease()
+    # Il leader smette di rinnovare (processo bloccato o terminato)
+    await leases.update_one(
+        {"_id": LEASE_ID}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+
+    await second._renew_lease()
+    assert second.is_leader
+    assert (await _lease(leases))["holder"] == second.worker_id
+    # Al rinnovo successivo il vecchio leader scopre di non esserlo più
+    await first._renew_lease()
+    assert not first.is_leader
+
+
+async def test_stopping_the_leader_releases_the_lease(leases):
+    first, second = Scheduler(leases), Scheduler(leases)
+    runs = {first.worker_id: 0, second.worker_id: 0}
+
+    def counting(scheduler):
+        async def job():
+            runs[scheduler.worker_id] += 1
+        return job
+
+    for scheduler in (first, second):
+        scheduler.every("leader_job", 0.01, counting(scheduler), jitter=0, run_at_start=True)
+    await first.start()
+    await second.start()
+    await asyncio.sleep(0.05)
+    assert runs[first.worker_id] > 0 and runs[second.worker_id] == 0
+    assert second.get_job("leader_job").skipped > 0
+
+    await first.stop()
+    assert await _lease(leases) is None
+    await second._renew_lease()
+    assert second.is_leader
+    await second.stop()
@@ -0,0 +1,100 @@
+import json
+import threading
+from datetime import datetime
+
+import pytest
+
+import content_codec as content_codec_module
+from content_codec import CODEC_FIELD, encode_content
+from models import FileSystemItem
+from serialization import model_projection, parse_fields, trusted_response
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("fields, expected", [
+    (None, None),
+    ("", None),
+    (" , ", None),
+    ("name", {"name"}),
+    (" name ,size,,name", {"name", "size"}),
+    (["id", "content"], {"id", "content"}),
+])
+def test_parse_fields(fields, expected):
+    assert parse_fields(FileSystemItem, fields) == expected
+
+
+def test_parse_fields_rejects_unknown_fields():
+    with pytest.raises(ValueError, match="_id, secret"):
+        parse_fields(FileSystemItem, "name,secret,_id")
+
+
+def test_model_projection():
+    full = model_projection(FileSystemItem)["$project"]
+    assert full["_id"] == 0 and full["id"] == {"$toString": "$_id"}
+    assert set(full) == set(FileSystemItem.model_fields) | {"_id", CODEC_FIELD, "content_ref"}
+
+    # Senza id e content non servono né la conversione né i campi del codec
+    assert model_projection(FileSystemItem, {"name", "size"}) == {"$project": {"name": 1, "size": 1, "_id": 0}}
+    assert model_projection(FileSystemItem, {"id"}) == {"$project": {"_id": 0, "id": {"$toString": "$_id"}}}
+
+
+@pytest.fixture
+async def items(filesystem, monkeypatch):
+    monkeypatch.setattr(content_codec_module, "CONTENT_COMPRESSION_MIN_BYTES", 64)
+    now = datetime.utcnow()
+    for name, content in (("small.txt", "ciao"), ("big.txt", "z" * 1000)):
+        await filesystem.insert_one({
+            "name": name, "type": "file", "path": f"/{name}", "parent_path": "/",
+            "user_id": "default_user", "size": len(content), "created_at": now, "modified_at": now,
+            "version": 1, **await encode_content(content),
+        })
+    assert (await filesystem.find_one({"path": "/big.txt"}))[CODEC_FIELD] == "zlib"
+    return filesystem
+
+
+async def _read(collection, fields=None):
+    pipeline = [{"$match": {"parent_path": "/"}}, {"$sort": {"name": 1}}, model_projection(FileSystemItem, fields)]
+    return await collection.aggregate(pipeline).to_list(None)
+
+
+async def test_trusted_response_maps_id_and_decodes_contents(items):
+    documents = await _read(items)
+    stored = await items.find({"parent_path": "/"}).sort("name", 1).to_list(None)
+    body = json.loads((await trusted_response(FileSystemItem, documents)).body)
+
+    assert [item["id"] for item in body] == [str(document["_id"]) for document in stored]
+    assert [item["content"] for item in body] == ["z" * 1000, "ciao"]
+    assert set(body[0]) == set(FileSystemItem.model_fields)
+    # I documenti letti (es. quelli in cache) restano compressi
+    assert documents[0][CODEC_FIELD] == "zlib"
+
+
+async def test_trusted_response_with_a_field_subset(items):
+    fields = {"name", "content"}
+    body = json.loads((await trusted_response(FileSystemItem, await _read(items, fields), fields)).body)
+    assert body == [{"name": "big.txt", "content": "z" * 1000}, {"name": "small.txt", "content": "ciao"}]
+
+    fields = {"id", "size"}
+    body = json.loads((await trusted_response(FileSystemItem, await _read(items, fields), fields)).body)
+    assert [set(item) for item in body] == [{"id", "size"}] * 2
+
+
+async def test_large_contents_are_decoded_in_the_buffer_pool(items, monkeypatch):
+    threads = []
+    decode = content_codec_module.decode_content
+
+    def recording(*args):
+        threads.append(threading.current_thread())
+        return decode(*args)
+
+    monkeypatch.setattr(content_codec_module, "decode_content", recording)
+    documents = await _read(items)
+    await trusted_response(FileSystemItem, documents)
+    assert threads == [threading.main_thread()]
+
+    # Sopra la soglia la decompressione lascia l'event loop
+    monkeypatch.setattr(content_codec_module, "DECODE_OFFLOAD_MIN_BYTES", 1)
+    body = json.loads((await trusted_response(FileSystemItem, documents)).body)
+    assert body[0]["content"] == "z" * 1000
+    assert threads[1] is not threading.main_thread()
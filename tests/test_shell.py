@@ -0,0 +1,134 @@
+import re
+
+import pytest
+
+from filesystem_ops import trash_node
+from routes.terminal import execute_command
+from shell import APPEND, PIPE, REDIRECT, ShellSyntaxError, Word, expand_word, glob_regex, parse, tokenize
+
+
+def _texts(tokens):
+    return [token.text if isinstance(token, Word) else token for token in tokens]
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("ls  -a\t/tmp", ["ls", "-a", "/tmp"]),
+    ("echo 'a b' \"c d\"", ["echo", "a b", "c d"]),
+    ("echo 'it''s'", ["echo", "its"]),
+    ("echo \"say \\\"hi\\\" \\\\ \\n\"", ["echo", 'say "hi" \\ \\n']),
+    ("echo a\\ b \\|", ["echo", "a b", "|"]),
+    ("echo '|' \">\"", ["echo", "|", ">"]),
+    ("echo ''", ["echo", ""]),
+    ("ls|grep x>out", ["ls", PIPE, "grep", "x", REDIRECT, "out"]),
+    ("echo a >> b", ["echo", "a", APPEND, "b"]),
+])
+def test_tokenize_quoting_and_operators(line, expected):
+    assert _texts(tokenize(line)) == expected
+
+
+def test_tokenize_marks_only_unquoted_wildcards():
+    plain, quoted, escaped, mixed = tokenize("*.txt '*.txt' \\*.txt \"a*\"*")
+    assert plain.magic and plain.pattern == "*.txt"
+    assert not quoted.magic and quoted.pattern == "\\*.txt"
+    assert not escaped.magic and escaped.pattern == "\\*.txt"
+    assert mixed.magic and mixed.pattern == "a\\**"
+
+
+@pytest.mark.parametrize("line", ["echo 'open", 'echo "open', "ls |", "| ls", "ls | | wc", "echo >", "> out"])
+def test_parse_rejects_malformed_lines(line):
+    with pytest.raises(ShellSyntaxError):
+        parse(line)
+
+
+def test_parse_pipeline_with_redirections():
+    first, second = parse("cat a.txt | grep x >> out.txt")
+    assert [word.text for word in first.words] == ["cat", "a.txt"] and first.redirect is None
+    assert [word.text for word in second.words] == ["grep", "x"]
+    assert second.redirect.text == "out.txt" and second.append
+    assert parse("   ") == []
+
+
+@pytest.mark.parametrize("pattern, matches, rejects", [
+    ("*.txt", ["a.txt", ".txt", "x.y.txt"], ["a.txt.bak", "dir/a.txt"]),
+    ("?.md", ["a.md"], ["ab.md", "/.md"]),
+    ("[ab]*", ["apple", "b"], ["cat"]),
+    ("[!ab]*", ["cat"], ["apple", "/x"]),
+    ("[a-c]", ["b"], ["d"]),
+    ("[]x]", ["]", "x"], ["y"]),
+    ("a[", ["a["], ["ab"]),
+    ("\\*.txt", ["*.txt"], ["a.txt"]),
+    ("a.b", ["a.b"], ["axb"]),
+    ("*/*.py", ["src/main.py"], ["main.py", "a/b/c.py"]),
+])
+def test_glob_regex(pattern, matches, rejects):
+    regex = re.compile(f"^{glob_regex(pattern)}$")
+    for name in matches:
+        assert regex.match(name), name
+    for name in rejects:
+        assert not regex.match(name), name
+
+
+@pytest.fixture
+async def tree(home, create_nodes):
+    await create_nodes(
+        folders=("/home/user/docs", "/home/user/src", "/home/user/src/pkg"),
+        files=[
+            ("/home/user/docs/a.txt", "alpha\nbeta\n"), ("/home/user/docs/b.txt", "gamma"),
+            ("/home/user/docs/c.md", "delta"), ("/home/user/docs/*.txt", "literal"),
+            "/home/user/src/main.py", "/home/user/src/pkg/util.py",
+        ],
+    )
+    return home
+
+
+async def _expand(text, cwd="/home/user"):
+    word, = tokenize(text)
+    return await expand_word(word, cwd)
+
+
+@pytest.mark.anyio
+async def test_expand_word(tree):
+    assert await _expand("docs/*.txt") == ["docs/*.txt", "docs/a.txt", "docs/b.txt"]
+    assert await _expand("*.txt", "/home/user/docs") == ["*.txt", "a.txt", "b.txt"]
+    assert await _expand("'*.txt'", "/home/user/docs") == ["*.txt"]
+    assert await _expand("/home/user/docs/?.md") == ["/home/user/docs/c.md"]
+    assert await _expand("*/*.py") == ["src/main.py"]
+    assert await _expand("src/*/*.py") == ["src/pkg/util.py"]
+    assert await _expand("../*/docs") == ["docs"]
+    assert await _expand("*.nothing") == ["*.nothing"]
+
+
+@pytest.mark.anyio
+async def test_expand_word_skips_trashed_nodes(tree):
+    await trash_node("/home/user/docs/b.txt")
+    await trash_node("/home/user/src")
+    assert await _expand("docs/[ab].txt") == ["docs/a.txt"]
+    assert await _expand("*/*.py") == ["*/*.py"]
+
+
+async def _run(command, cwd="/home/user/docs"):
+    return (await execute_command(command=command, current_directory=cwd, session_id="test"))["output"]
+
+
+@pytest.mark.anyio
+async def test_redirection(tree):
+    assert await _run("echo one > out.txt") == ""
+    assert await _run("echo two >> out.txt") == ""
+    assert await _run("cat out.txt") == "one\ntwo"
+    assert await _run("cat a.txt | grep -v beta > out.txt") == ""
+    assert await _run("cat out.txt") == "alpha"
+    assert await _run("ls ../src > listing") == ""
+    assert sorted((await _run("cat listing")).split("\n")) == ["main.py", "pkg"]
+    assert await _run("echo x > ../src") == "../src: È una directory"
+    assert await _run("echo x > missing/f") == "missing/f: Directory padre non trovata"
+    assert await _run("echo x > ?.txt") == "?.txt: redirezione ambigua"
+
+
+@pytest.mark.anyio
+async def test_pipes_run_every_stage(tree):
+    assert await _run("grep a [ab].txt") == "a.txt:alpha\na.txt:beta\nb.txt:gamma"
+    assert await _run("cat a.txt b.txt | grep -i A") == "alpha\nbeta\ngamma"
+    assert (await _run("touch new.txt | nosuch")).startswith("nosuch: comando non trovato")
+    assert (await _run("mkdir zz | foo | cat")).startswith("foo: comando non trovato")
+    assert await _run("echo x > d1.txt | echo y > ?.txt") == "?.txt: redirezione ambigua"
+    assert sorted((await _run("ls")).split("  ")) == ["*.txt", "a.txt", "b.txt", "c.md", "d1.txt", "new.txt", "zz"]
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pytest
+
+from database import notepad_files_collection, system_samples_collection
+from system_monitor import SystemMonitor, user_storage_bytes
+
+pytestmark = pytest.mark.anyio
+
+
+async def _file(collection, user_id, size):
+    now = datetime.utcnow()
+    await collection.insert_one({
+        "name": f"{user_id}-{size}", "type": "file", "path": f"/{user_id}-{size}", "parent_path": "/",
+        "user_id": user_id, "size": size, "created_at": now, "modified_at": now,
+    })
+
+
+async def test_storage_totals_are_shared_and_stale_users_removed(filesystem):
+    await system_samples_collection.delete_many({})
+    await notepad_files_collection.delete_many({})
+    await _file(filesystem, "alice", 10)
+    await _file(filesystem, "bob", 5)
+
+    leader, follower = SystemMonitor(), SystemMonitor()
+    await leader.sample_storage()
+    await follower.load_storage()
+    assert follower.system_info("alice")["storage_used_bytes"] == 10
+    assert user_storage_bytes.value(user_id="bob") == 5
+
+    await filesystem.delete_many({"user_id": "bob"})
+    await leader.sample_storage()
+    await follower.load_storage()
+    assert "storage_used_bytes" not in follower.system_info("bob")
+    assert not any(line.startswith('futureos_user_storage_bytes{user_id="bob"}')
+                   for line in user_storage_bytes.collect())
+    await system_samples_collection.delete_many({})
+
+
+async def test_load_before_the_first_sample_keeps_the_empty_totals():
+    await system_samples_collection.delete_many({})
+    monitor = SystemMonitor()
+    await monitor.load_storage()
+    assert "storage_used_bytes" not in monitor.system_info()
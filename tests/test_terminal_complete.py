@@ -0,0 +1,91 @@
+import pytest
+
+from listing_cache import get_listing
+from routes.terminal import complete_command
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def home(home, create_nodes):
+    await create_nodes(
+        folders=("/home/user/docs", "/home/user/downloads"),
+        files=("/home/user/docs/a.txt", "/home/user/docs/b.txt", "/home/user/dots.txt", "/readme.md"),
+    )
+    return home
+
+
+async def _complete(line, current_directory="/home/user", limit=20):
+    return await complete_command(line=line, current_directory=current_directory, limit=limit)
+
+
+@pytest.mark.parametrize("line, candidates", [
+    ("c", ["cd", "cat", "clear"]),
+    ("", None),
+    ("ls | gr", ["grep"]),
+    ("cat a.txt |c", ["cd", "cat", "clear"]),
+])
+async def test_first_word_completes_command_names(home, line, candidates):
+    completion = await _complete(line)
+    assert completion.kind == "command"
+    if candidates is not None:
+        assert completion.candidates == candidates
+    assert completion.complete
+
+
+async def test_later_words_complete_paths_in_the_current_directory(home):
+    completion = await _complete("cat do")
+    assert completion.kind == "path"
+    assert completion.token == "do"
+    assert completion.candidates == ["docs/", "dots.txt", "downloads/"]
+    assert completion.complete
+
+
+async def test_cd_completes_only_folders(home):
+    completion = await _complete("cd do")
+    assert completion.candidates == ["docs/", "downloads/"]
+
+
+@pytest.mark.parametrize("line, current_directory, candidates", [
+    ("cat docs/", "/home/user", ["docs/a.txt", "docs/b.txt"]),
+    ("cat ../user/docs/a", "/home/user", ["../user/docs/a.txt"]),
+    ("cat ../../../../r", "/home/user", ["../../../../readme.md"]),
+    ("cat ~/docs/b", "/", ["~/docs/b.txt"]),
+    ("cat ~/d", "/", ["~/docs/", "~/dots.txt", "~/downloads/"]),
+    ("cat /home/user/docs/", "/", ["/home/user/docs/a.txt", "/home/user/docs/b.txt"]),
+    ("cat //home//u", "/", ["//home//user/"]),
+])
+async def test_typed_directory_is_resolved_and_kept(home, line, current_directory, candidates):
+    completion = await _complete(line, current_directory)
+    assert completion.candidates == candidates
+
+
+async def test_piped_command_completes_paths_after_its_name(home):
+    completion = await _complete("ls | cat docs/a")
+    assert completion.kind == "path"
+    assert completion.candidates == ["docs/a.txt"]
+
+
+@pytest.mark.parametrize("cached", [False, True])
+async def test_candidates_are_capped_at_limit(home, cached):
+    if cached:
+        await get_listing("/home/user")
+    completion = await _complete("cat d", limit=2)
+    assert completion.candidates == ["docs/", "dots.txt"]
+    assert not completion.complete
+
+    completion = await _complete("cat d", limit=3)
+    assert len(completion.candidates) == 3
+    assert completion.complete
+
+
+async def test_command_names_are_capped_at_limit(home):
+    completion = await _complete("c", limit=2)
+    assert completion.candidates == ["cd", "cat"]
+    assert not completion.complete
+
+
+async def test_missing_directory_has_no_candidates(home):
+    completion = await _complete("cat missing/")
+    assert completion.candidates == []
+    assert completion.complete
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from database import terminal_history_collection
+from routes.terminal import search_terminal_history
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+async def history():
+    """Cronologia dalla più vecchia alla più recente, un secondo tra una voce e l'altra"""
+    await terminal_history_collection.delete_many({})
+    commands = ["ls", "cd /docs", "cat a.txt", "cat a.txt", "cat a.txt", "ls", "LS -la", "ls"]
+    await terminal_history_collection.insert_many([
+        {
+            "command": command, "output": f"out {index}", "directory": "/",
+            "user_id": "default_user", "timestamp": START + timedelta(seconds=index),
+        }
+        for index, command in enumerate(commands)
+    ])
+    yield terminal_history_collection
+    await terminal_history_collection.delete_many({})
+
+
+async def _search(**kwargs):
+    kwargs = {"prefix": None, "q": None, "limit": 50, "before": None, "dedup": True,
+              "include_output": False, **kwargs}
+    return await search_terminal_history(**kwargs)
+
+
+async def _pages(**kwargs):
+    """Segue i cursori fino all'ultima pagina"""
+    pages, before = [], None
+    while True:
+        page = await _search(before=before, **kwargs)
+        pages.append([entry.command for entry in page.entries])
+        if page.next_before is None:
+            return pages
+        before = page.next_before
+
+
+async def test_search_returns_newest_first_without_consecutive_duplicates(history):
+    page = await _search()
+    assert [entry.command for entry in page.entries] == [
+        "ls", "LS -la", "ls", "cat a.txt", "cd /docs", "ls"
+    ]
+    assert page.next_before is None
+    assert all(entry.output is None for entry in page.entries)
+
+
+async def test_single_entry_pages_skip_runs_of_duplicates(history):
+    pages = await _pages(limit=1)
+    assert [command for page in pages for command in page] == [
+        "ls", "LS -la", "ls", "cat a.txt", "cd /docs", "ls"
+    ]
+    # Una pagina vuota al massimo alla fine, quando l'ultima voce riempie il lotto
+    assert all(pages[:6])
+
+
+async def test_pages_without_dedup_return_every_entry(history):
+    pages = await _pages(limit=3, dedup=False)
+    assert [command for page in pages for command in page] == [
+        "ls", "LS -la", "ls", "cat a.txt", "cat a.txt", "cat a.txt", "cd /docs", "ls"
+    ]
+
+
+async def test_before_cursor_continues_after_the_given_entry(history):
+    first = await _search(limit=2)
+    assert [entry.command for entry in first.entries] == ["ls", "LS -la"]
+    assert first.next_before == first.entries[-1].id
+
+    second = await _search(limit=2, before=first.next_before)
+    assert [entry.command for entry in second.entries] == ["ls", "cat a.txt"]
+
+    # I duplicati dell'ultima voce della pagina precedente vengono saltati anche tra pagine
+    third = await _search(limit=1, before=second.next_before)
+    assert [entry.command for entry in third.entries] == ["cd /docs"]
+
+
+@pytest.mark.parametrize("before", ["not-an-id", "6ad6092381bdff2563dc19e4"])
+async def test_invalid_cursor_is_rejected(history, before):
+    with pytest.raises(HTTPException) as error:
+        await _search(before=before)
+    assert error.value.status_code == 400
+
+
+async def test_prefix_is_case_sensitive_and_q_is_not(history):
+    by_prefix = await _search(prefix="ls")
+    assert [entry.command for entry in by_prefix.entries] == ["ls"]
+
+    by_prefix = await _search(prefix="ls", dedup=False)
+    assert [entry.command for entry in by_prefix.entries] == ["ls", "ls", "ls"]
+
+    by_text = await _search(q="ls", dedup=False)
+    assert [entry.command for entry in by_text.entries] == ["ls", "LS -la", "ls", "ls"]
+
+    both = await _search(prefix="cat", q="A.TXT")
+    assert [entry.command for entry in both.entries] == ["cat a.txt"]
+
+
+async def test_include_output_adds_the_output(history):
+    page = await _search(limit=2, include_output=True)
+    assert [entry.output for entry in page.entries] == ["out 7", "out 6"]
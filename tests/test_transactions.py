@@ -0,0 +1,48 @@
+import pytest
+from pymongo.errors import OperationFailure, PyMongoError
+
+import transactions
+from transactions import _commit_with_retry
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeSession:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.commits = 0
+
+    async def commit_transaction(self):
+        self.commits += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def unknown_result():
+    return PyMongoError("esito incerto", error_labels=["UnknownTransactionCommitResult"])
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(transactions, "TRANSACTION_BACKOFF_SECONDS", 0)
+
+
+async def test_commit_is_retried_when_the_result_is_unknown():
+    session = FakeSession([unknown_result(), unknown_result()])
+    await _commit_with_retry(session)
+    assert session.commits == 3
+
+
+async def test_commit_retries_are_capped():
+    session = FakeSession([unknown_result() for _ in range(10)])
+    with pytest.raises(PyMongoError) as excinfo:
+        await _commit_with_retry(session, max_attempts=4)
+    assert excinfo.value.has_error_label("UnknownTransactionCommitResult")
+    assert session.commits == 4
+
+
+async def test_other_commit_errors_are_not_retried():
+    session = FakeSession([OperationFailure("scrittura in conflitto", code=112)])
+    with pytest.raises(OperationFailure):
+        await _commit_with_retry(session)
+    assert session.commits == 1
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import pytest
+
+from filesystem_ops import (
+    NodeExistsError, ParentNotFoundError, create_node, restore_node, trash_node
+)
+from jobs import purge_trash
+from listing_cache import get_listing
+from trash import IS_TRASHED, PURGING_FIELD, is_trashed
+
+pytestmark = pytest.mark.anyio
+
+
+class _Progress:
+    def __init__(self):
+        self.done = 0
+        self.total = None
+
+    async def update(self, done=None, total=None, message=None):
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+
+    async def advance(self, count, message=None):
+        self.done += count
+
+
+@pytest.fixture
+async def docs(filesystem, create_nodes):
+    await create_nodes(folders=["/docs", "/docs/sub"], files=["/docs/a.txt", "/docs/sub/b.txt"])
+    return filesystem
+
+
+async def _names(path):
+    return sorted(item["name"] for item in (await get_listing(path)).items)
+
+
+async def test_trash_hides_the_subtree_and_restore_brings_it_back(docs):
+    assert await trash_node("/docs")
+    assert await is_trashed("/docs/sub/b.txt")
+    assert await _names("/") == []
+    assert await _names("/docs/sub") == []
+    # Solo la radice viene scritta
+    assert await docs.count_documents(IS_TRASHED) == 1
+    assert not await trash_node("/docs/a.txt")
+
+    assert await restore_node("/docs")
+    assert not await is_trashed("/docs/sub/b.txt")
+    assert await _names("/docs") == ["a.txt", "sub"]
+    assert not await restore_node("/docs")
+
+
+async def test_restore_requires_the_original_parent(docs):
+    await trash_node("/docs/sub")
+    await trash_node("/docs")
+    with pytest.raises(ParentNotFoundError):
+        await restore_node("/docs/sub")
+    await restore_node("/docs")
+    assert await restore_node("/docs/sub")
+
+
+async def test_create_over_a_trashed_root_keeps_the_old_subtree_in_the_trash(docs, make_node):
+    await trash_node("/docs")
+    old = await docs.find_one({"path": "/docs"})
+
+    await create_node(make_node("/docs", "folder"))
+    assert await _names("/docs") == []
+    assert not await is_trashed("/docs")
+
+    moved = f"/docs~{old['_id']}"
+    root = await docs.find_one({"_id": old["_id"]})
+    assert (root["path"], root["name"]) == (moved, f"docs~{old['_id']}")
+    assert await docs.count_documents({"path": {"$regex": "^/docs/"}}) == 0
+    assert await restore_node(moved)
+    assert await _names(moved) == ["a.txt", "sub"]
+    assert (await docs.find_one({"path": f"{moved}/sub/b.txt"}))["parent_path"] == f"{moved}/sub"
+
+
+async def test_create_waits_for_a_running_purge(docs, make_node):
+    await trash_node("/docs")
+    await docs.update_one({"path": "/docs"}, {"$set": {PURGING_FIELD: datetime.utcnow()}})
+    with pytest.raises(NodeExistsError):
+        await create_node(make_node("/docs", "folder"))
+
+
+async def test_purge_deletes_only_the_selected_roots(docs, create_nodes):
+    await create_nodes(files=["/keep.txt"])
+    await trash_node("/keep.txt")
+    await trash_node("/docs")
+
+    progress = _Progress()
+    result = await purge_trash({"paths": ["/docs"]}, progress)
+    assert result == {"purged": 4}
+    assert progress.done == progress.total == 4
+    assert await docs.count_documents({"path": {"$regex": "^/docs"}}) == 0
+    assert not await restore_node("/docs")
+
+    assert (await purge_trash({}, _Progress())) == {"purged": 1}
+    assert await docs.count_documents({}) == 1
@@ -0,0 +1,50 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from versioning import conflict, document_etag, expected_condition, if_match_version, matches_expected
+
+DOCUMENT = {"_id": ObjectId("6ad6092381bdff2563dc19e4"), "version": 3}
+
+
+class _Request:
+    def __init__(self, if_match=None):
+        self.headers = {} if if_match is None else {"if-match": if_match}
+
+
+@pytest.mark.parametrize("header", [
+    document_etag(DOCUMENT),
+    'W/"3-6ad6092381bdff2563dc19e4"',
+    '"3-6ad6092381bdff2563dc19e4-f6ae99955"',
+    '"3-6ad6092381bdff2563dc19e4-gzip"',
+])
+def test_if_match_accepts_the_document_etag(header):
+    expected = if_match_version(_Request(header))
+    assert (expected.version, expected.document_id) == (3, "6ad6092381bdff2563dc19e4")
+    assert expected_condition(expected) == {"version": 3, "_id": DOCUMENT["_id"]}
+    assert matches_expected(DOCUMENT, expected)
+    assert not matches_expected({**DOCUMENT, "_id": ObjectId()}, expected)
+
+
+def test_if_match_accepts_a_bare_version():
+    expected = if_match_version(_Request('"0"'))
+    assert expected.document_id is None
+    assert expected_condition(expected) == {"version": {"$in": [0, None]}}
+    assert matches_expected({"_id": "x"}, expected)
+
+
+@pytest.mark.parametrize("header, expected", [(None, None), ("*", None)])
+def test_if_match_absent_or_any(header, expected):
+    assert if_match_version(_Request(header)) is expected
+
+
+def test_if_match_rejects_other_tags():
+    with pytest.raises(HTTPException) as error:
+        if_match_version(_Request('"d41d8cd98f00b204e9800998ecf8427e"'))
+    assert error.value.status_code == 400
+
+
+def test_conflict_reports_the_current_etag():
+    error = conflict(DOCUMENT)
+    assert error.status_code == 409
+    assert error.headers == {"ETag": '"3-6ad6092381bdff2563dc19e4"'}